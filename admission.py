@@ -0,0 +1,235 @@
+"""
+Admission control for CommandPro ML
+
+Limits how many model generations run at once across every CommandPro
+process of the current user. Each generation holds an exclusive lock on one
+of ADMISSION_CONFIG["slots"] lock files; the operating system releases
+it if the process dies. Requests that have to wait leave a marker file
+in a shared queue directory, so waiters are served in order with
+interactive requests ahead of batch ones. When too many requests are
+already ahead, or the wait exceeds the priority's limit, the request is
+shed and the caller answers with the rule-based analyzer instead.
+"""
+
+import getpass
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from ml_config import ADMISSION_CONFIG
+import metrics
+
+try:
+    import fcntl
+    # flock() needs no write access
+    _OPEN_FLAGS = os.O_RDONLY | os.O_CREAT
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+    _OPEN_FLAGS = os.O_RDWR | os.O_CREAT
+
+# Lower rank is served first
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+
+class Admission(NamedTuple):
+    """Outcome of waiting for a generation slot"""
+    admitted: bool
+    wait_s: float
+    queue_depth: int
+    reason: Optional[str] = None
+
+
+def default_lock_dir() -> str:
+    """
+    Per-user directory for the slot locks and queue markers
+
+    Not shared between users: anyone able to write a shared directory could
+    hold every slot and push all other users onto rule-based answers.
+    """
+    user = os.getuid() if hasattr(os, "getuid") else getpass.getuser()
+    return os.path.join(tempfile.gettempdir(), f"cmdpro-admission-{user}")
+
+
+class AdmissionController:
+    """Cross-process semaphore with a priority queue in front of it"""
+
+    def __init__(
+        self,
+        slots: Optional[int] = None,
+        lock_dir: Optional[str] = None,
+        max_queue: Optional[int] = None
+    ):
+        """
+        Initialize the controller
+
+        Args:
+            slots: Generations allowed at once (default ADMISSION_CONFIG)
+            lock_dir: Directory shared by every process (default ADMISSION_CONFIG,
+                      or a per-user directory in the system temp dir)
+            max_queue: Requests ahead of a new one before it is shed
+        """
+        self.slots = slots or ADMISSION_CONFIG.get("slots", 1)
+        lock_dir = lock_dir or ADMISSION_CONFIG.get("lock_dir")
+        self.lock_dir = os.path.expanduser(lock_dir or default_lock_dir())
+        self.queue_dir = os.path.join(self.lock_dir, "queue")
+        self.max_queue = ADMISSION_CONFIG.get("max_queue", 4) if max_queue is None else max_queue
+        self.poll_interval = ADMISSION_CONFIG.get("poll_interval", 0.02)
+        os.makedirs(self.queue_dir, mode=0o700, exist_ok=True)
+        if not lock_dir and hasattr(os, "getuid") and os.stat(self.lock_dir).st_uid != os.getuid():
+            # Someone else created our directory in the shared temp dir
+            raise PermissionError(f"{self.lock_dir} is not owned by the current user")
+
+    @contextmanager
+    def admit(self, priority: str = "interactive") -> Iterator[Admission]:
+        """
+        Wait for a generation slot and hold it for the with-block
+
+        Args:
+            priority: "interactive" or "batch"
+
+        Yields:
+            Admission; when admitted is False the caller must not call the model.
+            If the lock directory cannot be used the request is admitted
+            without limiting (reason "lock_error") rather than failing.
+        """
+        rank = PRIORITIES[priority]
+        max_wait = ADMISSION_CONFIG.get("max_wait", {}).get(priority, 30.0)
+        key = (rank, time.time_ns())
+        start = time.monotonic()
+        marker = None
+        slot = None
+        depth = 0
+        try:
+            try:
+                depth = len(self._ahead(key))
+                reason = "queue_full" if depth >= self.max_queue else None
+                if reason is None:
+                    slot = self._try_slots() if depth == 0 else None
+                    if slot is None:
+                        marker = self._enqueue(key)
+                    while slot is None:
+                        if time.monotonic() - start >= max_wait:
+                            reason = "timeout"
+                            break
+                        time.sleep(self.poll_interval)
+                        if not self._ahead(key):
+                            slot = self._try_slots()
+                admitted = slot is not None
+            except OSError:
+                # An unusable lock directory must not fail the analysis itself
+                admitted, reason = True, "lock_error"
+            if marker:
+                self._remove(marker)
+                marker = None
+
+            admission = Admission(admitted, time.monotonic() - start, depth, reason)
+            metrics.ADMISSIONS.inc(priority=priority, outcome=reason or "admitted")
+            metrics.ADMISSION_WAIT.observe(admission.wait_s, priority=priority)
+            yield admission
+        finally:
+            if marker:
+                self._remove(marker)
+            if slot is not None:
+                _unlock(slot)
+                os.close(slot)
+
+    def queue_depth(self) -> int:
+        """Number of requests currently waiting for a slot"""
+        return len(self._waiters())
+
+    def _try_slots(self) -> Optional[int]:
+        """Lock a free slot file, returning its descriptor"""
+        for i in range(self.slots):
+            path = os.path.join(self.lock_dir, f"slot-{i}.lock")
+            fd = os.open(path, _OPEN_FLAGS, 0o666)
+            if _try_lock(fd):
+                return fd
+            os.close(fd)
+        return None
+
+    def _enqueue(self, key: Tuple[int, int]) -> str:
+        """Leave a marker so later requests queue behind this one"""
+        name = f"{key[0]}-{key[1]:020d}-{os.getpid()}-{threading.get_ident()}.wait"
+        path = os.path.join(self.queue_dir, name)
+        open(path, "w").close()
+        return path
+
+    def _ahead(self, key: Tuple[int, int]) -> List[Tuple[int, int]]:
+        """Waiters to be served before a request with this key"""
+        return [waiter for waiter in self._waiters() if waiter < key]
+
+    def _waiters(self) -> List[Tuple[int, int]]:
+        """(rank, timestamp) of every live waiter, dropping markers of dead processes"""
+        waiters = []
+        try:
+            names = os.listdir(self.queue_dir)
+        except OSError:
+            return waiters
+        for name in names:
+            try:
+                rank, stamp, pid, _ = name[:-len(".wait")].split("-")
+                key = (int(rank), int(stamp))
+            except ValueError:
+                continue
+            if not _pid_alive(int(pid)):
+                self._remove(os.path.join(self.queue_dir, name))
+                continue
+            waiters.append(key)
+        return waiters
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def open_admission() -> Optional[AdmissionController]:
+    """Create the configured controller, or None if disabled or the lock directory is unusable"""
+    if not ADMISSION_CONFIG.get("enabled", True):
+        return None
+    try:
+        return AdmissionController()
+    except OSError:
+        return None
+
+
+def _try_lock(fd: int) -> bool:
+    """Take an exclusive lock without blocking"""
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(fd: int):
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    except OSError:
+        pass
+
+
+def _pid_alive(pid: int) -> bool:
+    """Whether a process still exists (always assumed on Windows)"""
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
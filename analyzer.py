@@ -1,6 +1,153 @@
 """Error analyzer for parsing and matching error messages"""
 
-from knowledge_base import find_error_type
+import os
+import sys
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+)
+from typing import Any, Dict, NamedTuple, Optional
+
+import config
+from knowledge_base import (
+    ErrorType, MatchRegion, find_error_type_id, find_error_type_windowed, get_error_type,
+    iter_shards, match_text, worker_options
+)
+from instrumentation import StageTimer, log_timings
+
+NO_MATCH_SOLUTIONS = (
+    "Try searching online for this error message",
+    "Check the official documentation for the command",
+    "Verify your inputs and try with --help flag",
+)
+
+
+class AnalysisResult(NamedTuple):
+    """
+    Outcome of a rule-based analysis
+    
+    Immutable and tuple-sized: it carries the matched error-type ID and a
+    reference to the original message instead of copying knowledge-base
+    data, so batch callers can keep (and pickle) millions of results
+    cheaply. to_dict() gives the dictionary shape returned by
+    ErrorAnalyzer.analyze.
+    """
+    success: bool
+    type_id: Optional[int] = None
+    original_message: Optional[str] = None
+    error: Optional[str] = None
+    timings: Optional[Dict[str, Any]] = None
+    region: Optional[MatchRegion] = None
+    
+    @property
+    def entry(self) -> Optional[ErrorType]:
+        return get_error_type(self.type_id) if self.type_id is not None else None
+    
+    @property
+    def error_type(self) -> Optional[str]:
+        return self.entry.name if self.type_id is not None else None
+    
+    @property
+    def solutions(self):
+        if self.type_id is not None:
+            return self.entry.solutions
+        return NO_MATCH_SOLUTIONS if self.original_message is not None else ()
+    
+    @property
+    def examples(self):
+        return self.entry.examples if self.type_id is not None else ()
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the result as a dictionary"""
+        if self.type_id is not None:
+            entry = self.entry
+            result = {
+                "success": True,
+                "error_type": entry.name,
+                "solutions": list(entry.solutions),
+                "examples": list(entry.examples),
+                "original_message": self.original_message
+            }
+            if self.region is not None:
+                result["match_region"] = self.region._asdict()
+        else:
+            result = {
+                "success": False,
+                "error": self.error,
+                "error_type": None,
+                "solutions": list(self.solutions)
+            }
+            if self.original_message is not None:
+                result["original_message"] = self.original_message
+        if self.timings is not None:
+            result["timings"] = self.timings
+        return result
+
+
+def _gil_disabled() -> bool:
+    """Check for a free-threaded build running without the GIL"""
+    is_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_enabled is not None and not is_enabled()
+
+
+def match_parallel(
+    error_message: str,
+    jobs: Optional[int] = config.MATCH_JOBS,
+    shard_size: int = config.MATCH_SHARD_SIZE
+) -> Optional[int]:
+    """
+    Match a very large message across worker processes
+    
+    The message is cut into line-aligned shards that are lowercased and
+    matched by the workers, with at most two shards per worker in flight so
+    the input is never copied whole. Threads are used instead of processes
+    on free-threaded builds, where they run in parallel without pickling.
+    
+    Args:
+        error_message: The error output
+        jobs: Workers to use (None = one per CPU)
+        shard_size: Approximate characters per shard
+        
+    Returns:
+        The lowest matching error-type ID, as find_error_type_id would return
+    """
+    jobs = jobs or os.cpu_count() or 1
+    if _gil_disabled():
+        executor = ThreadPoolExecutor(max_workers=jobs)
+    else:
+        # Spawned workers need the parent's pattern packs to return the same IDs
+        executor = ProcessPoolExecutor(max_workers=jobs, **worker_options())
+    best = None
+    
+    with executor:
+        pending = set()
+        shards = iter_shards(error_message, shard_size)
+        for shard in shards:
+            pending.add(executor.submit(match_text, shard))
+            if len(pending) < jobs * 2:
+                continue
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            best = _lowest(best, done)
+            if best == 0:
+                break
+        for future in pending:
+            if best == 0:
+                future.cancel()
+        if best != 0:
+            best = _lowest(best, wait(pending).done)
+    
+    return best
+
+
+def _lowest(best: Optional[int], futures) -> Optional[int]:
+    """Merge finished shard results, keeping the lowest type ID"""
+    for future in futures:
+        if future.cancelled():
+            continue
+        found = future.result()
+        if found is not None and (best is None or found < best):
+            best = found
+    return best
 
 
 class ErrorAnalyzer:
@@ -13,37 +160,42 @@ class ErrorAnalyzer:
         
         Args:
             error_message: The error message to analyze
-            
+        
         Returns:
             Dictionary with analysis results
         """
-        if not error_message or not error_message.strip():
-            return {
-                "success": False,
-                "error": "Empty error message provided",
-                "error_type": None,
-                "solutions": []
-            }
+        return ErrorAnalyzer.classify(error_message).to_dict()
+    
+    @staticmethod
+    def classify(error_message: str) -> AnalysisResult:
+        """
+        Analyze an error message without building a result dictionary
+        
+        Args:
+            error_message: The error message to analyze
         
-        error_type = find_error_type(error_message)
+        Returns:
+            AnalysisResult carrying the matched error-type ID
+        """
+        if not error_message or not error_message.strip():
+            return AnalysisResult(False, error="Empty error message provided")
         
-        if error_type:
-            return {
-                "success": True,
-                "error_type": error_type["name"],
-                "solutions": error_type.get("solutions", []),
-                "examples": error_type.get("examples", []),
-                "original_message": error_message
-            }
+        timer = StageTimer()
+        start = time.perf_counter()
+        if len(error_message) >= config.MATCH_PARALLEL_MIN_SIZE:
+            full_match = match_parallel
         else:
-            return {
-                "success": False,
-                "error": "Could not identify error type",
-                "error_type": None,
-                "original_message": error_message,
-                "solutions": [
-                    "Try searching online for this error message",
-                    "Check the official documentation for the command",
-                    "Verify your inputs and try with --help flag",
-                ]
-            }
+            full_match = find_error_type_id
+        type_id, region = find_error_type_windowed(error_message, full_match)
+        timer.since("match", start)
+        
+        timings = None
+        if timer.enabled:
+            timer.set("input_bytes", len(error_message))
+            timer.set("match_region", region.name)
+            timings = timer.as_dict()
+            log_timings("analyzer", timings)
+        
+        if type_id is not None:
+            return AnalysisResult(True, type_id, error_message, timings=timings, region=region)
+        return AnalysisResult(False, None, error_message, "Could not identify error type", timings)
@@ -0,0 +1,203 @@
+"""
+Batch mode for CommandPro ML
+
+Runs many commands concurrently with CommandWrapper and sends their
+failures through a bounded pool of analysis workers. Failures with the same
+fingerprint are analyzed once and the answer is shared, so a matrix of
+commands that all break the same way costs one model call.
+
+Usage:
+    python ml_cli.py --batch commands.txt --jobs 8
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional
+
+from history import fingerprint
+from ml_config import BATCH_CONFIG
+from stream_processor import CommandWrapper
+
+
+def load_commands(path: str) -> List[str]:
+    """Read one command per line, skipping blank lines and # comments"""
+    with open(path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+class BatchRunner:
+    """Runs commands in parallel and triages their failures"""
+
+    def __init__(
+        self,
+        processor_factory: Callable[[], Any],
+        jobs: Optional[int] = None,
+        analysis_workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        on_result: Optional[Callable[[Dict[str, Any]], None]] = None
+    ):
+        """
+        Initialize the runner
+
+        Args:
+            processor_factory: Creates one MLErrorProcessor per analysis worker,
+                               since a processor keeps per-request state
+            jobs: Commands run at once (default BATCH_CONFIG, None = one per CPU)
+            analysis_workers: Concurrent analyses (default BATCH_CONFIG)
+            queue_size: Failures waiting for analysis before runners block
+            on_result: Called with each command's entry once it is complete
+        """
+        self.processor_factory = processor_factory
+        self.jobs = jobs or BATCH_CONFIG.get("jobs") or os.cpu_count() or 1
+        self.analysis_workers = analysis_workers or BATCH_CONFIG.get("analysis_workers", 2)
+        self.queue = queue.Queue(maxsize=queue_size or BATCH_CONFIG.get("queue_size", 32))
+        self.on_result = on_result
+        self.lock = threading.Lock()
+        self.groups: Dict[str, Dict[str, Any]] = {}
+
+    def run(self, commands: List[str]) -> Dict[str, Any]:
+        """
+        Run every command and analyze the failures
+
+        Args:
+            commands: Commands to run through the shell
+
+        Returns:
+            Report with one entry per command, in input order, and a summary
+        """
+        start = time.perf_counter()
+        entries = [{"index": i, "command": command} for i, command in enumerate(commands)]
+
+        workers = [threading.Thread(target=self._analysis_worker, daemon=True)
+                   for _ in range(self.analysis_workers)]
+        for worker in workers:
+            worker.start()
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [executor.submit(self._run_one, entry) for entry in entries]
+            for future in as_completed(futures):
+                future.result()
+
+        for _ in workers:
+            self.queue.put(None)
+        for worker in workers:
+            worker.join()
+
+        failed = [entry for entry in entries if entry["returncode"] != 0]
+        summary = {
+            "commands": len(entries),
+            "passed": len(entries) - len(failed),
+            "failed": len(failed),
+            "unique_errors": len(self.groups),
+            "analyses": sum(1 for group in self.groups.values() if group["analysis"]),
+            "elapsed_s": time.perf_counter() - start,
+        }
+        return {"results": entries, "summary": summary}
+
+    def _run_one(self, entry: Dict[str, Any]):
+        """Run one command and queue its failure for analysis"""
+        start = time.perf_counter()
+        result = CommandWrapper.run_with_capture(entry["command"], shell=True)
+        entry["returncode"] = result["returncode"]
+        entry["run_ms"] = (time.perf_counter() - start) * 1000
+        entry["analysis"] = None
+
+        if result["success"] or not result["stderr"]:
+            self._complete(entry)
+            return
+
+        fp = fingerprint(result["stderr"])
+        with self.lock:
+            group = self.groups.get(fp)
+            first = group is None
+            if first:
+                group = self.groups[fp] = {"entries": [], "analysis": None, "done": False}
+            if group["done"]:
+                entry["analysis"] = group["analysis"]
+                entry["duplicate_of"] = group["entries"][0]["index"]
+            group["entries"].append(entry)
+
+        if first:
+            # Blocks when the analysis queue is full, throttling the runners
+            self.queue.put((fp, result["stderr"], entry["command"], entry["returncode"]))
+        elif entry["analysis"] is not None:
+            self._complete(entry)
+
+    def _analysis_worker(self):
+        """
+        Analyze queued failures with this worker's own processor
+
+        Errors are recorded per failure and the worker keeps consuming, so
+        runners blocked on a full queue always make progress.
+        """
+        processor = setup_error = None
+        try:
+            processor = self.processor_factory()
+        except Exception as e:
+            setup_error = e
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            fp, stderr, command, returncode = item
+            try:
+                if processor is None:
+                    raise setup_error
+                analysis = processor.process_error(stderr, command_context=command,
+                                                   returncode=returncode)
+            except Exception as e:
+                analysis = {"success": False, "method": None, "error_type": None,
+                            "suggestions": [], "error": str(e)}
+            try:
+                self._record_analysis(fp, analysis)
+            except Exception:
+                # e.g. a failing on_result callback; the queue must still drain
+                pass
+
+    def _record_analysis(self, fp: str, analysis: Dict[str, Any]):
+        """Attach an analysis to every command that failed with this fingerprint"""
+        with self.lock:
+            group = self.groups[fp]
+            group["analysis"] = analysis
+            group["done"] = True
+            waiting = list(group["entries"])
+        first_index = waiting[0]["index"]
+        for entry in waiting:
+            entry["analysis"] = analysis
+            if entry["index"] != first_index:
+                entry["duplicate_of"] = first_index
+            self._complete(entry)
+
+    def _complete(self, entry: Dict[str, Any]):
+        if self.on_result:
+            with self.lock:
+                self.on_result(entry)
+
+
+def format_batch_report(report: Dict[str, Any]) -> str:
+    """Format a batch report for console output"""
+    output = []
+    for entry in report["results"]:
+        if entry["returncode"] == 0:
+            output.append(f"✓ [{entry['index']}] {entry['command']} ({entry['run_ms']:.0f} ms)")
+            continue
+        output.append(f"✗ [{entry['index']}] {entry['command']} "
+                      f"(exit {entry['returncode']}, {entry['run_ms']:.0f} ms)")
+        analysis = entry.get("analysis")
+        if "duplicate_of" in entry:
+            output.append(f"    Same error as [{entry['duplicate_of']}]")
+        elif analysis and analysis.get("success") and analysis.get("suggestions"):
+            label = analysis.get("error_type") or analysis.get("method")
+            first_line = analysis["suggestions"][0].strip().splitlines()[0]
+            output.append(f"    {label}: {first_line}")
+
+    summary = report["summary"]
+    output.append(
+        f"\n{summary['passed']}/{summary['commands']} passed, {summary['failed']} failed, "
+        f"{summary['unique_errors']} unique error(s) in {summary['elapsed_s']:.1f}s"
+    )
+    return "\n".join(output)
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for CommandPro
+
+Measures matcher throughput, analyzer latency, stream processing speed and
+the end-to-end ML path against a local fake Ollama server. Results are
+written as JSON so runs from different versions can be compared.
+
+Set CMDPRO_BENCH_OLLAMA to a server URL to run the prefix_reuse benchmark
+against a real Ollama instead of the fake one.
+
+Usage:
+    python benchmarks.py --output bench_results.json
+    python benchmarks.py --quick --compare bench_results.json
+    CMDPRO_BENCH_OLLAMA=http://localhost:11434 python benchmarks.py --only prefix_reuse
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+from contextlib import redirect_stdout
+from typing import Any, Callable, Dict, List
+
+from analyzer import ErrorAnalyzer
+from knowledge_base import find_error_type, find_error_type_id
+from ml_config import PROMPT_SETTINGS
+
+BENCH_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_data")
+
+NOISE_LINES = [
+    "INFO  Starting build step 4/12",
+    "DEBUG resolved 142 dependencies in 0.8s",
+    "[2024-01-01 12:00:00] GET /health 200 1ms",
+    "Compiling src/module_a.c",
+    "  warning: unused variable 'tmp'",
+    "Downloading https://example.com/pkg-1.2.3.tar.gz (12.1 MB)",
+    "test_util.py::test_parse PASSED",
+]
+
+# Metric name suffixes and whether a larger value is better
+METRIC_DIRECTIONS = {
+    "_per_s": True,
+    "_mb_s": True,
+    "_us": False,
+    "_ms": False,
+    "_bytes": False,
+}
+
+
+def load_recorded_errors() -> List[str]:
+    """Load the recorded corpus of real-world error messages"""
+    with open(os.path.join(BENCH_DATA, "recorded_errors.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def synthetic_message(size: int, error: str, rng: random.Random) -> str:
+    """Build a stderr-like message of about `size` bytes ending in an error"""
+    lines, total = [], 0
+    while total < size - len(error):
+        line = rng.choice(NOISE_LINES)
+        lines.append(line)
+        total += len(line) + 1
+    lines.append(error)
+    return "\n".join(lines)
+
+
+def percentiles(samples: List[float], prefix: str, unit: str) -> Dict[str, float]:
+    """Summarize latency samples as p50/p90/p99/max"""
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        f"{prefix}p50_{unit}": pick(0.50),
+        f"{prefix}p90_{unit}": pick(0.90),
+        f"{prefix}p99_{unit}": pick(0.99),
+        f"{prefix}max_{unit}": ordered[-1],
+    }
+
+
+def bench_matcher(quick: bool) -> Dict[str, Any]:
+    """Throughput of find_error_type on short recorded and noise messages"""
+    messages = load_recorded_errors() + NOISE_LINES
+    rounds = 200 if quick else 2000
+    total_bytes = sum(len(m) for m in messages) * rounds
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for message in messages:
+            find_error_type(message)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "messages": len(messages) * rounds,
+        "messages_per_s": len(messages) * rounds / elapsed,
+        "throughput_mb_s": total_bytes / elapsed / 1e6,
+    }
+
+
+def bench_analyzer(quick: bool) -> Dict[str, Any]:
+    """Latency percentiles of ErrorAnalyzer.analyze by input size"""
+    rng = random.Random(42)
+    recorded = load_recorded_errors()
+    results: Dict[str, Any] = {}
+
+    for label, size, count in [("small", 200, 2000), ("medium", 64 * 1024, 200),
+                               ("large", 1024 * 1024, 20)]:
+        count = max(5, count // 10) if quick else count
+        messages = [synthetic_message(size, rng.choice(recorded), rng) for _ in range(10)]
+        samples = []
+        for i in range(count):
+            start = time.perf_counter()
+            ErrorAnalyzer.analyze(messages[i % len(messages)])
+            samples.append((time.perf_counter() - start) * 1e6)
+        results.update(percentiles(samples, f"{label}_", "us"))
+
+    # Batch callers use classify() and skip building the result dict
+    messages = [rng.choice(recorded) for _ in range(100)]
+    rounds = 20 if quick else 200
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for message in messages:
+            ErrorAnalyzer.classify(message)
+    results["classify_per_s"] = rounds * len(messages) / (time.perf_counter() - start)
+    return results
+
+
+# Runs in a fresh interpreter so ru_maxrss is not the high-water mark of
+# earlier benchmarks; fills in SIZE_MB and LINE
+STREAM_SCRIPT = """
+import json, subprocess, sys, time
+from stream_processor import StreamProcessor
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+writer = (
+    "import sys\\n"
+    "block = %r * (1024 * 1024 // %d)\\n"
+    "for _ in range(%d):\\n"
+    "    sys.stderr.buffer.write(block)\\n"
+) % (LINE, len(LINE), SIZE_MB)
+chunks = [0]
+processor = StreamProcessor(on_chunk=lambda chunk: chunks.__setitem__(0, chunks[0] + 1))
+
+start = time.perf_counter()
+process = subprocess.Popen([sys.executable, "-c", writer], stderr=subprocess.PIPE)
+output = processor.process_stderr(process)
+process.wait()
+elapsed = time.perf_counter() - start
+
+peak = None
+if resource:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    peak *= 1 if sys.platform == "darwin" else 1024
+print(json.dumps({
+    "input_bytes": len(output),
+    "throughput_mb_s": len(output) / elapsed / 1e6,
+    "chunks": chunks[0],
+    "peak_rss_bytes": peak,
+}))
+"""
+
+
+def bench_stream_processor(quick: bool) -> Dict[str, Any]:
+    """StreamProcessor MB/s and peak resident memory on a large stderr stream"""
+    size_mb = 8 if quick else 64
+    line = (NOISE_LINES[0] + "\n").encode()
+    script = f"SIZE_MB = {size_mb}\nLINE = {line!r}\n" + STREAM_SCRIPT
+    output = subprocess.run([sys.executable, "-c", script], stdout=subprocess.PIPE, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return json.loads(output)
+
+
+def bench_large_input(quick: bool) -> Dict[str, Any]:
+    """Sharded and process-pool matching of one huge stderr payload"""
+    from analyzer import match_parallel
+
+    rng = random.Random(11)
+    size_mb = 32 if quick else 256
+    message = synthetic_message(size_mb * 1024 * 1024, rng.choice(load_recorded_errors()), rng)
+
+    start = time.perf_counter()
+    sequential = find_error_type_id(message)
+    sequential_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parallel = match_parallel(message)
+    parallel_s = time.perf_counter() - start
+
+    return {
+        "input_bytes": len(message),
+        "jobs": os.cpu_count(),
+        "results_agree": sequential == parallel,
+        "sequential_mb_s": len(message) / sequential_s / 1e6,
+        "parallel_mb_s": len(message) / parallel_s / 1e6,
+    }
+
+
+def bench_scanner(quick: bool) -> Dict[str, Any]:
+    """Throughput of the bulk log scanner on a synthetic log file"""
+    import tempfile
+    from scanner import scan_file
+
+    rng = random.Random(7)
+    recorded = [e.splitlines()[-1] for e in load_recorded_errors()]
+    size_mb = 8 if quick else 64
+
+    with tempfile.NamedTemporaryFile("w", suffix=".log", delete=False) as f:
+        path = f.name
+        for _ in range(size_mb):
+            f.write(synthetic_message(1024 * 1024, rng.choice(recorded), rng) + "\n")
+    try:
+        start = time.perf_counter()
+        result = scan_file(path)
+        elapsed = time.perf_counter() - start
+    finally:
+        os.unlink(path)
+
+    return {
+        "records": result["records"],
+        "throughput_mb_s": result["bytes"] / elapsed / 1e6,
+        "records_per_s": result["records"] / elapsed,
+    }
+
+
+def bench_ml_path(quick: bool) -> Dict[str, Any]:
+    """End-to-end ml_cli latency against a local fake Ollama server"""
+    from fake_ollama import FakeOllamaServer
+    from ml_config import HISTORY_CONFIG, OLLAMA_CONFIG
+    import ml_cli
+
+    runs = 5 if quick else 30
+    recorded = load_recorded_errors()
+    command = f'"{sys.executable}" -c "import sys; sys.stderr.write(\'No module named x\'); sys.exit(1)"'
+    original_url = OLLAMA_CONFIG["base_url"]
+    original_history = HISTORY_CONFIG["enabled"]
+
+    with FakeOllamaServer(tokens_per_s=1000) as server:
+        OLLAMA_CONFIG["base_url"] = server.base_url
+        # Measure the model path, not answers replayed from history, and leave
+        # the user's history database untouched
+        HISTORY_CONFIG["enabled"] = False
+        try:
+            processor = ml_cli.MLErrorProcessor()
+            analysis_ms = []
+            methods = set()
+            for i in range(runs):
+                start = time.perf_counter()
+                result = processor.process_error(recorded[i % len(recorded)], "bench")
+                analysis_ms.append((time.perf_counter() - start) * 1000)
+                methods.add(result["method"])
+            if methods != {"ML"}:
+                # Timing a rule-based fallback would not measure the model path at all
+                raise RuntimeError(f"ml_path benchmark answered by {sorted(map(str, methods))}, not ML")
+
+            cli = ml_cli.EnhancedCLI(output_format="json")
+            command_ms = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                with redirect_stdout(io.StringIO()):
+                    cli.run_command_with_analysis(command)
+                command_ms.append((time.perf_counter() - start) * 1000)
+        finally:
+            OLLAMA_CONFIG["base_url"] = original_url
+            HISTORY_CONFIG["enabled"] = original_history
+
+    results = percentiles(analysis_ms, "process_error_", "ms")
+    results.update(percentiles(command_ms, "run_command_", "ms"))
+    return results
+
+
+def bench_prefix_reuse(quick: bool) -> Dict[str, Any]:
+    """Prefill time with and without reusing the system-prompt context"""
+    from fake_ollama import FakeOllamaServer
+    from ml_config import OLLAMA_CONFIG
+    from ollama_client import OllamaClient
+
+    runs = 3 if quick else 10
+    recorded = load_recorded_errors()
+    real_url = os.environ.get("CMDPRO_BENCH_OLLAMA")
+    # About 200 prompt tokens/s, a small model's prefill rate on a laptop CPU
+    server = None if real_url else FakeOllamaServer(
+        response="Fix: pip install requests", prefill_tokens_per_s=200, tokens_per_s=1000
+    ).start()
+    base_url = real_url or server.base_url
+
+    results: Dict[str, Any] = {"server": "ollama" if real_url else "fake"}
+    try:
+        for mode, reuse in (("full", False), ("reused", True)):
+            OllamaClient._prefix_contexts.clear()
+            client = OllamaClient(dict(OLLAMA_CONFIG, base_url=base_url, reuse_prefix=reuse))
+            client.prefix_context(PROMPT_SETTINGS.get("system_prompt", ""))
+            prefill_ms, tokens, total_ms = [], [], []
+            for i in range(runs):
+                start = time.perf_counter()
+                client.analyze_error(recorded[i % len(recorded)], "bench")
+                total_ms.append((time.perf_counter() - start) * 1000)
+                prefill_ms.append(client.last_stats.get("prompt_eval_duration", 0) / 1e6)
+                tokens.append(client.last_stats.get("prompt_eval_count", 0))
+            results[f"prefill_{mode}_ms"] = sum(prefill_ms) / runs
+            results[f"prompt_tokens_{mode}"] = sum(tokens) / runs
+            results[f"request_{mode}_ms"] = sum(total_ms) / runs
+    finally:
+        OllamaClient._prefix_contexts.clear()
+        if server:
+            server.stop()
+
+    results["prefill_saved_pct"] = 100 * (1 - results["prefill_reused_ms"]
+                                          / max(results["prefill_full_ms"], 1e-9))
+    return results
+
+
+BENCHMARKS: Dict[str, Callable[[bool], Dict[str, Any]]] = {
+    "matcher": bench_matcher,
+    "analyzer": bench_analyzer,
+    "stream_processor": bench_stream_processor,
+    "large_input": bench_large_input,
+    "scanner": bench_scanner,
+    "ml_path": bench_ml_path,
+    "prefix_reuse": bench_prefix_reuse,
+}
+
+
+def read_version() -> str:
+    """Read the package version without importing the package"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__init__.py")
+    with open(path, encoding="utf-8") as f:
+        match = re.search(r'__version__ = "([^"]+)"', f.read())
+    return match.group(1) if match else "unknown"
+
+
+def run_benchmarks(names: List[str], quick: bool = False) -> Dict[str, Any]:
+    """Run the selected benchmarks and collect their results"""
+    report = {
+        "version": read_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "quick": quick,
+        "results": {},
+    }
+    for name in names:
+        print(f"Running {name}...", file=sys.stderr)
+        report["results"][name] = BENCHMARKS[name](quick)
+    return report
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Compare two benchmark reports
+
+    Args:
+        baseline: Earlier report
+        current: New report
+        threshold: Allowed relative slowdown (0.1 = 10%)
+
+    Returns:
+        Human-readable descriptions of regressions
+    """
+    regressions = []
+    for bench, metrics in current["results"].items():
+        for metric, value in metrics.items():
+            old = baseline.get("results", {}).get(bench, {}).get(metric)
+            direction = next((up for suffix, up in METRIC_DIRECTIONS.items()
+                              if metric.endswith(suffix)), None)
+            if direction is None or not old:
+                continue
+            change = (value - old) / old
+            if (direction and change < -threshold) or (not direction and change > threshold):
+                regressions.append(f"{bench}.{metric}: {old:.4g} -> {value:.4g} ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None) -> int:
+    """Benchmark entry point"""
+    parser = argparse.ArgumentParser(description="CommandPro benchmark suite")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS),
+                        help="Benchmarks to run (default: all)")
+    parser.add_argument("--quick", action="store_true", help="Smaller inputs for a fast smoke run")
+    parser.add_argument("--output", help="Write results JSON to this file")
+    parser.add_argument("--compare", help="Baseline results JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Allowed relative regression (default: 0.1)")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.only or list(BENCHMARKS), args.quick)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        for line in regressions:
+            print(f"✗ Regression: {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
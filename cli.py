@@ -1,7 +1,11 @@
 """Command line interface for the error helper"""
 
+import argparse
 import sys
+import time
 from analyzer import ErrorAnalyzer
+from knowledge_base import load_configured_packs
+from output import OUTPUT_FORMATS, EventWriter, write_json
 
 
 def format_solutions(solutions):
@@ -39,14 +43,83 @@ def print_result(result):
         print()
 
 
-def main():
+def analyze_with_timing(error_message):
+    """Analyze an error message and attach machine-readable metadata"""
+    start = time.perf_counter()
+    result = ErrorAnalyzer.analyze(error_message)
+    result["method"] = "Rule-Based"
+    result["cache_hit"] = False
+    result.setdefault("timings", {})["analysis_ms"] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def emit_result(result, output_format):
+    """Emit an analysis result in the requested output format"""
+    if output_format == "json":
+        write_json(result)
+    elif output_format == "ndjson":
+        writer = EventWriter()
+        writer.emit("classification", error_type=result.get("error_type"),
+                    success=result["success"])
+        # Same shape as ml_cli.py's final event
+        writer.emit("final", analysis=result)
+    else:
+        print_result(result)
+
+
+def build_parser():
+    """Build the command line argument parser"""
+    parser = argparse.ArgumentParser(
+        prog="cmdpro",
+        description="Analyze a command line error message and suggest fixes"
+    )
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="text",
+        help="Output format (default: text)"
+    )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="Classify stdin line by line as it arrives (for shell pipelines)"
+    )
+    parser.add_argument(
+        "--tee",
+        action="store_true",
+        help="With --follow, pass input through to stdout and report on stderr"
+    )
+    parser.add_argument(
+        "message",
+        nargs=argparse.REMAINDER,
+        help="Error message to analyze (omit for interactive mode)"
+    )
+    return parser
+
+
+def main(argv=None):
     """Main CLI entry point"""
-    if len(sys.argv) < 2:
+    argv = sys.argv[1:] if argv is None else argv
+    load_configured_packs()
+    if argv and argv[0] == "scan":
+        import scanner
+        return scanner.main(argv[1:])
+    
+    args = build_parser().parse_args(argv)
+    interactive = args.format == "text"
+    
+    if args.follow:
+        import follow
+        follow.follow(sys.stdin.buffer, args.format, tee=args.tee)
+        return 0
+    
+    if not args.message:
         # Interactive mode
-        print("=" * 60)
-        print("CommandPro - Error Helper")
-        print("=" * 60)
-        print("\nPaste your error message (press Enter twice to submit):\n")
+        if interactive:
+            print("=" * 60)
+            print("CommandPro - Error Helper")
+            print("=" * 60)
+            print("\nPaste your error message (press Enter twice to submit):\n")
         
         lines = []
         empty_lines = 0
@@ -68,16 +141,17 @@ def main():
         error_message = "\n".join(lines).strip()
         
         if error_message:
-            result = ErrorAnalyzer.analyze(error_message)
-            print_result(result)
-        else:
+            emit_result(analyze_with_timing(error_message), args.format)
+        elif interactive:
             print("No error message provided.")
+        else:
+            emit_result(ErrorAnalyzer.analyze(""), args.format)
     else:
-        # Argument mode
-        error_message = " ".join(sys.argv[1:])
-        result = ErrorAnalyzer.analyze(error_message)
-        print_result(result)
+        # Argument mode; REMAINDER keeps the "--" that ends option parsing
+        words = args.message[1:] if args.message[0] == "--" else args.message
+        error_message = " ".join(words)
+        emit_result(analyze_with_timing(error_message), args.format)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -26,6 +26,34 @@ CACHE_RESULTS = False  # Cache analysis results
 
 # Custom error patterns file (optional)
 CUSTOM_PATTERNS_FILE = None  # Path to JSON file with custom patterns
+LEARNED_PATTERNS_FILE = "~/.cmdpro/learned_patterns.json"  # Pack written by learn.py apply
+
+# Pattern learning settings (learn.py)
+LEARN_MIN_CLUSTER = 3  # Occurrences of an ML-answered error before a rule is proposed
+LEARN_MAX_SOLUTIONS = 3  # Solutions kept per proposed rule
+
+# Large input matching settings
+MATCH_SHARD_SIZE = 4 * 1024 * 1024  # Characters lowercased and matched at a time
+MATCH_SHARD_OVERLAP = 1024  # Characters shared with the previous shard, extended to a line start
+MATCH_PARALLEL_MIN_SIZE = 32 * 1024 * 1024  # Inputs at least this long are matched in worker processes
+MATCH_JOBS = None  # Worker processes for large inputs; None = one per CPU
+MATCH_WINDOWED = True  # Search the tail and anchor neighborhoods before the full text
+MATCH_TAIL_CHARS = 8 * 1024  # Tail window searched first
+MATCH_ANCHORS = ("Traceback", "Error", "ERROR", "error", "Exception", "FATAL", "fatal")
+MATCH_ANCHOR_RADIUS = 2 * 1024  # Characters searched on each side of an anchor
+MATCH_MAX_ANCHORS = 16  # Anchor neighborhoods tried, nearest the end first
+
+# Log scanning settings (cmdpro scan)
+SCAN_READ_SIZE = 1024 * 1024  # Read buffer per file in bytes
+SCAN_RECORD_BOUNDARY = None  # Regex marking the first line of a record; None = one record per line
+SCAN_MAX_RECORD_LINES = 200  # Flush a multi-line record after this many lines
+SCAN_SAMPLE_LINES = 3  # Sample lines kept per error type
+SCAN_JOBS = None  # Worker processes; None = one per CPU
+
+# Follow mode settings (cmdpro --follow)
+FOLLOW_CONTEXT_LINES = 3  # Preceding lines reported with each finding
+FOLLOW_REPEAT_WINDOW = 50  # Suppress the same error type again within this many lines
+FOLLOW_MAX_LINE_BYTES = 64 * 1024  # Longer lines are split to bound memory
 
 # PowerShell specific settings
 POWERSHELL_INTEGRATION = True
@@ -0,0 +1,171 @@
+"""
+Environment context for CommandPro ML prompts
+
+Collects cheap facts about where a command failed (OS, shell, Python and
+virtualenv, where the failing program resolves on PATH, the working
+directory and the exit code) so the model can give a specific first answer
+instead of a generic one. Collectors run in parallel under a strict time
+budget; whatever has not finished in time is left out.
+"""
+
+import os
+import platform
+import shlex
+import shutil
+import signal
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from ml_config import CONTEXT_CONFIG
+
+# Words that run another program; the program after them is the one that failed
+_WRAPPERS = {"sudo", "env", "time", "nice", "nohup", "exec", "command", "xargs"}
+
+
+def command_binary(command: str) -> Optional[str]:
+    """
+    Find the program a shell command runs
+
+    Args:
+        command: The command line
+
+    Returns:
+        The program name, skipping VAR=value assignments and wrappers like sudo
+    """
+    try:
+        words = shlex.split(command, posix=os.name == "posix")
+    except ValueError:
+        words = command.split()
+    for word in words:
+        if "=" in word.split("/")[0] or word in _WRAPPERS or word.startswith("-"):
+            continue
+        return word
+    return None
+
+
+def path_hits(binary: str) -> List[str]:
+    """Return every PATH location of a program, first match first"""
+    if os.path.dirname(binary):
+        return [binary] if shutil.which(binary) else []
+    hits, seen = [], set()
+    for directory in os.environ.get("PATH", "").split(os.pathsep):
+        found = shutil.which(binary, path=directory) if directory else None
+        # /bin is often a symlink to /usr/bin; list each file once
+        if found and os.path.realpath(found) not in seen:
+            seen.add(os.path.realpath(found))
+            hits.append(found)
+    return hits
+
+
+def describe_exit_code(returncode: int) -> str:
+    """Explain the shell's special exit codes"""
+    if returncode == 127:
+        return "127 (command not found)"
+    if returncode == 126:
+        return "126 (not executable)"
+    if returncode < 0 or returncode > 128:
+        number = -returncode if returncode < 0 else returncode - 128
+        try:
+            return f"{returncode} (killed by {signal.Signals(number).name})"
+        except ValueError:
+            pass
+    return str(returncode)
+
+
+def _os() -> str:
+    return f"{platform.system()} {platform.release()} {platform.machine()}".strip()
+
+
+def _shell() -> Optional[str]:
+    shell = os.environ.get("SHELL") or os.environ.get("COMSPEC")
+    return os.path.basename(shell) if shell else None
+
+
+def _python() -> Optional[str]:
+    python = shutil.which("python3") or shutil.which("python")
+    venv = os.environ.get("VIRTUAL_ENV") or os.environ.get("CONDA_PREFIX")
+    parts = [python or "no python on PATH"]
+    if venv:
+        parts.append(f"venv {venv}")
+    return ", ".join(parts)
+
+
+def _listing(cwd: str) -> str:
+    limit = CONTEXT_CONFIG.get("max_listing", 20)
+    with os.scandir(cwd) as entries:
+        names = sorted(entry.name + ("/" if entry.is_dir() else "") for entry in entries)
+    shown = " ".join(names[:limit])
+    if len(names) > limit:
+        shown += f" (+{len(names) - limit} more)"
+    return shown or "(empty)"
+
+
+def collect_context(
+    command: str = "",
+    returncode: Optional[int] = None,
+    cwd: Optional[str] = None,
+    budget: Optional[float] = None
+) -> Dict[str, str]:
+    """
+    Gather facts about the environment a command failed in
+
+    Args:
+        command: The command that failed
+        returncode: Its exit code, if known
+        cwd: Working directory it ran in (default: ours)
+        budget: Seconds to wait for the collectors (default CONTEXT_CONFIG)
+
+    Returns:
+        Fact name -> short text, for the collectors that finished in time
+    """
+    budget = CONTEXT_CONFIG.get("time_budget", 0.05) if budget is None else budget
+    cwd = cwd or os.getcwd()
+    collectors: Dict[str, Callable[[], Optional[str]]] = {
+        "os": _os,
+        "shell": _shell,
+        "python": _python,
+        "cwd": lambda: f"{cwd}: {_listing(cwd)}",
+    }
+    binary = command_binary(command) if command else None
+    if binary:
+        collectors["path"] = lambda: f"{binary} -> " + (", ".join(path_hits(binary)) or "not found")
+
+    facts = {}
+    if returncode is not None:
+        facts["exit_code"] = describe_exit_code(returncode)
+
+    results: Dict[str, str] = {}
+
+    def run(name: str, collect: Callable[[], Optional[str]]):
+        try:
+            value = collect()
+        except Exception:
+            return
+        if value:
+            results[name] = value
+
+    # Daemon threads rather than an executor, whose workers are joined at
+    # interpreter exit: a collector stuck on a hung network mount must not
+    # keep the CLI from exiting
+    threads = [threading.Thread(target=run, args=item, name=f"context-{item[0]}", daemon=True)
+               for item in collectors.items()]
+    deadline = time.monotonic() + budget
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+
+    finished = dict(results)
+    facts.update((name, finished[name]) for name in collectors if name in finished)
+    return facts
+
+
+def format_context(facts: Dict[str, str]) -> str:
+    """Render collected facts as compact prompt lines"""
+    return "\n".join(f"{name}: {value}" for name, value in facts.items())
+
+
+if __name__ == "__main__":
+    print(format_context(collect_context(" ".join(sys.argv[1:]))))
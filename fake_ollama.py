@@ -0,0 +1,379 @@
+"""
+Fake Ollama server for CommandPro tests and benchmarks
+
+Serves the parts of the Ollama HTTP API that CommandPro uses (/api/tags,
+/api/generate, /api/pull and /api/show) from a background thread, with configurable
+token rate, first-token delay, prefill rate, failure injection and
+concurrency limits. Generate responses return a `context` token list and
+requests that send one back skip prefilling it, as a warm model would.
+The ML path can then be exercised deterministically without a model or
+network.
+
+Usage:
+    with FakeOllamaServer(tokens_per_s=50, first_token_delay=0.2) as server:
+        client = OllamaClient(dict(OLLAMA_CONFIG, base_url=server.base_url))
+        ...
+
+    python fake_ollama.py --port 11434 --tokens-per-s 20
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+DEFAULT_RESPONSE = (
+    "Fix: The module is missing from the active environment.\n"
+    "1. pip install requests\n"
+    "2. python -m pip show requests"
+)
+
+# Returned instead when the request asks for JSON (`format`), in FIX_SCHEMA shape
+DEFAULT_JSON_RESPONSE = json.dumps({
+    "error_type": "Module or Package Not Found",
+    "fix_commands": ["pip install requests", "python -m pip show requests"],
+    "explanation": "The module is missing from the active environment.",
+    "confidence": 0.9,
+})
+
+# Failure modes understood by the `failures` script and `failure_rate`
+FAILURE_MODES = ("error", "hang", "drop")
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """Request handler for the fake Ollama API"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        """Keep test and benchmark output quiet"""
+
+    def do_GET(self):
+        self.server.record(self.path, None)
+        if self.path == "/api/tags":
+            self._send_json({"models": self.server.model_entries()})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        self.server.record(self.path, body)
+
+        if self.path == "/api/generate":
+            with self.server.slot():
+                failure = self.server.next_failure()
+                if failure:
+                    self._fail(failure)
+                else:
+                    self._generate(body)
+        elif self.path == "/api/pull":
+            self._pull(body)
+        elif self.path == "/api/show":
+            self._show(body)
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def _fail(self, mode: str):
+        """Answer a generate request with an injected failure"""
+        if mode == "error":
+            self._send_json({"error": "injected failure"}, status=500)
+        elif mode == "hang":
+            time.sleep(self.server.hang_seconds)
+            self.close_connection = True
+        elif mode == "drop":
+            # Send headers and one token, then cut the connection
+            self._start_stream()
+            self._send_chunk({"response": "Fix:", "done": False})
+            self.close_connection = True
+
+    def _generate(self, body: Dict[str, Any]):
+        """Answer /api/generate with the configured response, token by token"""
+        server = self.server
+        options = body.get("options") or {}
+        text = server.response
+        if text is None:
+            text = DEFAULT_JSON_RESPONSE if body.get("format") else DEFAULT_RESPONSE
+        for stop in options.get("stop") or []:
+            if stop in text:
+                text = text[:text.index(stop)]
+        tokens = server.tokenize(text)
+        num_predict = options.get("num_predict", -1)
+        truncated = 0 <= num_predict < len(tokens)
+        if truncated:
+            tokens = tokens[:num_predict]
+        # Tokens sent back as context are already evaluated; only new text is prefilled
+        context = list(body.get("context") or [])
+        prompt_text = body.get("prompt", "")
+        if not context:
+            prompt_text = body.get("system", "") + " " + prompt_text
+        prompt_count = len(prompt_text.split())
+        prefill = server.first_token_delay + prompt_count * server.prefill_interval
+        eval_ns = int(server.token_interval * len(tokens) * 1e9)
+        stats = {
+            "done": True,
+            "done_reason": "length" if truncated else "stop",
+            "load_duration": 0,
+            "prompt_eval_count": prompt_count,
+            "prompt_eval_duration": int(prefill * 1e9),
+            "eval_count": len(tokens),
+            "eval_duration": eval_ns,
+            "total_duration": int(prefill * 1e9) + eval_ns,
+            "context": context + list(range(len(context), len(context) + prompt_count + len(tokens))),
+        }
+        model = body.get("model")
+
+        if not body.get("stream", True):
+            time.sleep(prefill + server.token_interval * len(tokens))
+            self._send_json(dict(stats, model=model, response="".join(tokens)))
+            return
+
+        self._start_stream()
+        time.sleep(prefill)
+        for token in tokens:
+            self._send_chunk({"model": model, "response": token, "done": False})
+            time.sleep(server.token_interval)
+        self._send_chunk(dict(stats, model=model, response=""))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _pull(self, body: Dict[str, Any]):
+        """Answer /api/pull, streaming progress unless stream is false"""
+        server = self.server
+        name = body.get("name") or body.get("model", "")
+        total = server.pull_size
+        steps = max(1, server.pull_steps)
+
+        if not body.get("stream", True):
+            time.sleep(server.pull_seconds)
+            server.add_model(name)
+            self._send_json({"status": "success"})
+            return
+
+        self._start_stream()
+        self._send_chunk({"status": "pulling manifest"})
+        for step in range(1, steps + 1):
+            time.sleep(server.pull_seconds / steps)
+            self._send_chunk({"status": f"pulling {name}", "digest": "sha256:fake",
+                              "total": total, "completed": total * step // steps})
+        server.add_model(name)
+        self._send_chunk({"status": "success"})
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _show(self, body: Dict[str, Any]):
+        """Answer /api/show with the model's architecture details"""
+        name = body.get("model") or body.get("name", "")
+        # Like Ollama, "mistral" and "mistral:latest" are the same model
+        if name.endswith(":latest") and name not in self.server.models:
+            name = name[:-len(":latest")]
+        if name not in self.server.models:
+            self._send_json({"error": f"model '{name}' not found"}, status=404)
+            return
+        self._send_json({
+            "details": {"family": "llama", "parameter_size": "7B"},
+            "model_info": {"general.architecture": "llama",
+                           "llama.context_length": self.server.context_length},
+        })
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _send_chunk(self, data: Dict[str, Any]):
+        payload = json.dumps(data).encode() + b"\n"
+        self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, data: Dict[str, Any], status: int = 200):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    """Fake Ollama server running on a background thread"""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        response: Optional[str] = None,
+        tokens_per_s: float = 0.0,
+        first_token_delay: float = 0.0,
+        prefill_tokens_per_s: float = 0.0,
+        models: Optional[List[str]] = None,
+        max_concurrency: int = 0,
+        failures: Optional[List[Optional[str]]] = None,
+        failure_rate: float = 0.0,
+        hang_seconds: float = 30.0,
+        pull_seconds: float = 0.0,
+        pull_steps: int = 3,
+        pull_size: int = 4_000_000_000,
+        context_length: int = 32768,
+        seed: int = 0,
+        port: int = 0
+    ):
+        """
+        Initialize the fake server
+
+        Args:
+            response: Text returned for every generate request (default: a prose
+                      reply, or a FIX_SCHEMA document when the request sets `format`)
+            tokens_per_s: Generation speed (0 = as fast as possible)
+            first_token_delay: Seconds before the first token (simulated prefill)
+            prefill_tokens_per_s: Prompt tokens evaluated per second, added to
+                                  first_token_delay (0 = free)
+            models: Model names reported by /api/tags
+            max_concurrency: Generations served at once; others queue (0 = unlimited)
+            failures: Scripted failure per generate request, consumed in order
+                      ("error", "hang", "drop" or None for success)
+            failure_rate: Probability of a random "error" once the script is used up
+            hang_seconds: How long a "hang" failure stalls
+            pull_seconds: Simulated download time for /api/pull
+            pull_steps: Progress messages streamed by /api/pull
+            pull_size: Model size reported by /api/pull and /api/tags
+            context_length: Context length reported by /api/show
+            seed: Random seed for failure_rate
+            port: Port to bind on localhost (0 picks a free port)
+        """
+        super().__init__(("127.0.0.1", port), FakeOllamaHandler)
+        self.response = response
+        self.token_interval = 1.0 / tokens_per_s if tokens_per_s else 0.0
+        self.first_token_delay = first_token_delay
+        self.prefill_interval = 1.0 / prefill_tokens_per_s if prefill_tokens_per_s else 0.0
+        self.models = list(models or ["mistral"])
+        self.failures = list(failures or [])
+        self.failure_rate = failure_rate
+        self.hang_seconds = hang_seconds
+        self.pull_seconds = pull_seconds
+        self.pull_steps = pull_steps
+        self.pull_size = pull_size
+        self.context_length = context_length
+        self.requests: List[Dict[str, Any]] = []
+        self.active = 0
+        self.peak_concurrency = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(max_concurrency) if max_concurrency else None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        """Base URL to put in OLLAMA_CONFIG"""
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    @staticmethod
+    def tokenize(text: str) -> list:
+        """Split text into word-sized tokens, keeping whitespace"""
+        tokens, start = [], 0
+        for i, char in enumerate(text):
+            if char in " \n" and i > start:
+                tokens.append(text[start:i])
+                start = i
+        tokens.append(text[start:])
+        return tokens
+
+    def record(self, path: str, body: Optional[Dict[str, Any]]):
+        """Remember a request for later assertions"""
+        with self._lock:
+            self.requests.append({"path": path, "body": body, "time": time.monotonic()})
+
+    def requests_to(self, path: str) -> List[Dict[str, Any]]:
+        """Return the recorded requests for one endpoint"""
+        with self._lock:
+            return [r for r in self.requests if r["path"] == path]
+
+    def next_failure(self) -> Optional[str]:
+        """Pick the failure mode for the next generate request, if any"""
+        with self._lock:
+            if self.failures:
+                return self.failures.pop(0)
+            if self.failure_rate and self._random.random() < self.failure_rate:
+                return "error"
+        return None
+
+    @contextmanager
+    def slot(self):
+        """Hold a generation slot, enforcing max_concurrency and tracking the peak"""
+        if self._slots:
+            self._slots.acquire()
+        with self._lock:
+            self.active += 1
+            self.peak_concurrency = max(self.peak_concurrency, self.active)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+            if self._slots:
+                self._slots.release()
+
+    def add_model(self, name: str):
+        """Make a model available, as after a successful pull"""
+        with self._lock:
+            if name and name not in self.models:
+                self.models.append(name)
+
+    def model_entries(self) -> List[Dict[str, Any]]:
+        """Model list in the shape returned by /api/tags"""
+        with self._lock:
+            return [{"name": name, "model": name, "size": self.pull_size} for name in self.models]
+
+    def start(self) -> "FakeOllamaServer":
+        """Serve requests on a daemon thread"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and release the port"""
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    """Run the fake server in the foreground"""
+    parser = argparse.ArgumentParser(description="Fake Ollama server for CommandPro")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--tokens-per-s", type=float, default=20.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.5)
+    parser.add_argument("--prefill-tokens-per-s", type=float, default=0.0)
+    parser.add_argument("--max-concurrency", type=int, default=1)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--response", help="Reply text (default: prose, or JSON when asked for)")
+    args = parser.parse_args(argv)
+
+    server = FakeOllamaServer(
+        response=args.response,
+        tokens_per_s=args.tokens_per_s,
+        first_token_delay=args.first_token_delay,
+        prefill_tokens_per_s=args.prefill_tokens_per_s,
+        max_concurrency=args.max_concurrency,
+        failure_rate=args.failure_rate,
+        port=args.port,
+    )
+    print(f"Fake Ollama listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
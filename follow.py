@@ -0,0 +1,125 @@
+"""
+Follow mode for CommandPro
+
+Classifies a live stream (usually stdin in a shell pipeline) line by line
+and reports findings as soon as they appear, without waiting for EOF.
+"""
+
+import sys
+from collections import deque
+from typing import Any, BinaryIO, Dict, Iterator, Optional, TextIO
+
+import config
+from knowledge_base import TYPE_IDS, get_error_type
+from output import EventWriter
+from scanner import PREFILTER, classify
+
+SAMPLE_WIDTH = 200
+
+
+def _decode(line: bytes) -> str:
+    """Decode a raw line for reporting"""
+    return line.decode("utf-8", errors="replace").rstrip()[:SAMPLE_WIDTH]
+
+
+def iter_findings(
+    stream: BinaryIO,
+    context_lines: int = config.FOLLOW_CONTEXT_LINES,
+    repeat_window: int = config.FOLLOW_REPEAT_WINDOW,
+    max_line_bytes: int = config.FOLLOW_MAX_LINE_BYTES,
+    tee: Optional[BinaryIO] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Classify a binary stream line by line as data arrives
+
+    Memory is bounded by the context window and the maximum line length;
+    lines that match no pattern cost one lowercase and one regex search.
+
+    Args:
+        stream: Binary stream to read (e.g. sys.stdin.buffer)
+        context_lines: Preceding lines to report with each finding
+        repeat_window: Lines within which a repeated error type is suppressed
+        max_line_bytes: Longer lines are split into several reads
+        tee: Optional binary stream to copy every input line to
+
+    Yields:
+        One finding dictionary per reported error
+    """
+    context = deque(maxlen=context_lines)
+    last_seen: Dict[int, int] = {}
+    line_number = 0
+
+    while True:
+        line = stream.readline(max_line_bytes)
+        if not line:
+            return
+        line_number += 1
+
+        if tee is not None:
+            tee.write(line)
+            tee.flush()
+
+        lowered = line.lower()
+        type_id = classify(lowered) if PREFILTER.search(lowered) else None
+
+        if (type_id is not None
+                and line_number - last_seen.get(type_id, -repeat_window) >= repeat_window):
+            last_seen[type_id] = line_number
+            yield {
+                "line_number": line_number,
+                "error_type": get_error_type(type_id).name,
+                "line": _decode(line),
+                "context": [_decode(previous) for previous in context],
+            }
+
+        # Raw bytes are kept so that lines without findings are never decoded
+        if context_lines:
+            context.append(line[:SAMPLE_WIDTH])
+
+
+def follow(
+    stream: BinaryIO,
+    output_format: str = "text",
+    tee: bool = False,
+    out: Optional[TextIO] = None
+) -> Dict[str, int]:
+    """
+    Report findings from a live stream until EOF or interrupt
+
+    Args:
+        stream: Binary stream to read
+        output_format: "text", "json" or "ndjson"; json is treated as ndjson
+        tee: Pass input through to stdout as well
+        out: Text stream for findings (defaults to stdout, or stderr with tee)
+
+    Returns:
+        Count of reported findings per error type
+    """
+    if out is None:
+        out = sys.stderr if tee else sys.stdout
+    writer = EventWriter(out) if output_format != "text" else None
+    counts: Dict[str, int] = {}
+
+    findings = iter_findings(stream, tee=sys.stdout.buffer if tee else None)
+    try:
+        for finding in findings:
+            name = finding["error_type"]
+            solutions = get_error_type(TYPE_IDS[name]).solutions
+            counts[name] = counts.get(name, 0) + 1
+            if writer:
+                writer.emit("finding", solutions=list(solutions), **finding)
+            else:
+                out.write(f"✗ [line {finding['line_number']}] {name}: {finding['line']}\n")
+                if solutions:
+                    out.write(f"    → {solutions[0]}\n")
+                out.flush()
+    except KeyboardInterrupt:
+        pass
+
+    if writer:
+        writer.emit("final", counts=counts)
+    elif counts:
+        summary = ", ".join(f"{name} ({count})" for name, count in counts.items())
+        out.write(f"\nFindings: {summary}\n")
+        out.flush()
+    return counts
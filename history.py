@@ -0,0 +1,316 @@
+"""
+Analysis history store for CommandPro ML
+
+Records every analysis (command, stderr tail, fingerprint, classification,
+suggestions, timings and outcome) in a local SQLite database, and answers
+"what fixed this last time?" by fingerprint so recurring failures can be
+answered without calling the model.
+
+Usage:
+    python history.py "ModuleNotFoundError: No module named 'requests'"
+    python history.py --recent 20
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from ml_config import HISTORY_CONFIG, CACHE_CONFIG, CONFIDENCE_CONFIG
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id          INTEGER PRIMARY KEY,
+    ts          REAL    NOT NULL,
+    fingerprint TEXT    NOT NULL,
+    command     TEXT,
+    stderr      TEXT,
+    error_type  TEXT,
+    method      TEXT,
+    confidence  REAL,
+    suggestions TEXT,
+    timings     TEXT,
+    returncode  INTEGER,
+    resolved    INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_analyses_fingerprint ON analyses (fingerprint, ts);
+CREATE INDEX IF NOT EXISTS idx_analyses_command ON analyses (command, ts);
+"""
+
+# Characters per line assumed when cutting the tail to fingerprint
+MAX_LINE_CHARS = 1024
+
+# Volatile tokens replaced before hashing, most specific first
+_NORMALIZERS = [
+    (re.compile(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b"), "<uuid>"),
+    (re.compile(r"\b0x[0-9a-f]+\b"), "<hex>"),
+    (re.compile(r"(?:[a-z]:)?(?:[\\/][\w.\-]+){2,}"), "<path>"),
+    (re.compile(r"\d+"), "<n>"),
+    (re.compile(r"[ \t]+"), " "),
+]
+
+
+def fingerprint(error_message: str, tail_lines: Optional[int] = None) -> str:
+    """
+    Compute a stable fingerprint for an error message
+
+    Only the last non-blank lines are used, lowercased, with paths, numbers,
+    addresses and UUIDs replaced by placeholders, so the same failure on a
+    different line, port or temp directory maps to the same fingerprint.
+
+    Args:
+        error_message: The stderr to fingerprint
+        tail_lines: Lines from the end to consider (default from HISTORY_CONFIG)
+
+    Returns:
+        Hex digest identifying the error
+    """
+    tail_lines = tail_lines or HISTORY_CONFIG.get("tail_lines", 20)
+    # Never lowercase or split a huge message whole; the tail is all we use
+    tail = error_message[-tail_lines * MAX_LINE_CHARS:]
+    lines = [line.strip() for line in tail.lower().splitlines() if line.strip()]
+    text = "\n".join(lines[-tail_lines:])
+    for pattern, replacement in _NORMALIZERS:
+        text = pattern.sub(replacement, text)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:20]
+
+
+class HistoryStore:
+    """SQLite-backed store of past analyses"""
+
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        Open (and create if needed) the history database
+
+        Args:
+            db_path: Database file, or ":memory:" (default from HISTORY_CONFIG)
+        """
+        path = db_path or HISTORY_CONFIG.get("db_path", "~/.cmdpro/history.db")
+        if path != ":memory:":
+            path = os.path.expanduser(path)
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            # Several wrapped commands may record at once
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def record(
+        self,
+        error_message: str,
+        result: Dict[str, Any],
+        command: str = "",
+        returncode: Optional[int] = None,
+        fp: Optional[str] = None
+    ) -> int:
+        """
+        Store one analysis
+
+        Args:
+            error_message: The analyzed stderr
+            result: Analysis result from MLErrorProcessor.process_error
+            command: The command that failed
+            returncode: Its exit code, if known
+            fp: Precomputed fingerprint
+
+        Returns:
+            Row id of the new record
+        """
+        max_bytes = HISTORY_CONFIG.get("max_stderr_bytes", 4096)
+        row = (
+            time.time(),
+            fp or fingerprint(error_message),
+            command,
+            error_message[-max_bytes:],
+            result.get("error_type"),
+            result.get("method"),
+            result.get("ml_confidence"),
+            json.dumps(result.get("suggestions", [])),
+            json.dumps(result.get("timings", {}), default=str),
+            returncode,
+        )
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO analyses (ts, fingerprint, command, stderr, error_type, method,"
+                " confidence, suggestions, timings, returncode) VALUES (?,?,?,?,?,?,?,?,?,?)",
+                row
+            )
+            self._prune()
+            return cursor.lastrowid
+
+    def lookup(
+        self,
+        fp: str,
+        max_age: Optional[float] = None,
+        min_confidence: Optional[float] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Find the best past ML answer for a fingerprint
+
+        Answers whose command later succeeded are preferred, then the most
+        recent. Low-confidence answers are never reused.
+
+        Args:
+            fp: Fingerprint from fingerprint()
+            max_age: Ignore records older than this many seconds (default CACHE_CONFIG ttl)
+            min_confidence: Minimum stored confidence (default CONFIDENCE_CONFIG)
+
+        Returns:
+            The stored analysis as a dict, or None
+        """
+        max_age = CACHE_CONFIG.get("ttl", 3600) if max_age is None else max_age
+        if min_confidence is None:
+            min_confidence = CONFIDENCE_CONFIG.get("min_confidence", 0.4)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT * FROM analyses WHERE fingerprint = ? AND ts >= ?"
+                " AND method = 'ML' AND confidence >= ?"
+                " ORDER BY resolved DESC, ts DESC LIMIT 1",
+                (fp, time.time() - max_age, min_confidence)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def last_fix(self, error_message: str) -> Optional[Dict[str, Any]]:
+        """Answer "what fixed this last time?" for any method and age"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT * FROM analyses WHERE fingerprint = ?"
+                " ORDER BY resolved DESC, ts DESC LIMIT 1",
+                (fingerprint(error_message),)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def mark_resolved(self, command: str) -> int:
+        """
+        Mark the latest unresolved failure of a command as fixed
+
+        Called when the command succeeds, so the suggestion that preceded
+        the success is preferred next time.
+
+        Returns:
+            Number of records updated
+        """
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "UPDATE analyses SET resolved = 1 WHERE id = ("
+                " SELECT id FROM analyses WHERE command = ? AND resolved = 0"
+                " ORDER BY ts DESC LIMIT 1)",
+                (command,)
+            )
+            return cursor.rowcount
+
+    def recent(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Return the most recent analyses, newest first"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM analyses ORDER BY ts DESC, id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def clusters(self, min_count: int = 2, method: str = "ML") -> List[Dict[str, Any]]:
+        """
+        Group analyses the rules could not classify by fingerprint
+
+        Args:
+            min_count: Smallest cluster to return
+            method: Only count analyses answered by this method
+
+        Returns:
+            [{"fingerprint", "count"}], largest first
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT fingerprint, COUNT(*) AS count FROM analyses"
+                " WHERE method = ? AND error_type IS NULL"
+                " GROUP BY fingerprint HAVING COUNT(*) >= ?"
+                " ORDER BY count DESC, fingerprint",
+                (method, min_count)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def records(self, fp: str) -> List[Dict[str, Any]]:
+        """Return every analysis with a fingerprint, resolved and newest first"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM analyses WHERE fingerprint = ?"
+                " ORDER BY resolved DESC, ts DESC, id DESC",
+                (fp,)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def close(self):
+        """Close the database connection"""
+        self.conn.close()
+
+    def _prune(self):
+        """Drop the oldest records beyond HISTORY_CONFIG["max_records"]"""
+        max_records = HISTORY_CONFIG.get("max_records", 10000)
+        self.conn.execute(
+            "DELETE FROM analyses WHERE id <= ("
+            " SELECT id FROM analyses ORDER BY id DESC LIMIT 1 OFFSET ?)",
+            (max_records,)
+        )
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        record = dict(row)
+        record["suggestions"] = json.loads(record["suggestions"] or "[]")
+        record["timings"] = json.loads(record["timings"] or "{}")
+        record["resolved"] = bool(record["resolved"])
+        return record
+
+
+def open_history() -> Optional[HistoryStore]:
+    """Open the configured history store, or None if disabled or unavailable"""
+    if not HISTORY_CONFIG.get("enabled", True):
+        return None
+    try:
+        return HistoryStore()
+    except (sqlite3.Error, OSError):
+        return None
+
+
+def main(argv=None) -> int:
+    """Query the history from the command line"""
+    parser = argparse.ArgumentParser(description="Query CommandPro analysis history")
+    parser.add_argument("error", nargs="*", help="Error message to look up")
+    parser.add_argument("--recent", type=int, metavar="N", help="Show the N most recent analyses")
+    args = parser.parse_args(argv)
+
+    store = HistoryStore()
+    if args.recent:
+        records = store.recent(args.recent)
+    elif args.error:
+        record = store.last_fix(" ".join(args.error))
+        records = [record] if record else []
+    else:
+        parser.print_usage()
+        return 1
+
+    if not records:
+        print("No matching analyses in history.")
+        return 1
+    for record in records:
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(record["ts"]))
+        status = "fixed" if record["resolved"] else "unresolved"
+        print(f"\n[{when}] {record['command'] or '(no command)'} - {record['method']}, {status}")
+        if record["error_type"]:
+            print(f"  Error Type: {record['error_type']}")
+        for i, suggestion in enumerate(record["suggestions"], 1):
+            print(f"  {i}. {suggestion}")
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+Hot-path instrumentation for CommandPro
+
+Per-stage timings, enabled by DEBUG["benchmark"], that are attached to
+result dicts and optionally appended to DEBUG["log_file"] as NDJSON.
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Optional
+
+from ml_config import DEBUG
+
+_log_lock = threading.Lock()
+
+# Returned by StageTimer.stage() when timing is off; reusable, so nothing is built per call
+_NO_STAGE = nullcontext()
+
+
+def benchmark_enabled() -> bool:
+    """Check whether per-stage timing is switched on"""
+    return bool(DEBUG.get("benchmark"))
+
+
+class StageTimer:
+    """Collects named stage timings in milliseconds when benchmarking is enabled"""
+
+    def __init__(self, enabled: Optional[bool] = None):
+        """
+        Initialize the timer
+
+        Args:
+            enabled: Override DEBUG["benchmark"] (None = use the config)
+        """
+        self.enabled = benchmark_enabled() if enabled is None else enabled
+        self.timings: Dict[str, Any] = {}
+
+    def stage(self, name: str):
+        """Time the enclosed block, accumulating into `name`_ms"""
+        return self._timed(name) if self.enabled else _NO_STAGE
+
+    @contextmanager
+    def _timed(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add(self, name: str, elapsed_ms: float):
+        """Accumulate elapsed milliseconds into a stage"""
+        if self.enabled:
+            key = f"{name}_ms"
+            self.timings[key] = self.timings.get(key, 0.0) + elapsed_ms
+
+    def since(self, name: str, start: float):
+        """Record milliseconds elapsed since a perf_counter() value"""
+        if self.enabled:
+            self.timings[f"{name}_ms"] = (time.perf_counter() - start) * 1000
+
+    def set(self, name: str, value: Any):
+        """Record a raw value such as a count or rate"""
+        if self.enabled:
+            self.timings[name] = value
+
+    def reset(self):
+        """Clear timings before a new measured operation"""
+        self.timings = {}
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return a copy of the collected timings"""
+        return dict(self.timings)
+
+
+def log_timings(component: str, timings: Dict[str, Any]):
+    """
+    Append timings to DEBUG["log_file"] as one NDJSON record
+
+    Args:
+        component: Name of the measured component
+        timings: Stage timings to record
+    """
+    path = DEBUG.get("log_file")
+    if not (path and timings and benchmark_enabled()):
+        return
+    record = {"ts": time.time(), "component": component, "timings": timings}
+    line = json.dumps(record, separators=(",", ":"), default=str) + "\n"
+    with _log_lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
@@ -1,5 +1,13 @@
 """Knowledge base of common errors and solutions"""
 
+import json
+import os
+import re
+import sys
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import config
+
 ERROR_PATTERNS = [
     {
         "name": "Command Not Found",
@@ -185,20 +193,351 @@ ERROR_PATTERNS = [
 ]
 
 
+def load_pattern_pack(path: str) -> list:
+    """
+    Load error patterns from a JSON pattern pack
+    
+    A pack is either a list of ERROR_PATTERNS-style entries or an object
+    with a "patterns" list. Entries without a name, patterns and solutions,
+    or with a regex that does not compile, are skipped.
+    
+    Args:
+        path: Pack file; a missing file yields no patterns
+        
+    Returns:
+        List of valid pattern entries
+    """
+    path = os.path.expanduser(path)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    entries = data.get("patterns", []) if isinstance(data, dict) else data
+    
+    valid = []
+    for entry in entries:
+        if not (entry.get("name") and entry.get("patterns") and entry.get("solutions")):
+            continue
+        try:
+            for pattern in entry["patterns"]:
+                re.compile(pattern)
+        except re.error:
+            continue
+        valid.append({
+            "name": entry["name"],
+            "patterns": list(entry["patterns"]),
+            "solutions": list(entry["solutions"]),
+            "examples": list(entry.get("examples", [])),
+        })
+    return valid
+
+
+class ErrorType(NamedTuple):
+    """Compiled, immutable knowledge-base entry identified by a small integer"""
+    id: int
+    name: str
+    patterns: Tuple[str, ...]
+    solutions: Tuple[str, ...]
+    examples: Tuple[str, ...]
+
+
+def lower_pattern(pattern: str) -> str:
+    """Lowercase a regex for use on lowercased text, keeping escapes such as \\S intact"""
+    return re.sub(
+        r"\\.|[^\\]+",
+        lambda m: m.group() if m.group().startswith("\\") else m.group().lower(),
+        pattern
+    )
+
+
+def compile_knowledge_base():
+    """
+    Build the compact lookup table from ERROR_PATTERNS
+    
+    Each entry becomes an ErrorType whose id is its position, with strings
+    interned and lists frozen into tuples, plus one case-sensitive regex per
+    type over lowercased text. Call again after changing ERROR_PATTERNS at
+    runtime.
+    """
+    global ERROR_TYPES, _MATCHERS, _PREFILTER
+    ERROR_TYPES = tuple(
+        ErrorType(
+            type_id,
+            sys.intern(entry["name"]),
+            tuple(entry.get("patterns", [])),
+            tuple(sys.intern(s) for s in entry.get("solutions", [])),
+            tuple(sys.intern(e) for e in entry.get("examples", [])),
+        )
+        for type_id, entry in enumerate(ERROR_PATTERNS)
+    )
+    # Updated in place: other modules import TYPE_IDS by name
+    TYPE_IDS.clear()
+    for error_type in ERROR_TYPES:
+        TYPE_IDS.setdefault(error_type.name, error_type.id)
+    _MATCHERS = tuple(
+        re.compile("|".join(f"(?:{lower_pattern(p)})" for p in error_type.patterns) or "(?!)")
+        for error_type in ERROR_TYPES
+    )
+    # One pass over text that matches nothing, which is most of a large log
+    _PREFILTER = re.compile("|".join(matcher.pattern for matcher in _MATCHERS) or "(?!)")
+
+
+ERROR_TYPES: Tuple[ErrorType, ...] = ()
+TYPE_IDS = {}
+_MATCHERS = ()
+_PREFILTER = None
+compile_knowledge_base()
+
+_packs_loaded = False
+# Entries added by load_configured_packs(), handed to spawned worker processes
+_pack_entries: List[dict] = []
+
+
+def load_configured_packs() -> bool:
+    """
+    Append the custom and learned pattern packs after the built-in patterns
+    
+    Called by the command-line entry points rather than at import, so
+    library code and tests see only the built-in rules unless they ask.
+    Paths are read from config at call time; later calls do nothing.
+    
+    Returns:
+        True if any entries were added (and the knowledge base recompiled)
+    """
+    global _packs_loaded
+    if _packs_loaded:
+        return False
+    _packs_loaded = True
+    added = 0
+    for path in (config.CUSTOM_PATTERNS_FILE, config.LEARNED_PATTERNS_FILE):
+        if not path:
+            continue
+        try:
+            entries = load_pattern_pack(path)
+        except (OSError, ValueError, AttributeError, TypeError):
+            # A broken pack must not take the built-in rules down with it
+            continue
+        ERROR_PATTERNS.extend(entries)
+        _pack_entries.extend(entries)
+        added += len(entries)
+    if added:
+        compile_knowledge_base()
+    return bool(added)
+
+
+def init_worker(pack_entries: List[dict]) -> bool:
+    """
+    Process-pool initializer giving a worker the parent's knowledge base
+    
+    Forked workers inherit the loaded packs; spawned ones (macOS, Windows)
+    re-import this module with the built-in rules only and add the entries
+    here, so type IDs match the parent's.
+    
+    Returns:
+        True if entries were added (and the knowledge base recompiled)
+    """
+    global _packs_loaded
+    if _packs_loaded or not pack_entries:
+        return False
+    _packs_loaded = True
+    ERROR_PATTERNS.extend(pack_entries)
+    _pack_entries.extend(pack_entries)
+    compile_knowledge_base()
+    return True
+
+
+def worker_options(initializer: Callable[[List[dict]], Any] = init_worker) -> Dict[str, Any]:
+    """
+    Keyword arguments for a ProcessPoolExecutor whose workers match errors
+    
+    Args:
+        initializer: init_worker, or a wrapper that calls it and rebuilds
+                     derived matchers
+    """
+    return {"initializer": initializer, "initargs": (list(_pack_entries),)}
+
+
 def get_all_patterns():
     """Return all error patterns from knowledge base"""
     return ERROR_PATTERNS
 
 
-def find_error_type(error_message: str) -> dict:
-    """Find matching error type for given error message"""
-    import re
+def get_error_type(type_id: int) -> ErrorType:
+    """Return the compiled entry for an error-type ID"""
+    return ERROR_TYPES[type_id]
+
+
+def iter_shards(
+    text: str,
+    shard_size: int = config.MATCH_SHARD_SIZE,
+    overlap: int = config.MATCH_SHARD_OVERLAP
+) -> Iterator[str]:
+    """
+    Split text into line-aligned shards
     
-    error_lower = error_message.lower()
+    Each shard ends at a line break and starts at the beginning of a line at
+    least `overlap` characters before the previous shard's end, so a match
+    spanning a shard boundary is still seen whole by one shard.
     
-    for error_type in ERROR_PATTERNS:
-        for pattern in error_type.get("patterns", []):
-            if re.search(pattern, error_lower, re.IGNORECASE):
-                return error_type
+    Args:
+        text: Text to split
+        shard_size: Approximate characters per shard
+        overlap: Minimum characters repeated from the previous shard
+        
+    Yields:
+        Shards in order
+    """
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + shard_size)
+        if end < len(text):
+            newline = text.find("\n", end)
+            end = len(text) if newline == -1 else newline + 1
+        begin = text.rfind("\n", 0, max(0, start - overlap)) + 1 if start else 0
+        yield text[begin:end]
+        start = end
+
+
+def match_text(text: str, limit: Optional[int] = None) -> Optional[int]:
+    """
+    Find the first error type matching a piece of text
     
+    Args:
+        text: Text to match; lowercased here
+        limit: Only try IDs below this one (a better match is already known)
+        
+    Returns:
+        The lowest matching error-type ID, or None
+    """
+    lowered = text.lower()
+    if not _PREFILTER.search(lowered):
+        return None
+    for type_id in range(len(_MATCHERS) if limit is None else limit):
+        if _MATCHERS[type_id].search(lowered):
+            return type_id
     return None
+
+
+def find_error_type_id(error_message: str) -> Optional[int]:
+    """
+    Find the ID of the first error type matching an error message
+    
+    Long messages are lowercased and matched one shard at a time rather than
+    copied whole; the lowest ID found in any shard wins, as if the whole
+    message had been searched type by type.
+    """
+    if len(error_message) <= config.MATCH_SHARD_SIZE:
+        return match_text(error_message)
+    
+    best = None
+    for shard in iter_shards(error_message):
+        found = match_text(shard, best)
+        if found is not None:
+            best = found
+            if best == 0:
+                break
+    return best
+
+
+class MatchRegion(NamedTuple):
+    """Part of a message that produced a match: "tail", "anchor" or "full" """
+    name: str
+    start: int
+    end: int
+
+
+def _line_span(text: str, start: int, end: int, slack: int) -> Tuple[int, int]:
+    """Widen a span to whole lines, looking at most `slack` characters further"""
+    start = text.rfind("\n", max(0, start - slack), start) + 1 if start > 0 else 0
+    newline = text.find("\n", end, end + slack)
+    end = newline + 1 if newline != -1 else min(len(text), end)
+    return start, end
+
+
+def anchor_spans(
+    text: str,
+    anchors: Tuple[str, ...] = config.MATCH_ANCHORS,
+    radius: int = config.MATCH_ANCHOR_RADIUS,
+    max_anchors: int = config.MATCH_MAX_ANCHORS,
+    before: Optional[int] = None
+) -> List[Tuple[int, int]]:
+    """
+    Find line-aligned neighborhoods of anchor words, nearest the end first
+    
+    Args:
+        text: Text to search
+        anchors: Case-sensitive anchor words such as "Traceback" and "Error"
+        radius: Characters kept on each side of an anchor
+        max_anchors: Maximum anchor occurrences to use
+        before: Only consider anchors before this offset (e.g. the tail window)
+        
+    Returns:
+        Merged (start, end) spans in descending order
+    """
+    end = len(text) if before is None else before
+    positions = []
+    for anchor in anchors:
+        position = end
+        for _ in range(max_anchors):
+            position = text.rfind(anchor, 0, position)
+            if position == -1:
+                break
+            positions.append(position)
+    positions = sorted(set(positions), reverse=True)[:max_anchors]
+    
+    spans: List[Tuple[int, int]] = []
+    for position in positions:
+        start, stop = _line_span(text, position - radius, position + radius, radius)
+        if spans and stop >= spans[-1][0]:
+            spans[-1] = (start, spans[-1][1])
+        else:
+            spans.append((start, stop))
+    return spans
+
+
+def find_error_type_windowed(
+    error_message: str,
+    full_match: Callable[[str], Optional[int]] = find_error_type_id
+) -> Tuple[Optional[int], MatchRegion]:
+    """
+    Match the most diagnostic parts of a message before the whole of it
+    
+    Error signatures are nearly always in the last few KB of stderr or next
+    to a "Traceback"/"Error" anchor, so the tail window is searched first,
+    then the anchor neighborhoods, and the full text only when neither
+    matches. Small messages are searched whole.
+    
+    Args:
+        error_message: The error output
+        full_match: Whole-text matcher used as the last resort
+        
+    Returns:
+        (error-type ID or None, region that was searched last)
+    """
+    length = len(error_message)
+    tail_chars = config.MATCH_TAIL_CHARS
+    if not config.MATCH_WINDOWED or length <= tail_chars:
+        return full_match(error_message), MatchRegion("full", 0, length)
+    
+    start, _ = _line_span(error_message, length - tail_chars, length, config.MATCH_ANCHOR_RADIUS)
+    type_id = match_text(error_message[start:])
+    if type_id is not None:
+        return type_id, MatchRegion("tail", start, length)
+    
+    best, region = None, None
+    for span_start, span_end in anchor_spans(error_message, before=start):
+        found = match_text(error_message[span_start:span_end], best)
+        if found is not None:
+            best, region = found, MatchRegion("anchor", span_start, span_end)
+            if best == 0:
+                break
+    if best is not None:
+        return best, region
+    
+    return full_match(error_message), MatchRegion("full", 0, length)
+
+
+def find_error_type(error_message: str) -> dict:
+    """Find matching error type for given error message"""
+    type_id = find_error_type_id(error_message)
+    return ERROR_PATTERNS[type_id] if type_id is not None else None
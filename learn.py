@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Pattern learning for CommandPro
+
+Offline batch job over the analysis history: errors the rules could not
+classify but the model answered repeatedly are clustered by fingerprint,
+turned into ERROR_PATTERNS-style proposals, and written to the learned
+pattern pack once approved. The command-line entry points load that pack,
+so a promoted error is answered by a regex instead of an LLM call.
+
+Usage:
+    python learn.py propose --output proposals.json
+    python learn.py apply proposals.json            # entries marked "approved": true
+    python learn.py apply proposals.json --review   # approve interactively
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional
+
+import config
+from history import HistoryStore
+
+# Volatile tokens generalized in proposed patterns, most specific first
+_VOLATILE = re.compile(
+    r"(?P<uuid>\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b)"
+    r"|(?P<hex>\b0x[0-9a-f]+\b)"
+    r"|(?P<path>(?:[a-z]:)?(?:[\\/][\w.\-]+){2,})"
+    r"|(?P<number>\d+)"
+)
+_QUOTED = re.compile(r"'[^'\n]*'|\"[^\"\n]*\"")
+_REPLACEMENTS = {"uuid": r"\S+", "hex": r"\S+", "path": r"\S+", "number": r"\d+"}
+
+# Lines carrying these words are tried first when picking the signature line
+_DIAGNOSTIC = re.compile(r"error|exception|fail|fatal|denied|invalid|cannot|unable|refused")
+_EXCEPTION_NAME = re.compile(r"\b([A-Za-z_][\w.]*(?:Error|Exception))\b")
+_BULLET = re.compile(r"^\s*(?:\d+[.)]|[-*•])\s*")
+
+MIN_SIGNATURE_CHARS = 8
+MAX_SIGNATURE_CHARS = 160
+
+
+def generalize(line: str, quoted: bool = False) -> str:
+    """
+    Turn one lowercased stderr line into a regex matching its variants
+
+    Args:
+        line: The signature line
+        quoted: Also generalize quoted names (module, file, package names)
+
+    Returns:
+        Regex with volatile parts replaced by wildcards
+    """
+    parts, pos = [], 0
+    for match in _VOLATILE.finditer(line):
+        parts.append(_escape_literal(line[pos:match.start()], quoted))
+        parts.append(_REPLACEMENTS[match.lastgroup])
+        pos = match.end()
+    parts.append(_escape_literal(line[pos:], quoted))
+    return "".join(parts)
+
+
+def _escape(text: str) -> str:
+    """re.escape, leaving spaces readable in the pack"""
+    return re.escape(text).replace("\\ ", " ")
+
+
+def _escape_literal(text: str, quoted: bool) -> str:
+    if not quoted:
+        return _escape(text)
+    pieces, pos = [], 0
+    for match in _QUOTED.finditer(text):
+        quote = match.group()[0]
+        pieces.append(_escape(text[pos:match.start()]))
+        pieces.append(f"{quote}[^{quote}]*{quote}")
+        pos = match.end()
+    pieces.append(_escape(text[pos:]))
+    return "".join(pieces)
+
+
+def _signature_lines(stderr: str) -> List[str]:
+    """Candidate signature lines, diagnostic ones first, each group bottom-up"""
+    lines = [line.strip() for line in stderr.lower().splitlines()]
+    lines = [line for line in lines
+             if MIN_SIGNATURE_CHARS <= len(line) <= MAX_SIGNATURE_CHARS]
+    lines.reverse()
+    return ([line for line in lines if _DIAGNOSTIC.search(line)]
+            + [line for line in lines if not _DIAGNOSTIC.search(line)])
+
+
+def derive_pattern(samples: List[str]) -> Optional[str]:
+    """
+    Find a regex that matches every sample of a cluster
+
+    Args:
+        samples: stderr of each analysis in the cluster, newest first
+
+    Returns:
+        The regex, or None if no line generalizes across the cluster
+    """
+    lowered = [sample.lower() for sample in samples]
+    for line in _signature_lines(samples[0]):
+        for quoted in (False, True):
+            pattern = generalize(line, quoted)
+            if all(re.search(pattern, text) for text in lowered):
+                return pattern
+    return None
+
+
+def split_solutions(suggestion: str, limit: int) -> List[str]:
+    """Split a free-text ML answer into at most `limit` solution lines"""
+    lines = [_BULLET.sub("", line).strip() for line in suggestion.splitlines()]
+    lines = [line for line in lines if line]
+    return lines[:limit]
+
+
+def _name_for(line: str, sample: str) -> str:
+    """Readable rule name from the exception name or the signature line"""
+    match = _EXCEPTION_NAME.search(sample)
+    if match:
+        return f"Learned: {match.group(1)}"
+    words = line.split()[:6]
+    return "Learned: " + " ".join(words).rstrip(":")
+
+
+def propose(
+    store: HistoryStore,
+    min_count: int = config.LEARN_MIN_CLUSTER,
+    max_solutions: int = config.LEARN_MAX_SOLUTIONS
+) -> List[Dict[str, Any]]:
+    """
+    Propose rules for frequent ML-answered errors the rules missed
+
+    A proposal is dropped if its pattern would also match a sample from
+    another cluster, so one rule never swallows a different error.
+
+    Args:
+        store: History to learn from
+        min_count: Smallest cluster worth a rule
+        max_solutions: Solutions kept per rule
+
+    Returns:
+        Proposals in ERROR_PATTERNS shape plus review fields
+        (fingerprint, count, resolved, sample, approved)
+    """
+    clusters = []
+    for cluster in store.clusters(min_count):
+        records = store.records(cluster["fingerprint"])
+        clusters.append((cluster, records))
+
+    proposals = []
+    for cluster, records in clusters:
+        samples = [record["stderr"] or "" for record in records]
+        pattern = derive_pattern(samples)
+        if not pattern:
+            continue
+        others = [record["stderr"].lower() for other, other_records in clusters
+                  if other is not cluster for record in other_records if record["stderr"]]
+        if any(re.search(pattern, text) for text in others):
+            continue
+
+        best = records[0]
+        solutions = []
+        for suggestion in best["suggestions"]:
+            solutions.extend(split_solutions(suggestion, max_solutions - len(solutions)))
+        if not solutions:
+            continue
+
+        line = next(text for text in _signature_lines(samples[0])
+                    if re.search(pattern, text))
+        proposals.append({
+            "name": _name_for(line, samples[0]),
+            "patterns": [pattern],
+            "solutions": solutions,
+            "examples": [],
+            "fingerprint": cluster["fingerprint"],
+            "count": cluster["count"],
+            "resolved": best["resolved"],
+            "sample": line,
+            "approved": False,
+        })
+    return proposals
+
+
+def write_pack(entries: List[Dict[str, Any]], path: str = config.LEARNED_PATTERNS_FILE) -> int:
+    """
+    Merge approved entries into a pattern pack
+
+    Entries whose name or pattern is already in the pack are skipped. The
+    pack is replaced atomically so a concurrent reader never sees half a file.
+
+    Args:
+        entries: Approved proposals
+        path: Pack file to update
+
+    Returns:
+        Number of entries added
+    """
+    path = os.path.expanduser(path)
+    pack = {"version": 1, "patterns": []}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            pack = json.load(f)
+
+    names = {entry["name"] for entry in pack["patterns"]}
+    known = {pattern for entry in pack["patterns"] for pattern in entry["patterns"]}
+    added = 0
+    for entry in entries:
+        if entry["name"] in names or known.intersection(entry["patterns"]):
+            continue
+        pack["patterns"].append({
+            "name": entry["name"],
+            "patterns": entry["patterns"],
+            "solutions": entry["solutions"],
+            "examples": entry.get("examples", []),
+            "fingerprint": entry.get("fingerprint"),
+        })
+        names.add(entry["name"])
+        known.update(entry["patterns"])
+        added += 1
+
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(pack, f, indent=2)
+        f.write("\n")
+    os.replace(tmp, path)
+    return added
+
+
+def _review(proposals: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Ask on the terminal which proposals to approve"""
+    approved = []
+    for proposal in proposals:
+        print(f"\n{proposal['name']}  ({proposal['count']} occurrences)")
+        print(f"  Sample:  {proposal['sample']}")
+        print(f"  Pattern: {proposal['patterns'][0]}")
+        for i, solution in enumerate(proposal["solutions"], 1):
+            print(f"  {i}. {solution}")
+        if input("Promote to a rule? [y/N] ").strip().lower() == "y":
+            approved.append(proposal)
+    return approved
+
+
+def build_parser():
+    """Build the command line argument parser"""
+    parser = argparse.ArgumentParser(description="Promote frequent ML answers into rules")
+    sub = parser.add_subparsers(dest="action")
+
+    propose_parser = sub.add_parser("propose", help="Cluster the history and propose rules")
+    propose_parser.add_argument("--db", help="History database (default from HISTORY_CONFIG)")
+    propose_parser.add_argument("--min-count", type=int, default=config.LEARN_MIN_CLUSTER,
+                                help="Occurrences needed before a rule is proposed")
+    propose_parser.add_argument("--output", default="proposals.json",
+                                help="Where to write proposals for review")
+
+    apply_parser = sub.add_parser("apply", help="Write approved proposals to the pattern pack")
+    apply_parser.add_argument("proposals", help="Proposals file from 'propose'")
+    apply_parser.add_argument("--pack", default=config.LEARNED_PATTERNS_FILE,
+                              help="Pattern pack to update")
+    group = apply_parser.add_mutually_exclusive_group()
+    group.add_argument("--review", action="store_true", help="Approve proposals interactively")
+    group.add_argument("--all", action="store_true", help="Approve every proposal")
+    return parser
+
+
+def main(argv=None) -> int:
+    """Pattern learning entry point"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.action == "propose":
+        proposals = propose(HistoryStore(args.db), args.min_count)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(proposals, f, indent=2)
+            f.write("\n")
+        for proposal in proposals:
+            print(f"{proposal['count']:>5}  {proposal['name']}  {proposal['patterns'][0]}")
+        print(f"\n{len(proposals)} proposal(s) written to {args.output}; "
+              "set \"approved\": true and run 'learn.py apply'.")
+        return 0
+
+    if args.action == "apply":
+        with open(args.proposals, encoding="utf-8") as f:
+            proposals = json.load(f)
+        if args.review:
+            approved = _review(proposals)
+        elif args.all:
+            approved = proposals
+        else:
+            approved = [proposal for proposal in proposals if proposal.get("approved")]
+        added = write_pack(approved, args.pack)
+        print(f"Added {added} rule(s) to {args.pack}")
+        return 0
+
+    parser.print_usage()
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
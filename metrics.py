@@ -0,0 +1,216 @@
+"""
+Prometheus-style metrics for CommandPro
+
+Counters and histograms for the analysis pipeline, exposed in the Prometheus
+text format on a local HTTP endpoint or dumped to a file. Each thread
+updates its own shard of every metric, so recording never takes a lock;
+shards are only merged when the metrics are rendered.
+"""
+
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ml_config import METRICS_CONFIG
+
+# Seconds; covers rule-based answers through slow CPU-only generations
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Metric:
+    """Base class holding per-thread shards keyed by label values"""
+
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._shards_lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _shard(self) -> dict:
+        """Return this thread's shard, creating it on first use"""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            return shard
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{label}="{_escape(value)}"' for label, value in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def _snapshots(self) -> List[dict]:
+        with self._shards_lock:
+            return [dict(shard) for shard in self._shards]
+
+    def reset(self):
+        """Clear all recorded values"""
+        with self._shards_lock:
+            for shard in self._shards:
+                shard.clear()
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        """Add to the counter for the given label values"""
+        if not METRICS_CONFIG.get("enabled", True):
+            return
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        """Merged totals per label combination"""
+        totals: Dict[Tuple[str, ...], float] = {}
+        for shard in self._snapshots():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{self._format_labels(key)} {_number(value)}"
+                for key, value in sorted(self.values().items())]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        """Record one observation"""
+        if not METRICS_CONFIG.get("enabled", True):
+            return
+        shard = self._shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # Per-bucket counts, then +Inf count, then sum
+            state = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def values(self) -> Dict[Tuple[str, ...], list]:
+        """Merged bucket counts and sums per label combination"""
+        totals: Dict[Tuple[str, ...], list] = {}
+        for shard in self._snapshots():
+            for key, state in shard.items():
+                merged = totals.setdefault(key, [0] * len(state))
+                for i, value in enumerate(list(state)):
+                    merged[i] += value
+        return totals
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, state in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{self._format_labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {_number(state[-1])}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+REGISTRY: List[_Metric] = []
+
+ANALYSES = Counter(
+    "cmdpro_analyses_total", "Error analyses completed, by method", ["method"])
+ERROR_TYPES = Counter(
+    "cmdpro_error_types_total", "Analyses per identified error type", ["error_type"])
+CACHE_LOOKUPS = Counter(
+    "cmdpro_cache_lookups_total", "Lookups of previously analyzed errors", ["result"])
+FALLBACKS = Counter(
+    "cmdpro_fallbacks_total", "Analyses that fell back from ML to rules", ["reason"])
+OLLAMA_REQUESTS = Counter(
+    "cmdpro_ollama_requests_total", "Ollama generate requests, by outcome", ["mode", "outcome"])
+OLLAMA_LATENCY = Histogram(
+    "cmdpro_ollama_request_seconds", "Ollama generate request latency", ["mode"])
+ADMISSIONS = Counter(
+    "cmdpro_admissions_total", "Requests for a generation slot, by outcome", ["priority", "outcome"])
+ADMISSION_WAIT = Histogram(
+    "cmdpro_admission_wait_seconds", "Time spent queued for a generation slot", ["priority"])
+STDERR_BYTES = Counter(
+    "cmdpro_stderr_bytes_total", "Bytes of stderr processed from wrapped commands")
+
+
+def render() -> str:
+    """Render every metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path: Optional[str] = None):
+    """Dump the current metrics to a file (defaults to METRICS_CONFIG["export_file"])"""
+    path = path or METRICS_CONFIG.get("export_file")
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(render())
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        """Keep scrapes out of the console"""
+
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        payload = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def serve_metrics(port: Optional[int] = None, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Expose /metrics on a local port from a daemon thread
+
+    Args:
+        port: Port to listen on (defaults to METRICS_CONFIG["http_port"])
+        host: Interface to bind; localhost only by default
+
+    Returns:
+        The running server, so callers can shut it down
+    """
+    port = METRICS_CONFIG.get("http_port") if port is None else port
+    server = ThreadingHTTPServer((host, port or 0), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -4,61 +4,176 @@ Enhanced CLI with ML-powered error analysis
 Combines rule-based (CommandPro) and ML-based (Ollama) error fixing.
 """
 
+import argparse
+import math
+import sqlite3
 import sys
-from typing import Optional, Dict, Any
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional, Dict, Any
 from analyzer import ErrorAnalyzer
+from knowledge_base import TYPE_IDS, find_error_type_id, load_configured_packs
 from stream_processor import CommandWrapper, RealTimeDisplay
 from ollama_client import OllamaClient, OllamaManager
-from ml_config import FEATURES, FALLBACK_CONFIG, DISPLAY_CONFIG
+from ml_config import (
+    FEATURES, FALLBACK_CONFIG, DISPLAY_CONFIG, CONFIDENCE_CONFIG, METRICS_CONFIG, CACHE_CONFIG,
+    CONTEXT_CONFIG
+)
+from context import collect_context, format_context
+from admission import open_admission
+from history import fingerprint, open_history
+from output import OUTPUT_FORMATS, EventWriter, write_json
+from batch import BatchRunner, format_batch_report, load_commands
+from instrumentation import StageTimer, log_timings
+import metrics
+
+# Callback receiving (event name, payload) as an analysis progresses
+EventCallback = Callable[[str, Dict[str, Any]], None]
 
 
 class MLErrorProcessor:
     """Process errors using ML with fallback to rule-based system"""
     
-    def __init__(self):
+    def __init__(self, priority: str = "interactive"):
+        """
+        Args:
+            priority: Queue priority for model calls, "interactive" or "batch"
+        """
         self.ollama_client = OllamaClient() if FEATURES.get("use_ml") else None
         self.use_fallback = FEATURES.get("use_fallback", True)
         self.display = RealTimeDisplay()
+        self.history = open_history()
+        self.priority = priority
+        self.admission = open_admission() if self.ollama_client else None
     
-    def process_error(self, error_message: str, command_context: str = "") -> Dict[str, Any]:
+    def process_error(
+        self,
+        error_message: str,
+        command_context: str = "",
+        on_event: Optional[EventCallback] = None,
+        returncode: Optional[int] = None
+    ) -> Dict[str, Any]:
         """
         Process an error using ML and/or rule-based analysis
         
         Args:
             error_message: The error output
             command_context: The command that was run
+            on_event: Optional callback for "classification" and "token" events
+            returncode: The command's exit code, described to the model
             
         Returns:
             Analysis result with suggestions
         """
+        start = time.perf_counter()
         result = {
             "success": False,
             "method": None,
             "error_type": None,
             "suggestions": [],
-            "ml_confidence": 0.0
+            "ml_confidence": 0.0,
+            "cache_hit": False,
+            "timings": {}
         }
         
-        # Try ML first if enabled and available
-        if FEATURES.get("use_ml") and self.ollama_client and self.ollama_client.is_available():
-            ml_suggestion = self._get_ml_suggestion(error_message, command_context)
-            if ml_suggestion:
+        timer = StageTimer()
+        self.display.timer.reset()
+        rule_result = ErrorAnalyzer.classify(error_message)
+        result["timings"]["rule_ms"] = (time.perf_counter() - start) * 1000
+        if timer.enabled:
+            result["timings"]["analyzer"] = rule_result.timings or {}
+        if on_event:
+            on_event("classification", {
+                "error_type": rule_result.error_type,
+                "method": "Rule-Based"
+            })
+        
+        # Answer recurring errors from history before calling the model
+        fp = fingerprint(error_message) if self.history else None
+        if fp and FEATURES.get("cache_results") and CACHE_CONFIG.get("enabled"):
+            with timer.stage("history_lookup"):
+                past = self.history.lookup(fp)
+            metrics.CACHE_LOOKUPS.inc(result="hit" if past else "miss")
+            if past:
                 result["success"] = True
-                result["method"] = "ML"
-                result["suggestions"] = [ml_suggestion]
-                result["ml_confidence"] = 0.85
+                result["method"] = past["method"]
+                result["error_type"] = rule_result.error_type or past["error_type"]
+                result["suggestions"] = past["suggestions"]
+                result["ml_confidence"] = past["confidence"] or 0.0
+                result["cache_hit"] = True
+                self._finish(result, timer, start)
                 return result
         
+        # Try ML first if enabled and available
+        with timer.stage("health_probe"):
+            ml_ready = bool(FEATURES.get("use_ml") and self.ollama_client
+                            and self.ollama_client.is_available())
+        fallback_reason = "ml_unavailable" if FEATURES.get("use_ml") else None
+        if ml_ready:
+            fallback_reason = "ml_failed"
+            environment = ""
+            if CONTEXT_CONFIG.get("enabled", True):
+                with timer.stage("context"):
+                    environment = format_context(collect_context(command_context, returncode))
+            ml_start = time.perf_counter()
+            with self._admission(result) as admitted:
+                ml_suggestion = self._get_ml_suggestion(
+                    error_message, command_context, on_event, environment
+                ) if admitted else None
+            result["timings"]["ml_ms"] = (time.perf_counter() - ml_start) * 1000
+            if timer.enabled:
+                result["timings"]["ollama"] = self.ollama_client.last_timings
+                if self.display.timer.timings:
+                    result["timings"]["display"] = self.display.timer.as_dict()
+            if not admitted:
+                # Too busy: answer with rules now rather than queue without bound
+                fallback_reason = "overloaded"
+            structured = self.ollama_client.last_structured if admitted else None
+            if self.ollama_client.structured and not structured:
+                # Malformed or truncated JSON is not a fix; let the rules answer
+                ml_suggestion = None
+            if structured:
+                suggestions = structured["fix_commands"] or [structured["explanation"]]
+                ml_suggestion = f"{structured['error_type']}: {structured['explanation']}"
+            else:
+                suggestions = [ml_suggestion]
+            if ml_suggestion:
+                confidence = self.estimate_confidence(
+                    ml_suggestion,
+                    self.ollama_client.last_stats,
+                    rule_result.error_type,
+                    structured["confidence"] if structured else None
+                )
+                low_confidence = confidence < CONFIDENCE_CONFIG.get("min_confidence", 0.4)
+                
+                # Low-confidence answers give way to a rule-based match
+                if not low_confidence or not (self.use_fallback and rule_result.success):
+                    result["success"] = True
+                    result["method"] = "ML"
+                    result["error_type"] = rule_result.error_type
+                    result["suggestions"] = suggestions
+                    result["ml_confidence"] = confidence
+                    result["low_confidence"] = low_confidence
+                    if structured:
+                        result["ml_error_type"] = structured["error_type"]
+                        result["explanation"] = structured["explanation"]
+                    self._finish(result, timer, start)
+                    self._remember(fp, error_message, command_context, result, returncode)
+                    return result
+                fallback_reason = "low_confidence"
+        
         # Fallback to rule-based if enabled
         if self.use_fallback:
-            rule_result = ErrorAnalyzer.analyze(error_message)
-            if rule_result["success"]:
+            if rule_result.success:
                 result["success"] = True
                 result["method"] = "Rule-Based"
-                result["error_type"] = rule_result.get("error_type")
-                result["suggestions"] = rule_result.get("solutions", [])
-                if "examples" in rule_result:
-                    result["examples"] = rule_result["examples"]
+                result["error_type"] = rule_result.error_type
+                result["suggestions"] = list(rule_result.solutions)
+                result["examples"] = list(rule_result.examples)
+                if rule_result.region is not None:
+                    result["match_region"] = rule_result.region._asdict()
+                self._finish(result, timer, start, fallback_reason)
+                self._remember(fp, error_message, command_context, result, returncode)
                 return result
         
         # No suggestions available
@@ -67,36 +182,156 @@ class MLErrorProcessor:
             "Check the official documentation",
             "Verify your inputs are correct"
         ]
+        self._finish(result, timer, start, fallback_reason)
+        self._remember(fp, error_message, command_context, result, returncode)
         return result
     
-    def _get_ml_suggestion(self, error_message: str, context: str = "") -> Optional[str]:
+    @contextmanager
+    def _admission(self, result: Dict[str, Any]) -> Iterator[bool]:
+        """Hold a cross-process generation slot; yields False if the request was shed"""
+        if not self.admission:
+            yield True
+            return
+        with self.admission.admit(self.priority) as admission:
+            result["timings"]["queue_wait_ms"] = admission.wait_s * 1000
+            if not admission.admitted:
+                result["shed"] = admission.reason
+            yield admission.admitted
+    
+    def _remember(
+        self,
+        fp: Optional[str],
+        error_message: str,
+        command: str,
+        result: Dict[str, Any],
+        returncode: Optional[int] = None
+    ):
+        """Record an analysis in the history store, if one is open"""
+        if not self.history:
+            return
+        try:
+            self.history.record(error_message, result, command=command,
+                                returncode=returncode, fp=fp)
+        except sqlite3.Error:
+            # History is best effort; never fail an analysis over it
+            pass
+    
+    def mark_resolved(self, command: str):
+        """Note that a previously failing command now succeeds"""
+        if not self.history:
+            return
+        try:
+            self.history.mark_resolved(command)
+        except sqlite3.Error:
+            pass
+    
+    @staticmethod
+    def _finish(
+        result: Dict[str, Any],
+        timer: StageTimer,
+        start: float,
+        fallback_reason: Optional[str] = None
+    ):
+        """Record total time, metrics and, when benchmarking, the stage breakdown"""
+        result["timings"]["total_ms"] = (time.perf_counter() - start) * 1000
+        if timer.enabled:
+            result["timings"].update(timer.as_dict())
+            log_timings("ml_processor", result["timings"])
+        
+        metrics.ANALYSES.inc(method=result["method"] or "none")
+        metrics.ERROR_TYPES.inc(error_type=result["error_type"] or "unknown")
+        if fallback_reason and result["method"] != "ML":
+            metrics.FALLBACKS.inc(reason=fallback_reason)
+    
+    @staticmethod
+    def estimate_confidence(
+        suggestion: str,
+        stats: Optional[Dict[str, Any]] = None,
+        rule_error_type: Optional[str] = None,
+        reported_confidence: Optional[float] = None
+    ) -> float:
+        """
+        Estimate how much an ML suggestion can be trusted
+        
+        Args:
+            suggestion: The text returned by the model
+            stats: Generation statistics from OllamaClient.last_stats
+            rule_error_type: Error type found by the rule-based analyzer
+            reported_confidence: The model's own estimate from a structured reply
+            
+        Returns:
+            Confidence between 0.0 and 1.0
+        """
+        stats = stats or {}
+        if not suggestion or stats.get("eval_count") == 0:
+            return 0.0
+        
+        # Geometric mean of the token probabilities when Ollama exposes them
+        logprobs = stats.get("logprobs")
+        if logprobs:
+            confidence = math.exp(sum(logprobs) / len(logprobs))
+        elif reported_confidence is not None:
+            confidence = reported_confidence
+        else:
+            confidence = CONFIDENCE_CONFIG.get("default_confidence", 0.6)
+        
+        if stats.get("done_reason") == "length":
+            confidence -= CONFIDENCE_CONFIG.get("truncation_penalty", 0.15)
+        
+        # Agreement with the rule-based classification
+        if rule_error_type:
+            ml_type = find_error_type_id(suggestion)
+            if ml_type is not None and ml_type == TYPE_IDS.get(rule_error_type):
+                confidence += CONFIDENCE_CONFIG.get("agreement_bonus", 0.15)
+            elif ml_type is not None:
+                confidence -= CONFIDENCE_CONFIG.get("disagreement_penalty", 0.2)
+        
+        return max(0.0, min(1.0, confidence))
+    
+    def _get_ml_suggestion(
+        self,
+        error_message: str,
+        context: str = "",
+        on_event: Optional[EventCallback] = None,
+        environment: str = ""
+    ) -> Optional[str]:
         """Get suggestion from ML model"""
         try:
             if FEATURES.get("stream_responses"):
                 # Stream the response in real-time
-                suggestion_parts = []
-                for chunk in self.ollama_client.analyze_error_stream(error_message, context):
-                    suggestion_parts.append(chunk)
-                    # Print chunks as they arrive for real-time feedback
-                    if DISPLAY_CONFIG.get("verbose"):
-                        print(chunk, end='', flush=True)
-                return "".join(suggestion_parts).strip()
+                chunks = self.ollama_client.analyze_error_stream(error_message, context, environment)
+                if on_event:
+                    chunks = self._forward_tokens(chunks, on_event)
+                elif DISPLAY_CONFIG.get("verbose") and not self.ollama_client.structured:
+                    # Render chunks as they arrive for real-time feedback
+                    return self.display.stream_display(chunks).strip()
+                return "".join(chunks).strip()
             else:
                 # Get complete response at once
-                return self.ollama_client.analyze_error(error_message, context)
+                return self.ollama_client.analyze_error(error_message, context, environment)
         except Exception as e:
             if FEATURES.get("use_fallback"):
-                print(f"ML analysis failed, falling back to rule-based")
+                print(f"ML analysis failed, falling back to rule-based", file=sys.stderr)
             return None
+    
+    @staticmethod
+    def _forward_tokens(chunks, on_event: EventCallback):
+        """Pass streamed chunks through while reporting each as a token event"""
+        for chunk in chunks:
+            on_event("token", {"text": chunk})
+            yield chunk
 
 
 class EnhancedCLI:
     """Enhanced CLI with command wrapping and ML analysis"""
     
-    def __init__(self):
+    def __init__(self, output_format: str = "text", use_pty: Optional[bool] = None):
         self.processor = MLErrorProcessor()
         self.display = RealTimeDisplay()
         self.wrapper = CommandWrapper()
+        self.output_format = output_format
+        self.use_pty = use_pty
+        self.events = EventWriter() if output_format == "ndjson" else None
     
     def run_command_with_analysis(self, command: str) -> int:
         """
@@ -108,7 +343,9 @@ class EnhancedCLI:
         Returns:
             Command return code
         """
-        print(f"🔧 Running: {command}\n")
+        text_mode = self.output_format == "text"
+        if text_mode:
+            print(f"🔧 Running: {command}\n")
         
         # Track stderr chunks for analysis
         stderr_chunks = []
@@ -117,30 +354,63 @@ class EnhancedCLI:
             """Callback for stderr chunks"""
             stderr_chunks.append(chunk)
             # Could process in real-time here
-            print(chunk, end='', flush=True)
+            if self.events:
+                self.events.emit("chunk", text=chunk)
+            elif text_mode:
+                print(chunk, end='', flush=True)
         
         # Run the command
+        start = time.perf_counter()
         result = self.wrapper.run_with_capture(
             command,
             on_stderr_chunk=on_stderr_chunk,
-            shell=True
+            shell=True,
+            use_pty=self.use_pty
         )
+        run_ms = (time.perf_counter() - start) * 1000
+        
+        analysis = None
+        
+        if result["success"]:
+            self.processor.mark_resolved(command)
         
         # Analyze if there was an error
-        if not result["success"] and result["stderr"]:
-            print("\n" + "=" * 70)
-            print("Analyzing error with CommandPro ML...")
-            print("=" * 70 + "\n")
+        elif result["stderr"]:
+            if text_mode:
+                print("\n" + "=" * 70)
+                print("Analyzing error with CommandPro ML...")
+                print("=" * 70 + "\n")
             
             analysis = self.processor.process_error(
                 result["stderr"],
-                command_context=command
+                command_context=command,
+                on_event=self._emit if self.events else None,
+                returncode=result["returncode"]
             )
             
-            self._display_analysis(analysis)
+            if text_mode:
+                self._display_analysis(analysis)
+        
+        if not text_mode:
+            report = {
+                "command": command,
+                "returncode": result["returncode"],
+                "analysis": analysis,
+                "timings": {"run_ms": run_ms}
+            }
+            if "timings" in result:
+                report["timings"]["stream"] = result["timings"]
+            if self.events:
+                self.events.emit("final", **report)
+            else:
+                write_json(report)
         
         return result["returncode"]
     
+    def _emit(self, event: str, payload: Dict[str, Any]):
+        """Forward processor events to the NDJSON writer"""
+        self.events.emit(event, **payload)
+    
     def _display_analysis(self, analysis: Dict[str, Any]):
         """Display analysis results"""
         if not analysis["success"]:
@@ -148,10 +418,20 @@ class EnhancedCLI:
             return
         
         print(f"\n✓ Method: {analysis['method']}")
+        if analysis.get("cache_hit"):
+            print("✓ Answered from history")
+        if analysis.get("shed"):
+            print("✓ Model busy; answered with rules")
         if analysis.get("error_type"):
             print(f"✓ Error Type: {analysis['error_type']}")
-        if analysis.get("ml_confidence"):
-            print(f"✓ Confidence: {analysis['ml_confidence']*100:.0f}%")
+        elif analysis.get("ml_error_type"):
+            print(f"✓ Error Type: {analysis['ml_error_type']}")
+        if analysis.get("ml_confidence") and DISPLAY_CONFIG.get("show_confidence", True):
+            note = " (low - verify before running)" if analysis.get("low_confidence") else ""
+            print(f"✓ Confidence: {analysis['ml_confidence']*100:.0f}%{note}")
+        
+        if analysis.get("explanation"):
+            print(f"\n{analysis['explanation']}")
         
         print("\n💡 Suggested Fixes:")
         for i, suggestion in enumerate(analysis["suggestions"], 1):
@@ -165,28 +445,100 @@ class EnhancedCLI:
         print()
 
 
-def main():
+def build_parser():
+    """Build the command line argument parser"""
+    parser = argparse.ArgumentParser(
+        prog="ml_cli.py",
+        description="Run a command and analyze its errors with CommandPro ML",
+        epilog="Example: python ml_cli.py 'npm install missing-package'"
+    )
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="text",
+        help="Output format; ndjson streams chunk/classification/token/final events"
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="Run the commands in FILE (one per line) concurrently and triage failures"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Commands run at once in batch mode (default: one per CPU)"
+    )
+    parser.add_argument(
+        "--pty",
+        action="store_true",
+        default=None,
+        help="Run the command on a pseudo-terminal so it keeps colors and line buffering (POSIX)"
+    )
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="Command to run")
+    return parser
+
+
+def run_batch(path: str, jobs: Optional[int], output_format: str) -> int:
+    """
+    Run a file of commands concurrently and print a consolidated report
+    
+    Returns:
+        0 if every command succeeded, 1 otherwise
+    """
+    events = EventWriter() if output_format == "ndjson" else None
+    on_result = (lambda entry: events.emit("result", **entry)) if events else None
+    runner = BatchRunner(lambda: MLErrorProcessor(priority="batch"), jobs=jobs, on_result=on_result)
+    
+    if METRICS_CONFIG.get("http_port"):
+        metrics.serve_metrics()
+    report = runner.run(load_commands(path))
+    metrics.write_metrics()
+    
+    if events:
+        events.emit("final", **report["summary"])
+    elif output_format == "json":
+        write_json(report)
+    else:
+        print(format_batch_report(report))
+    return 0 if report["summary"]["failed"] == 0 else 1
+
+
+def main(argv=None):
     """Main entry point for enhanced CLI"""
+    args = build_parser().parse_args(argv)
+    load_configured_packs()
     
     # Check if Ollama is available
     if FEATURES.get("use_ml"):
         if not OllamaManager.is_running():
-            print("⚠️  Ollama is not running. Using rule-based analysis only.")
-            print("   Tip: Start Ollama with: ollama serve")
-            print("   Or pull a model with: ollama pull mistral\n")
+            # Keep machine-readable stdout clean
+            out = sys.stdout if args.format == "text" else sys.stderr
+            print("⚠️  Ollama is not running. Using rule-based analysis only.", file=out)
+            print("   Tip: Start Ollama with: ollama serve", file=out)
+            print("   Or pull a model with: ollama pull mistral\n", file=out)
+    
+    if args.batch:
+        return run_batch(args.batch, args.jobs, args.format)
     
-    # Get command from arguments
-    if len(sys.argv) < 2:
-        print("Usage: python ml_cli.py <command>")
+    # Get command from arguments; REMAINDER keeps the "--" that ends option parsing
+    if args.command[:1] == ["--"]:
+        args.command = args.command[1:]
+    if not args.command:
+        print("Usage: python ml_cli.py [--format text|json|ndjson] <command>")
+        print("       python ml_cli.py --batch commands.txt [--jobs N]")
         print("Example: python ml_cli.py 'npm install missing-package'")
         return 1
     
-    command = " ".join(sys.argv[1:])
+    command = " ".join(args.command)
+    
+    if METRICS_CONFIG.get("http_port"):
+        metrics.serve_metrics()
     
     # Run with analysis
-    cli = EnhancedCLI()
+    cli = EnhancedCLI(output_format=args.format, use_pty=args.pty)
     return_code = cli.run_command_with_analysis(command)
     
+    metrics.write_metrics()
     return return_code
 
 
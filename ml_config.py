@@ -11,6 +11,20 @@ OLLAMA_CONFIG = {
     "timeout": 10,                          # Timeout for LLM response (seconds)
     "temperature": 0.7,                     # Creativity level (0.0-1.0)
     "num_ctx": 2048,                        # Context window size
+    "reuse_prefix": True,                   # Prefill the system prompt once per model and reuse it
+    "prefix_timeout": 3,                    # Seconds allowed for that prefill
+    "prefix_retry_after": 60,               # Seconds before a failed prefill is tried again
+    "output_format": "schema",              # "schema"/"json" for structured fixes, "text" for prose
+    "num_predict": None,                    # Max tokens generated; None = derived from max_suggestions
+    "tokens_per_suggestion": 48,            # Token budget per suggested fix
+}
+
+# Model Registry (cached model list, sizes and context lengths)
+REGISTRY_CONFIG = {
+    "path": "~/.cmdpro/models.json",        # Shared by every CommandPro process
+    "ttl": 300,                             # Seconds before the model list is fetched again
+    "pull_retries": 2,                      # Extra attempts when a download is interrupted
+    "pull_idle_timeout": 120,               # Seconds without progress before a pull attempt fails
 }
 
 # Feature Flags
@@ -36,12 +50,33 @@ Provide commands the user can copy and run immediately.""",
     "include_examples": True,
 }
 
+# Confidence Scoring
+CONFIDENCE_CONFIG = {
+    "request_logprobs": True,               # Ask Ollama for per-token log-probabilities
+    "default_confidence": 0.6,              # Base score when no log-probs are returned
+    "min_confidence": 0.4,                  # Below this, prefer the rule-based answer
+    "agreement_bonus": 0.15,                # Added when ML agrees with rule-based type
+    "disagreement_penalty": 0.2,            # Subtracted when ML contradicts rule-based type
+    "truncation_penalty": 0.15,             # Subtracted when generation hit the token limit
+}
+
+# Environment Context (attached to ML prompts)
+CONTEXT_CONFIG = {
+    "enabled": True,                        # Describe the environment in the prompt
+    "time_budget": 0.05,                    # Seconds to wait for the collectors
+    "max_listing": 20,                      # Working-directory entries listed
+}
+
 # Real-time Processing
 STREAM_CONFIG = {
-    "buffer_size": 1024,                    # stderr buffer size in bytes
+    "buffer_size": 65536,                   # Max bytes of stderr read at once
     "chunk_timeout": 0.5,                   # Time to wait before sending to LLM (seconds)
     "min_chunk_size": 50,                   # Minimum characters before processing
-    "display_delay": 0.1,                   # Delay between printing characters (for effect)
+    "display_fps": 30,                      # Max screen refreshes per second when streaming
+    "command_timeout": None,                # Seconds before a wrapped command is killed (async wrapper)
+    "kill_grace": 2.0,                      # Seconds between SIGTERM and SIGKILL
+    "use_pty": False,                       # Run wrapped commands on pseudo-terminals (POSIX)
+    "fallback_encoding": None,              # Used when output is not UTF-8; None = locale encoding
 }
 
 # Fallback Behavior
@@ -59,6 +94,35 @@ CACHE_CONFIG = {
     "ttl": 3600,                            # Cache TTL in seconds (1 hour)
 }
 
+# Batch Mode (ml_cli.py --batch)
+BATCH_CONFIG = {
+    "jobs": None,                           # Commands run at once; None = one per CPU
+    "analysis_workers": 2,                  # Failures analyzed at once
+    "queue_size": 32,                       # Failures waiting for analysis before runners block
+}
+
+# Admission Control (limits concurrent generations across all CommandPro processes)
+ADMISSION_CONFIG = {
+    "enabled": True,
+    "slots": 1,                             # Generations at once across your CommandPro processes
+    "lock_dir": None,                       # Lock directory; None = per-user dir in system temp
+    "max_queue": 4,                         # Answer with rules when this many requests are ahead
+    "max_wait": {                           # Seconds to wait for a slot before answering with rules
+        "interactive": 15.0,
+        "batch": 120.0,
+    },
+    "poll_interval": 0.02,                  # Seconds between checks while queued
+}
+
+# Analysis History
+HISTORY_CONFIG = {
+    "enabled": True,                        # Record every analysis locally
+    "db_path": "~/.cmdpro/history.db",      # SQLite database file
+    "max_records": 10000,                   # Oldest records are pruned beyond this
+    "max_stderr_bytes": 4096,               # Tail of stderr kept per record
+    "tail_lines": 20,                       # Lines of stderr used for the fingerprint
+}
+
 # Display Settings
 DISPLAY_CONFIG = {
     "use_colors": True,
@@ -67,6 +131,13 @@ DISPLAY_CONFIG = {
     "max_output_lines": 50,                 # Max lines to display
 }
 
+# Metrics (Prometheus text format)
+METRICS_CONFIG = {
+    "enabled": True,                        # Record counters and histograms
+    "http_port": None,                      # Serve /metrics on localhost at this port
+    "export_file": None,                    # Write metrics to this file on exit
+}
+
 # Debug Settings
 DEBUG = {
     "verbose_logging": False,
@@ -0,0 +1,277 @@
+"""
+Model registry cache for CommandPro ML
+
+Remembers which models an Ollama server has, their sizes and context
+lengths, in a small JSON file shared by every CommandPro process. Checks
+such as "is the configured model installed?" are answered from the file
+while it is younger than REGISTRY_CONFIG["ttl"], so wrappers that check
+before every run do not pay a round trip each time. Pulls stream their
+progress, retry interrupted downloads (Ollama resumes partial blobs) and
+can run in the background.
+
+Usage:
+    python model_registry.py                # list cached models
+    python model_registry.py --refresh
+    python model_registry.py --pull llama3
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+import requests
+
+from ml_config import OLLAMA_CONFIG, REGISTRY_CONFIG
+
+# Called with (status, completed bytes, total bytes) while a model downloads
+ProgressCallback = Callable[[str, int, int], None]
+
+_file_lock = threading.Lock()
+
+
+def canonical_name(name: str) -> str:
+    """Add the implicit ":latest" tag, as Ollama does"""
+    return name if ":" in name else f"{name}:latest"
+
+
+class ModelRegistry:
+    """Cached view of the models on one Ollama server"""
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        path: Optional[str] = None,
+        ttl: Optional[float] = None
+    ):
+        """
+        Initialize the registry
+
+        Args:
+            base_url: Ollama server (default OLLAMA_CONFIG)
+            path: Cache file (default REGISTRY_CONFIG)
+            ttl: Seconds before the model list is fetched again (default REGISTRY_CONFIG)
+        """
+        self.base_url = base_url or OLLAMA_CONFIG.get("base_url", "http://localhost:11434")
+        self.path = os.path.expanduser(path or REGISTRY_CONFIG.get("path", "~/.cmdpro/models.json"))
+        self.ttl = REGISTRY_CONFIG.get("ttl", 300) if ttl is None else ttl
+
+    def models(self, refresh: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        Return the server's models
+
+        Args:
+            refresh: Ignore the cache and ask the server
+
+        Returns:
+            Canonical model name -> {"size", "digest", "context_length"};
+            empty if the server cannot be reached and nothing is cached
+        """
+        entry = self._entry()
+        if not refresh and entry and time.time() - entry["fetched_at"] < self.ttl:
+            return entry["models"]
+        try:
+            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
+            response.raise_for_status()
+            listed = response.json().get("models", [])
+        except (requests.RequestException, ValueError):
+            # Offline: a stale answer beats none
+            return entry["models"] if entry else {}
+
+        known = entry["models"] if entry else {}
+        models = {}
+        for model in listed:
+            name = canonical_name(model["name"])
+            info = {"size": model.get("size"), "digest": model.get("digest")}
+            previous = known.get(name, {})
+            if previous.get("digest") == info["digest"]:
+                info["context_length"] = previous.get("context_length")
+            models[name] = info
+        self._store(models)
+        return models
+
+    def has_model(self, name: str) -> bool:
+        """Whether a model is installed, from the cache when it is fresh"""
+        return canonical_name(name) in self.models()
+
+    def context_length(self, name: str) -> Optional[int]:
+        """
+        Return a model's maximum context length
+
+        Looked up once with /api/show and cached with the model's digest.
+
+        Returns:
+            Context length in tokens, or None if unknown
+        """
+        name = canonical_name(name)
+        info = self.models().get(name)
+        if info is None:
+            return None
+        if info.get("context_length"):
+            return info["context_length"]
+        try:
+            response = requests.post(f"{self.base_url}/api/show", json={"model": name}, timeout=5)
+            response.raise_for_status()
+            model_info = response.json().get("model_info", {})
+        except (requests.RequestException, ValueError):
+            return None
+        length = next((value for key, value in model_info.items()
+                       if key.endswith(".context_length")), None)
+        if length:
+            models = dict(self.models())
+            models[name] = dict(info, context_length=length)
+            self._store(models, keep_time=True)
+        return length
+
+    def pull(
+        self,
+        name: str,
+        on_progress: Optional[ProgressCallback] = None,
+        retries: Optional[int] = None
+    ) -> bool:
+        """
+        Download a model, streaming progress
+
+        Args:
+            name: Model to pull
+            on_progress: Called with (status, completed, total) for each update
+            retries: Extra attempts after a dropped connection (default REGISTRY_CONFIG)
+
+        Returns:
+            True if the model is now installed
+        """
+        retries = REGISTRY_CONFIG.get("pull_retries", 2) if retries is None else retries
+        for _ in range(retries + 1):
+            try:
+                with requests.post(
+                    f"{self.base_url}/api/pull",
+                    json={"name": name, "stream": True},
+                    # No overall limit; give up only if the server goes quiet
+                    timeout=(5, REGISTRY_CONFIG.get("pull_idle_timeout", 120)),
+                    stream=True
+                ) as response:
+                    if response.status_code != 200:
+                        return False
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        update = json.loads(line)
+                        if "error" in update:
+                            return False
+                        if on_progress:
+                            on_progress(update.get("status", ""),
+                                        update.get("completed", 0), update.get("total", 0))
+                        if update.get("status") == "success":
+                            self.models(refresh=True)
+                            return True
+            except (requests.RequestException, ValueError):
+                # Ollama keeps partial downloads, so the next attempt resumes
+                continue
+        return False
+
+    def pull_in_background(
+        self,
+        name: str,
+        on_progress: Optional[ProgressCallback] = None
+    ) -> "Future[bool]":
+        """
+        Start pull() on a daemon thread
+
+        Returns:
+            Future resolving to pull()'s result
+        """
+        future: "Future[bool]" = Future()
+
+        def run():
+            try:
+                future.set_result(self.pull(name, on_progress))
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name=f"pull-{name}", daemon=True).start()
+        return future
+
+    def invalidate(self):
+        """Forget this server's cached models"""
+        with _file_lock:
+            data = self._read()
+            if data.pop(self.base_url, None) is not None:
+                self._write(data)
+
+    def _entry(self) -> Optional[Dict[str, Any]]:
+        with _file_lock:
+            return self._read().get(self.base_url)
+
+    def _store(self, models: Dict[str, Dict[str, Any]], keep_time: bool = False):
+        with _file_lock:
+            data = self._read()
+            fetched_at = time.time()
+            if keep_time and self.base_url in data:
+                fetched_at = data[self.base_url]["fetched_at"]
+            data[self.base_url] = {"fetched_at": fetched_at, "models": models}
+            try:
+                self._write(data)
+            except OSError:
+                pass
+
+    def _read(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, data: Dict[str, Any]):
+        """Replace the cache file atomically so concurrent readers never see half of it"""
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".models-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+def print_progress(status: str, completed: int, total: int):
+    """Render pull progress on one terminal line"""
+    if total:
+        line = f"{status}: {completed / total:6.1%} of {total / 1e9:.2f} GB"
+    else:
+        line = status
+    end = "\n" if status == "success" else ""
+    print(f"\r{line:<70}", end=end, file=sys.stderr, flush=True)
+
+
+def main(argv=None) -> int:
+    """Inspect or update the registry from the command line"""
+    parser = argparse.ArgumentParser(description="CommandPro model registry")
+    parser.add_argument("--refresh", action="store_true", help="Ask the server instead of the cache")
+    parser.add_argument("--pull", metavar="MODEL", help="Download a model with progress")
+    args = parser.parse_args(argv)
+
+    registry = ModelRegistry()
+    if args.pull:
+        return 0 if registry.pull(args.pull, print_progress) else 1
+
+    models = registry.models(refresh=args.refresh)
+    if not models:
+        print("No models known (is Ollama running?)")
+        return 1
+    for name, info in sorted(models.items()):
+        size = f"{info['size'] / 1e9:.1f} GB" if info.get("size") else "?"
+        context = info.get("context_length") or "?"
+        print(f"{name:<30} {size:>8}  context {context}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,16 +4,244 @@ Ollama integration module for CommandPro ML
 Handles communication with local Ollama instances for AI-powered error analysis.
 """
 
+import hashlib
 import json
+import re
+import threading
+import time
 import requests
 import subprocess
-from typing import Generator, Optional, Dict, Any
-from ml_config import OLLAMA_CONFIG, FEATURES, PROMPT_SETTINGS
+from typing import Generator, Optional, Dict, Any, List, Tuple
+from ml_config import OLLAMA_CONFIG, FEATURES, PROMPT_SETTINGS, CONFIDENCE_CONFIG
+from model_registry import ModelRegistry, ProgressCallback, print_progress
+from instrumentation import StageTimer, log_timings
+import metrics
+
+# Generation statistics reported by Ollama on the final response object
+STAT_FIELDS = (
+    "total_duration",
+    "load_duration",
+    "prompt_eval_count",
+    "prompt_eval_duration",
+    "eval_count",
+    "eval_duration",
+    "done_reason",
+)
+
+# Fixed instructions sent with every analysis; with prefix reuse they are
+# prefilled once per model and the requests carry only the error
+PROMPT_INSTRUCTIONS = """Provide a brief, actionable fix that the user can execute immediately.
+Focus on the most likely solution. Be concise."""
+
+LIST_INSTRUCTIONS = """List at most {max_suggestions} fixes as a numbered list, one line each, \
+most likely first, and nothing after the list."""
+
+# Generated tokens allowed besides the fixes themselves (preamble, JSON keys, explanation)
+NUM_PREDICT_OVERHEAD = 64
+
+# A numbered list item; "3." alone counts, like the "\n3." stop sequence
+NUMBERED_ITEM = re.compile(r"^\s*\d+[.)](?:\s|$)")
+
+PREFIX_PROMPT = """I will send you command-line errors to analyze and fix, one at a time.
+For each one: {instructions}"""
+
+# Reply shape requested with OLLAMA_CONFIG["output_format"] = "schema" or "json"
+FIX_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "error_type": {"type": "string"},
+        "fix_commands": {"type": "array", "items": {"type": "string"}},
+        "explanation": {"type": "string"},
+        "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+    },
+    "required": ["error_type", "fix_commands", "explanation", "confidence"],
+}
+
+JSON_INSTRUCTIONS = """Reply with only a JSON object with these fields, in this order:
+"error_type" (a short name for the error), "fix_commands" (at most {max_suggestions} shell \
+commands to run, most likely first), "explanation" (one sentence) and "confidence" \
+(0 to 1, how sure you are the first command fixes it)."""
+
+
+class StructuredFixParser:
+    """
+    Incrementally parses and validates a streamed FIX_SCHEMA reply
+    
+    Top-level members are decoded as soon as the comma or brace after them
+    arrives, so the caller can stop generation once every required field
+    is present instead of waiting for the model to close the object.
+    """
+    
+    def __init__(self):
+        self.text = ""
+        self.fields: Dict[str, Any] = {}
+        self.closed = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._member_start: Optional[int] = None
+    
+    def feed(self, chunk: str) -> bool:
+        """
+        Add streamed text
+        
+        Args:
+            chunk: Next piece of the response
+            
+        Returns:
+            True once the reply is complete
+        """
+        self.text += chunk
+        text = self.text
+        for i in range(self._pos, len(text)):
+            char = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+                if self._depth == 1:
+                    self._member_start = i + 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0 and self._member_start is not None:
+                    self._take_member(text[self._member_start:i])
+                    self.closed = True
+            elif char == "," and self._depth == 1:
+                self._take_member(text[self._member_start:i])
+                self._member_start = i + 1
+        self._pos = len(text)
+        return self.complete
+    
+    @property
+    def complete(self) -> bool:
+        """Whether all required fields are present or the object has ended"""
+        return self.closed or all(name in self.fields for name in FIX_SCHEMA["required"])
+    
+    def result(self) -> Optional[Dict[str, Any]]:
+        """Return the validated fields, or None if a required one is missing"""
+        if not all(name in self.fields for name in FIX_SCHEMA["required"]):
+            return None
+        return dict(self.fields)
+    
+    def _take_member(self, member: str):
+        """Decode one `"name": value` member and keep it if it is valid"""
+        if not member.strip():
+            return
+        try:
+            ((name, value),) = json.loads("{" + member + "}").items()
+        except (ValueError, TypeError):
+            return
+        valid = _validate_field(name, value)
+        if valid is not None:
+            self.fields[name] = valid
+    
+    @classmethod
+    def parse(cls, text: str) -> Optional[Dict[str, Any]]:
+        """Parse a complete reply"""
+        parser = cls()
+        parser.feed(text)
+        return parser.result()
+
+
+class FixListParser:
+    """
+    Counts the fixes in a streamed prose reply
+    
+    Only numbered items count; bullets are usually prose. An item, with its
+    indented command lines, is complete once the next numbered item starts,
+    so the caller can stop as soon as an item beyond the last wanted fix
+    begins. Servers that honour the stop sequences end the reply there
+    themselves.
+    """
+    
+    def __init__(self, max_suggestions: int):
+        self.max_suggestions = max_suggestions
+        self.suggestions: List[str] = []
+        # Characters at the end of the last chunk that belong to the unwanted item
+        self.excess = 0
+        self._item: Optional[List[str]] = None
+        self._line = ""
+    
+    def feed(self, chunk: str) -> bool:
+        """
+        Add streamed text
+        
+        Args:
+            chunk: Next piece of the response
+            
+        Returns:
+            True once max_suggestions fixes are complete
+        """
+        if self.complete:
+            return True
+        text = self._line + chunk
+        *lines, self._line = text.split("\n")
+        start = 0
+        for line in lines:
+            self._add_line(line)
+            if self.complete:
+                self.excess = min(len(chunk), len(text) - start)
+                return True
+            start += len(line) + 1
+        # Stop on the first characters of the next item rather than its whole line
+        started = len(self.suggestions) + (self._item is not None)
+        if NUMBERED_ITEM.match(self._line) and started >= self.max_suggestions:
+            self._finish_item()
+            self.excess = min(len(chunk), len(self._line))
+        return self.complete
+    
+    def _add_line(self, line: str):
+        if NUMBERED_ITEM.match(line):
+            self._finish_item()
+            self._item = [line.strip()]
+        elif self._item is not None and line.strip():
+            self._item.append(line.strip())
+    
+    def _finish_item(self):
+        if self._item:
+            self.suggestions.append("\n".join(self._item))
+        self._item = None
+    
+    @property
+    def complete(self) -> bool:
+        return len(self.suggestions) >= self.max_suggestions
+
+
+def _validate_field(name: str, value: Any) -> Any:
+    """Check one field against FIX_SCHEMA, returning the cleaned value or None"""
+    if name in ("error_type", "explanation"):
+        return value.strip() if isinstance(value, str) else None
+    if name == "fix_commands":
+        if isinstance(value, str):
+            value = [value]
+        if not isinstance(value, list):
+            return None
+        return [command.strip() for command in value if isinstance(command, str) and command.strip()]
+    if name == "confidence":
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+        return max(0.0, min(1.0, float(value)))
+    return None
 
 
 class OllamaClient:
     """Client for interacting with Ollama local LLM"""
     
+    # Context tokens of the evaluated prompt prefix, per (server, model, prefix),
+    # shared by every client in the process
+    _prefix_contexts: Dict[Tuple[str, str, str], List[int]] = {}
+    # Monotonic time before which a failed prefill is not retried
+    _prefix_failures: Dict[Tuple[str, str, str], float] = {}
+    _prefix_lock = threading.Lock()
+    
     def __init__(self, config: Dict[str, Any] = None):
         """Initialize Ollama client with configuration"""
         self.config = config or OLLAMA_CONFIG
@@ -21,6 +249,10 @@ class OllamaClient:
         self.model = self.config.get("model", "mistral")
         self.timeout = self.config.get("timeout", 10)
         self.temperature = self.config.get("temperature", 0.7)
+        self.output_format = self.config.get("output_format", "text")
+        self.last_stats: Dict[str, Any] = {}
+        self.last_structured: Optional[Dict[str, Any]] = None
+        self.timer = StageTimer()
         self._check_ollama_available()
     
     def _check_ollama_available(self) -> bool:
@@ -57,53 +289,75 @@ class OllamaClient:
         except Exception:
             return []
     
-    def analyze_error(self, error_message: str, context: str = "") -> Optional[str]:
+    def analyze_error(
+        self,
+        error_message: str,
+        context: str = "",
+        environment: str = ""
+    ) -> Optional[str]:
         """
         Analyze an error message using Ollama and return suggestions.
         
         Args:
             error_message: The stderr output to analyze
             context: Optional context (command that was run)
+            environment: Optional environment facts from context.format_context
             
         Returns:
             Suggested fix from LLM
         """
-        if not self.is_available():
+        self.timer.reset()
+        with self.timer.stage("health_probe"):
+            available = self.is_available()
+        if not available:
             return None
         
         # Build prompt
         system_prompt = PROMPT_SETTINGS.get("system_prompt", "")
-        user_prompt = self._build_prompt(error_message, context)
+        with self.timer.stage("prefix"):
+            prefix = self.prefix_context(system_prompt)
+        user_prompt = self._build_prompt(error_message, context, environment, not prefix)
+        self.last_stats = {}
+        self.last_structured = None
         
+        start = time.perf_counter()
+        outcome = "error"
         try:
-            response = requests.post(
-                f"{self.base_url}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": user_prompt,
-                    "system": system_prompt,
-                    "stream": False,
-                    "temperature": self.temperature,
-                    "num_ctx": self.config.get("num_ctx", 2048),
-                },
-                timeout=self.timeout
-            )
+            with self.timer.stage("generate"):
+                response = requests.post(
+                    f"{self.base_url}/api/generate",
+                    json=self._build_payload(user_prompt, system_prompt, stream=False, context=prefix),
+                    timeout=self.timeout
+                )
             
             if response.status_code == 200:
                 data = response.json()
-                return data.get("response", "").strip()
+                self.last_stats = self._extract_stats(data)
+                self.last_stats["logprobs"] = self._extract_logprobs(data)
+                self._record_server_timings(self.last_stats)
+                log_timings("ollama", self.last_timings)
+                outcome = "ok"
+                text = data.get("response", "").strip()
+                if self.structured:
+                    self.last_structured = StructuredFixParser.parse(text)
+                return text
             return None
         except requests.Timeout:
+            outcome = "timeout"
             return None
         except Exception as e:
             if FEATURES.get("verbose"):
                 print(f"Error calling Ollama: {e}")
             return None
+        finally:
+            metrics.OLLAMA_REQUESTS.inc(mode="blocking", outcome=outcome)
+            metrics.OLLAMA_LATENCY.observe(time.perf_counter() - start, mode="blocking")
     
     def analyze_error_stream(
         self, 
         error_message: str, 
-        context: str = ""
+        context: str = "",
+        environment: str = ""
     ) -> Generator[str, None, None]:
         """
         Analyze error and stream responses back (real-time suggestions).
@@ -111,42 +365,234 @@ class OllamaClient:
         Args:
             error_message: The stderr to analyze
             context: Optional command context
+            environment: Optional environment facts from context.format_context
             
         Yields:
             Chunks of the LLM response
         """
-        if not self.is_available():
+        self.timer.reset()
+        with self.timer.stage("health_probe"):
+            available = self.is_available()
+        if not available:
             return
         
         system_prompt = PROMPT_SETTINGS.get("system_prompt", "")
-        user_prompt = self._build_prompt(error_message, context)
+        with self.timer.stage("prefix"):
+            prefix = self.prefix_context(system_prompt)
+        user_prompt = self._build_prompt(error_message, context, environment, not prefix)
+        self.last_stats = {}
+        self.last_structured = None
+        if self.structured:
+            parser = StructuredFixParser()
+        else:
+            parser = FixListParser(PROMPT_SETTINGS.get("max_suggestions", 3))
+        response = None
+        logprobs = []
+        start = time.perf_counter()
+        first_token = True
+        outcome = "error"
         
         try:
             response = requests.post(
                 f"{self.base_url}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": user_prompt,
-                    "system": system_prompt,
-                    "stream": True,
-                    "temperature": self.temperature,
-                    "num_ctx": self.config.get("num_ctx", 2048),
-                },
+                json=self._build_payload(user_prompt, system_prompt, stream=True, context=prefix),
                 timeout=self.timeout,
                 stream=True
             )
+            self.timer.since("connect", start)
             
             if response.status_code == 200:
                 for line in response.iter_lines():
                     if line:
                         data = json.loads(line)
+                        logprobs.extend(self._extract_logprobs(data))
+                        if data.get("done"):
+                            self.last_stats = self._extract_stats(data)
                         chunk = data.get("response", "")
                         if chunk:
-                            yield chunk
+                            if first_token:
+                                self.timer.since("first_token", start)
+                                first_token = False
+                            done = parser.feed(chunk)
+                            if done and not self.structured:
+                                # Drop the start of the item beyond the last wanted fix
+                                chunk = chunk[:len(chunk) - parser.excess]
+                            if chunk:
+                                yield chunk
+                            if done:
+                                # The answer is complete; anything after it is padding
+                                self.last_stats["early_stop"] = not data.get("done")
+                                break
+                outcome = "ok"
+        except requests.Timeout:
+            outcome = "timeout"
         except Exception:
             pass
+        finally:
+            if response is not None:
+                # Closing the connection makes Ollama stop generating
+                response.close()
+            if self.structured:
+                self.last_structured = parser.result()
+            metrics.OLLAMA_REQUESTS.inc(mode="stream", outcome=outcome)
+            metrics.OLLAMA_LATENCY.observe(time.perf_counter() - start, mode="stream")
+            self.last_stats["logprobs"] = logprobs
+            self.timer.since("generate", start)
+            self._record_server_timings(self.last_stats)
+            log_timings("ollama", self.last_timings)
+    
+    @property
+    def last_timings(self) -> Dict[str, Any]:
+        """Per-stage timings of the last request (empty unless DEBUG["benchmark"])"""
+        return self.timer.as_dict()
     
-    def _build_prompt(self, error_message: str, context: str = "") -> str:
+    def _record_server_timings(self, stats: Dict[str, Any]):
+        """Convert Ollama's nanosecond durations into timer stages"""
+        for field, stage in (("load_duration", "model_load"),
+                             ("prompt_eval_duration", "prefill"),
+                             ("eval_duration", "eval")):
+            if field in stats:
+                self.timer.set(f"{stage}_ms", stats[field] / 1e6)
+        if stats.get("eval_duration") and "eval_count" in stats:
+            self.timer.set("tokens_per_s", stats["eval_count"] / (stats["eval_duration"] / 1e9))
+    
+    @property
+    def structured(self) -> bool:
+        """Whether replies are requested as FIX_SCHEMA JSON"""
+        return self.output_format in ("schema", "json")
+    
+    def instructions(self) -> str:
+        """The fixed instructions for the configured output format"""
+        template = JSON_INSTRUCTIONS if self.structured else LIST_INSTRUCTIONS
+        format_instructions = template.format(
+            max_suggestions=PROMPT_SETTINGS.get("max_suggestions", 3)
+        )
+        return f"{PROMPT_INSTRUCTIONS}\n{format_instructions}"
+    
+    def generation_options(self) -> Dict[str, Any]:
+        """
+        Limits that end generation as soon as a full answer is possible
+        
+        num_predict allows OLLAMA_CONFIG["tokens_per_suggestion"] tokens for each
+        of PROMPT_SETTINGS["max_suggestions"] fixes plus NUM_PREDICT_OVERHEAD,
+        unless OLLAMA_CONFIG["num_predict"] is set. Prose replies also stop
+        where a fix beyond the last wanted one would begin.
+        """
+        max_suggestions = PROMPT_SETTINGS.get("max_suggestions", 3)
+        num_predict = self.config.get("num_predict") or (
+            NUM_PREDICT_OVERHEAD + max_suggestions * self.config.get("tokens_per_suggestion", 48)
+        )
+        options: Dict[str, Any] = {"num_predict": num_predict}
+        if not self.structured:
+            options["stop"] = [f"\n{max_suggestions + 1}.", f"\n{max_suggestions + 1})"]
+        return options
+    
+    def prefix_context(self, system_prompt: str) -> Optional[List[int]]:
+        """
+        Return context tokens for the fixed system prompt and instructions
+        
+        The first call per server and model evaluates the prefix with a
+        one-token generation and keeps the `context` Ollama returns. Later
+        requests send those tokens instead of the system prompt and
+        instructions, so only the error-specific text is prefilled.
+        
+        Args:
+            system_prompt: The system prompt the prefix starts with
+            
+        Returns:
+            Context tokens, or None when reuse is disabled or unsupported
+        """
+        if not self.config.get("reuse_prefix", False):
+            return None
+        prefix_prompt = PREFIX_PROMPT.format(instructions=self.instructions())
+        digest = hashlib.sha1(f"{system_prompt}\0{prefix_prompt}".encode()).hexdigest()
+        key = (self.base_url, self.model, digest)
+        with self._prefix_lock:
+            if key in self._prefix_contexts:
+                return self._prefix_contexts[key] or None
+            if time.monotonic() < self._prefix_failures.get(key, 0.0):
+                return None
+        
+        tokens = None
+        try:
+            response = requests.post(
+                f"{self.base_url}/api/generate",
+                json={
+                    "model": self.model,
+                    "prompt": prefix_prompt,
+                    "system": system_prompt,
+                    "stream": False,
+                    # A different num_ctx would make Ollama reload the model
+                    "options": {"num_predict": 1, "num_ctx": self.config.get("num_ctx", 2048)},
+                },
+                # A slow prefill must not cost a whole generate timeout on top of the request
+                timeout=min(self.timeout, self.config.get("prefix_timeout", 3))
+            )
+            if response.status_code == 200:
+                tokens = response.json().get("context") or []
+        except Exception:
+            pass
+        
+        with self._prefix_lock:
+            if tokens is None:
+                # Back off so a struggling server is not prefilled before every request
+                self._prefix_failures[key] = time.monotonic() + self.config.get("prefix_retry_after", 60)
+            else:
+                # Servers without `context` are remembered too, so they are not probed again
+                self._prefix_contexts[key] = tokens
+                self._prefix_failures.pop(key, None)
+        return tokens or None
+    
+    def _build_payload(
+        self,
+        prompt: str,
+        system_prompt: str,
+        stream: bool,
+        context: Optional[List[int]] = None
+    ) -> Dict[str, Any]:
+        """Build the request body for /api/generate"""
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "system": system_prompt,
+            "stream": stream,
+        }
+        if context:
+            # The system prompt is already part of the context tokens
+            payload["context"] = context
+            del payload["system"]
+        # Ollama reads sampling and model parameters from options only
+        payload["options"] = {
+            "temperature": self.temperature,
+            "num_ctx": self.config.get("num_ctx", 2048),
+        }
+        payload["options"].update(self.generation_options())
+        if self.output_format == "schema":
+            payload["format"] = FIX_SCHEMA
+        elif self.output_format == "json":
+            payload["format"] = "json"
+        if CONFIDENCE_CONFIG.get("request_logprobs"):
+            payload["logprobs"] = True
+        return payload
+    
+    @staticmethod
+    def _extract_stats(data: Dict[str, Any]) -> Dict[str, Any]:
+        """Pick the generation statistics out of a final response object"""
+        return {field: data[field] for field in STAT_FIELDS if field in data}
+    
+    @staticmethod
+    def _extract_logprobs(data: Dict[str, Any]) -> list:
+        """Return the token log-probabilities of a response object, if any"""
+        entries = data.get("logprobs") or []
+        return [e["logprob"] for e in entries if isinstance(e, dict) and "logprob" in e]
+    
+    def _build_prompt(
+        self,
+        error_message: str,
+        context: str = "",
+        environment: str = "",
+        instructions: bool = True
+    ) -> str:
         """Build a well-structured prompt for error analysis"""
         prompt = f"""Analyze this command-line error and provide a fix:
 
@@ -158,24 +604,17 @@ Error Output:
         if context:
             prompt += f"\n\nCommand Context: {context}"
         
-        prompt += f"""
-
-Provide a brief, actionable fix that the user can execute immediately.
-Focus on the most likely solution. Be concise."""
+        if environment:
+            prompt += f"\n\nEnvironment:\n{environment}"
+        
+        if instructions:
+            prompt += f"\n\n{self.instructions()}"
         
         return prompt
     
-    def pull_model(self, model_name: str) -> bool:
-        """Download/pull a model from Ollama"""
-        try:
-            response = requests.post(
-                f"{self.base_url}/api/pull",
-                json={"name": model_name},
-                timeout=300  # Long timeout for download
-            )
-            return response.status_code == 200
-        except Exception:
-            return False
+    def pull_model(self, model_name: str, on_progress: Optional[ProgressCallback] = None) -> bool:
+        """Download/pull a model from Ollama, streaming progress to on_progress"""
+        return ModelRegistry(self.base_url).pull(model_name, on_progress)
 
 
 class OllamaManager:
@@ -188,16 +627,30 @@ class OllamaManager:
         return client.is_available()
     
     @staticmethod
-    def ensure_model(model_name: str) -> bool:
-        """Ensure a specific model is available, download if needed"""
-        client = OllamaClient()
-        available_models = client.list_models()
+    def ensure_model(model_name: str, background: bool = False) -> bool:
+        """
+        Ensure a specific model is available, download if needed
+        
+        Availability comes from the model registry cache, so repeated checks
+        do not contact the server until the cache expires.
         
-        if model_name in available_models:
+        Args:
+            model_name: Model to check
+            background: Start a missing model's download without waiting for it
+            
+        Returns:
+            True if the model is available now
+        """
+        registry = ModelRegistry()
+        if registry.has_model(model_name):
             return True
         
+        if background:
+            print(f"Model '{model_name}' not found. Downloading in the background...")
+            registry.pull_in_background(model_name)
+            return False
         print(f"Model '{model_name}' not found. Downloading...")
-        return client.pull_model(model_name)
+        return registry.pull(model_name, print_progress)
     
     @staticmethod
     def get_client() -> OllamaClient:
@@ -0,0 +1,44 @@
+"""
+Machine-readable output for CommandPro CLIs
+
+Emits analysis results as a single JSON document or as a stream of
+newline-delimited JSON (NDJSON) events that tools can consume line by line.
+"""
+
+import json
+import sys
+from typing import Any, Dict, Optional, TextIO
+
+OUTPUT_FORMATS = ("text", "json", "ndjson")
+
+
+def to_json(data: Dict[str, Any]) -> str:
+    """Serialize a result compactly on a single line"""
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def write_json(result: Dict[str, Any], stream: Optional[TextIO] = None):
+    """Write a complete analysis result as one JSON document"""
+    stream = stream or sys.stdout
+    stream.write(to_json(result) + "\n")
+    stream.flush()
+
+
+class EventWriter:
+    """Writes NDJSON events, one object per line, flushed immediately"""
+
+    def __init__(self, stream: Optional[TextIO] = None):
+        self.stream = stream or sys.stdout
+
+    def emit(self, event: str, **fields):
+        """
+        Write a single event
+
+        Args:
+            event: Event name (chunk, classification, token, final)
+            **fields: Event payload
+        """
+        record = {"event": event}
+        record.update(fields)
+        self.stream.write(to_json(record) + "\n")
+        self.stream.flush()
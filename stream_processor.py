@@ -4,11 +4,153 @@ Stream processor for real-time stderr analysis
 Captures command stderr in real-time and processes it with ML.
 """
 
+import asyncio
+import codecs
+import inspect
+import locale
+import os
+import re
+import selectors
+import shlex
+import signal
 import subprocess
+import sys
 import threading
 import time
-from typing import Callable, Optional, Dict, Any
-from ml_config import STREAM_CONFIG
+from typing import Callable, Optional, Dict, Any, Iterable, List, TextIO
+from ml_config import STREAM_CONFIG, DISPLAY_CONFIG
+from instrumentation import StageTimer, log_timings
+import metrics
+
+try:
+    import fcntl
+    import termios
+except ImportError:  # Windows
+    fcntl = termios = None
+
+# Pseudo-terminals are only used on POSIX systems
+HAS_PTY = hasattr(os, "openpty") and os.name == "posix"
+
+# CSI sequences (colors, cursor movement), OSC sequences (titles, links)
+# and two-character escapes
+ANSI_ESCAPE = re.compile(
+    r"\x1b\[[0-?]*[ -/]*[@-~]|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|\x1b[@-Z\\-_]"
+)
+
+
+# Escape sequences plus control characters other than tab, newline and CR
+_TERMINAL_NOISE = re.compile(ANSI_ESCAPE.pattern + r"|[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+# Any byte _normalize acts on: escapes, stray controls and carriage returns
+_CONTROL = re.compile(r"[\x00-\x08\x0b-\x1f\x7f]")
+
+_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+def strip_ansi(text: str) -> str:
+    """Remove terminal escape sequences so patterns see plain text"""
+    return ANSI_ESCAPE.sub("", text)
+
+
+class OutputNormalizer:
+    """
+    Incrementally turns raw terminal output into plain text
+    
+    Bytes go in as they are read and complete lines come out decoded, with
+    escape sequences and stray control characters removed and carriage-return
+    progress bars collapsed to the last state they drew. The encoding is
+    detected from a BOM or UTF-16 NUL bytes, starts as UTF-8, and switches
+    to STREAM_CONFIG["fallback_encoding"] (default: the locale's) the first
+    time the output is not valid UTF-8.
+    """
+    
+    def __init__(self, fallback_encoding: Optional[str] = None):
+        self.fallback_encoding = (
+            fallback_encoding
+            or STREAM_CONFIG.get("fallback_encoding")
+            or locale.getpreferredencoding(False)
+        )
+        self.encoding: Optional[str] = None
+        self._decoder = None
+        self._pending = ""
+    
+    def feed(self, data: bytes) -> str:
+        """
+        Add raw output
+        
+        Args:
+            data: Bytes read from the stream
+            
+        Returns:
+            Normalized text for every line completed so far (may be empty)
+        """
+        self._pending += self._decode(data)
+        end = self._pending.rfind("\n") + 1
+        if not end:
+            self._collapse_pending()
+            return ""
+        complete, self._pending = self._pending[:end], self._pending[end:]
+        return self._normalize(complete)
+    
+    def finish(self) -> str:
+        """Return the normalized text of the unterminated last line"""
+        if self._decoder is not None:
+            self._pending += self._decoder.decode(b"", final=True)
+        text, self._pending = self._pending, ""
+        return self._normalize(text)
+    
+    def normalize(self, data: bytes) -> str:
+        """Normalize a complete output in one call"""
+        return self.feed(data) + self.finish()
+    
+    def _decode(self, data: bytes) -> str:
+        if self._decoder is None:
+            self.encoding = _detect_encoding(data)
+            errors = "replace" if self.encoding != "utf-8" else "strict"
+            self._decoder = codecs.getincrementaldecoder(self.encoding)(errors=errors)
+        try:
+            return self._decoder.decode(data)
+        except UnicodeDecodeError:
+            # Not UTF-8 after all: decode this chunk and the rest with the fallback
+            buffered, _ = self._decoder.getstate()
+            self.encoding = self.fallback_encoding
+            self._decoder = codecs.getincrementaldecoder(self.encoding)(errors="replace")
+            return self._decoder.decode(buffered + data)
+    
+    def _collapse_pending(self):
+        """Keep only the last redraw of a line that has not ended yet"""
+        last = self._pending.rfind("\r")
+        cut = self._pending.rfind("\r", 0, last) if last > 0 else -1
+        if cut > 0:
+            self._pending = self._pending[cut:]
+    
+    @staticmethod
+    def _normalize(text: str) -> str:
+        if not _CONTROL.search(text):
+            # Plain text, the common case: nothing to strip or collapse
+            return text
+        text = _TERMINAL_NOISE.sub("", text)
+        if "\r" not in text:
+            return text
+        lines = text.split("\n")
+        for i, line in enumerate(lines):
+            if "\r" in line:
+                lines[i] = next((part for part in reversed(line.split("\r")) if part), "")
+        return "\n".join(lines)
+
+
+def _detect_encoding(data: bytes) -> str:
+    """Guess the encoding of a stream from its first bytes"""
+    for bom, encoding in _BOMS:
+        if data.startswith(bom):
+            return encoding
+    # ASCII text in UTF-16 (e.g. redirected PowerShell output) alternates with NULs
+    if len(data) >= 4 and data[1] == 0 and data[3] == 0 and data[0] and data[2]:
+        return "utf-16-le"
+    return "utf-8"
 
 
 class StreamProcessor:
@@ -29,6 +171,8 @@ class StreamProcessor:
         self.buffer = ""
         self.lock = threading.Lock()
         self.config = STREAM_CONFIG
+        self.timer = StageTimer()
+        self.normalizer = OutputNormalizer()
     
     def process_stderr(self, process: subprocess.Popen) -> str:
         """
@@ -40,40 +184,89 @@ class StreamProcessor:
         Returns:
             Complete stderr output
         """
-        stderr_output = ""
+        parts: List[str] = []
+        timing = self.timer.enabled
+        self.timer.reset()
+        reads = 0
+        raw_bytes = 0
+        # Whatever is available, not whole lines: \r progress bars never end a line
+        read = getattr(process.stderr, "read1", process.stderr.read)
+        read_size = self.config.get("buffer_size", 65536)
         
         try:
-            for line in iter(process.stderr.readline, b''):
-                if not line:
+            read_start = time.perf_counter() if timing else 0.0
+            while True:
+                data = read(read_size)
+                if not data:
                     break
+                if timing:
+                    self.timer.add("read", (time.perf_counter() - read_start) * 1000)
+                    reads += 1
                 
-                decoded = line.decode('utf-8', errors='replace')
-                stderr_output += decoded
+                raw_bytes += len(data)
+                text = self.normalizer.feed(data)
+                if text:
+                    parts.append(text)
+                    self.feed(text)
                 
-                with self.lock:
-                    self.buffer += decoded
-                    
-                    # Check if we have enough to process
-                    if self._should_process():
-                        chunk = self.buffer
-                        self.buffer = ""
-                        
-                        if self.on_chunk:
-                            self.on_chunk(chunk)
+                if timing:
+                    read_start = time.perf_counter()
             
-            # Process any remaining buffer
-            with self.lock:
-                if self.buffer.strip():
-                    if self.on_chunk:
-                        self.on_chunk(self.buffer)
-                    if self.on_complete:
-                        self.on_complete(stderr_output)
+            text = self.normalizer.finish()
+            if text:
+                parts.append(text)
+                self.feed(text)
+            self.flush("".join(parts))
         
         except Exception as e:
             print(f"Error processing stream: {e}")
         
+        stderr_output = "".join(parts)
+        metrics.STDERR_BYTES.inc(raw_bytes)
+        if timing:
+            self.timer.set("reads", reads)
+            self.timer.set("raw_bytes", raw_bytes)
+            self.timer.set("bytes", len(stderr_output))
+            log_timings("stream_processor", self.timer.as_dict())
         return stderr_output
     
+    def feed(self, text: str):
+        """
+        Add decoded stderr text, passing the buffer to on_chunk once it is large enough
+        
+        Args:
+            text: Newly read stderr text
+        """
+        with self.lock:
+            self.buffer += text
+            
+            # Check if we have enough to process
+            if self._should_process():
+                chunk = self.buffer
+                self.buffer = ""
+                
+                if self.on_chunk:
+                    if self.timer.enabled:
+                        with self.timer.stage("callback"):
+                            self.on_chunk(chunk)
+                    else:
+                        self.on_chunk(chunk)
+    
+    def flush(self, output: str):
+        """
+        Process any remaining buffer at the end of the stream
+        
+        Args:
+            output: Complete stderr output, passed to on_complete
+        """
+        with self.lock:
+            if self.buffer.strip():
+                if self.on_chunk:
+                    self.on_chunk(self.buffer)
+                if self.on_complete:
+                    self.on_complete(output)
+            self.buffer = ""
+    
     def _should_process(self) -> bool:
         """Check if buffer has enough data to process"""
         min_size = self.config.get("min_chunk_size", 50)
@@ -93,7 +286,8 @@ class CommandWrapper:
         command: str,
         on_stderr_chunk: Optional[Callable[[str], None]] = None,
         capture_stdout: bool = True,
-        shell: bool = True
+        shell: bool = True,
+        use_pty: Optional[bool] = None
     ) -> Dict[str, Any]:
         """
         Run a command and capture both stdout and stderr.
@@ -103,10 +297,17 @@ class CommandWrapper:
             on_stderr_chunk: Callback for stderr chunks
             capture_stdout: Whether to capture stdout
             shell: Run through shell (True for PowerShell commands)
+            use_pty: Attach the command to pseudo-terminals instead of pipes
+                     (default STREAM_CONFIG["use_pty"]; ignored where unsupported)
             
         Returns:
             Dictionary with returncode, stdout, stderr
         """
+        if use_pty is None:
+            use_pty = STREAM_CONFIG.get("use_pty", False)
+        if use_pty and HAS_PTY:
+            return CommandWrapper.run_with_pty(command, on_stderr_chunk, capture_stdout, shell)
+        
         processor = StreamProcessor(on_chunk=on_stderr_chunk)
         
         try:
@@ -116,30 +317,39 @@ class CommandWrapper:
                 stdout=subprocess.PIPE if capture_stdout else None,
                 stderr=subprocess.PIPE,
                 shell=shell,
-                text=False,
-                bufsize=1
+                text=False
             )
             
-            # Capture stdout
-            stdout_output = ""
-            stderr_output = ""
+            # Drain stdout concurrently so a full stdout pipe cannot block the
+            # command while stderr is being read
+            stdout_parts = []
+            reader = None
+            if capture_stdout and process.stdout:
+                reader = threading.Thread(
+                    target=lambda: stdout_parts.append(process.stdout.read()),
+                    daemon=True
+                )
+                reader.start()
             
             # Process stderr in real-time
             stderr_output = processor.process_stderr(process)
             
-            # Get stdout if capturing
-            if capture_stdout and process.stdout:
-                stdout_output = process.stdout.read().decode('utf-8', errors='replace')
+            if reader:
+                reader.join()
+            stdout_output = OutputNormalizer().normalize(b"".join(stdout_parts))
             
             # Wait for process to complete
             return_code = process.wait()
             
-            return {
+            result = {
                 "returncode": return_code,
                 "stdout": stdout_output,
                 "stderr": stderr_output,
                 "success": return_code == 0
             }
+            if processor.timer.enabled:
+                result["timings"] = processor.timer.as_dict()
+            return result
         
         except Exception as e:
             return {
@@ -149,25 +359,390 @@ class CommandWrapper:
                 "success": False,
                 "error": str(e)
             }
+    
+    @staticmethod
+    def run_with_pty(
+        command: str,
+        on_stderr_chunk: Optional[Callable[[str], None]] = None,
+        capture_stdout: bool = True,
+        shell: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Run a command attached to pseudo-terminals (POSIX only)
+        
+        Many tools switch to block buffering and drop colors when their
+        output is a pipe. Here stdout and stderr each get their own
+        pseudo-terminal, so the command behaves as it would interactively
+        and stderr still arrives separately. on_stderr_chunk receives the
+        output as the terminal would show it, colors included; the returned
+        stdout and stderr go through OutputNormalizer for matching.
+        
+        Args:
+            command: Command to run (string)
+            on_stderr_chunk: Callback for stderr chunks
+            capture_stdout: Whether to capture stdout
+            shell: Run through shell
+            
+        Returns:
+            Dictionary with returncode, stdout, stderr and pty=True
+        """
+        processor = StreamProcessor(on_chunk=on_stderr_chunk)
+        fds = []
+        
+        try:
+            err_master, err_slave = os.openpty()
+            fds += [err_master, err_slave]
+            out_master = out_slave = None
+            if capture_stdout:
+                out_master, out_slave = os.openpty()
+                fds += [out_master, out_slave]
+            for slave in (err_slave, out_slave):
+                if slave is not None:
+                    _copy_window_size(slave)
+            
+            process = subprocess.Popen(
+                command,
+                stdout=out_slave,
+                stderr=err_slave,
+                shell=shell
+            )
+            # Only the child keeps the slave ends open, so reads hit EOF when it exits
+            for slave in (err_slave, out_slave):
+                if slave is not None:
+                    os.close(slave)
+                    fds.remove(slave)
+            
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            normalizer = OutputNormalizer()
+            stderr_parts = []
+            stdout_parts = []
+            raw_bytes = 0
+            
+            with selectors.DefaultSelector() as selector:
+                selector.register(err_master, selectors.EVENT_READ)
+                if out_master is not None:
+                    selector.register(out_master, selectors.EVENT_READ)
+                
+                while selector.get_map():
+                    for key, _ in selector.select():
+                        try:
+                            data = os.read(key.fd, 65536)
+                        except OSError:
+                            # Linux reports EIO once the slave side is closed
+                            data = b""
+                        if not data:
+                            selector.unregister(key.fd)
+                            continue
+                        if key.fd == err_master:
+                            raw_bytes += len(data)
+                            processor.feed(decoder.decode(data))
+                            stderr_parts.append(normalizer.feed(data))
+                        else:
+                            stdout_parts.append(data)
+            
+            processor.feed(decoder.decode(b"", final=True))
+            stderr_parts.append(normalizer.finish())
+            stderr_output = "".join(stderr_parts)
+            processor.flush(stderr_output)
+            metrics.STDERR_BYTES.inc(raw_bytes)
+            
+            return_code = process.wait()
+            
+            result = {
+                "returncode": return_code,
+                "stdout": OutputNormalizer().normalize(b"".join(stdout_parts)),
+                "stderr": stderr_output,
+                "success": return_code == 0,
+                "pty": True
+            }
+            if processor.timer.enabled:
+                result["timings"] = processor.timer.as_dict()
+            return result
+        
+        except Exception as e:
+            return {
+                "returncode": -1,
+                "stdout": "",
+                "stderr": str(e),
+                "success": False,
+                "error": str(e)
+            }
+        
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+
+def _copy_window_size(fd: int):
+    """Give a pseudo-terminal the size of our own terminal, if we have one"""
+    if fcntl is None or not sys.stdout.isatty():
+        return
+    try:
+        size = fcntl.ioctl(sys.stdout.fileno(), termios.TIOCGWINSZ, b"\0" * 8)
+        fcntl.ioctl(fd, termios.TIOCSWINSZ, size)
+    except (OSError, ValueError):
+        pass
+
+
+class AsyncCommandWrapper:
+    """Runs commands on an asyncio event loop and captures their streams"""
+    
+    def __init__(self, timeout: Optional[float] = None):
+        """
+        Initialize the wrapper
+        
+        Args:
+            timeout: Seconds before a command is killed (default STREAM_CONFIG)
+        """
+        self.timeout = timeout if timeout is not None else STREAM_CONFIG.get("command_timeout")
+        self.kill_grace = STREAM_CONFIG.get("kill_grace", 2.0)
+        self.min_chunk_size = STREAM_CONFIG.get("min_chunk_size", 50)
+        self.read_size = STREAM_CONFIG.get("buffer_size", 65536)
+    
+    async def run_with_capture(
+        self,
+        command: str,
+        on_stderr_chunk: Optional[Callable[[str], Any]] = None,
+        capture_stdout: bool = True,
+        shell: bool = True,
+        timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Run a command and capture both stdout and stderr.
+        
+        The command runs in its own process group. On timeout or when the
+        calling task is cancelled the whole group is terminated, then killed
+        after STREAM_CONFIG["kill_grace"] seconds.
+        
+        Args:
+            command: Command to run (string)
+            on_stderr_chunk: Callback for stderr chunks; may be a coroutine function
+            capture_stdout: Whether to capture stdout
+            shell: Run through shell
+            timeout: Override the wrapper's timeout for this command
+            
+        Returns:
+            Dictionary with returncode, stdout, stderr, success and timed_out
+        """
+        timeout = self.timeout if timeout is None else timeout
+        stdout = asyncio.subprocess.PIPE if capture_stdout else None
+        group = {"start_new_session": True} if os.name == "posix" else {}
+        try:
+            if shell:
+                process = await asyncio.create_subprocess_shell(
+                    command, stdout=stdout, stderr=asyncio.subprocess.PIPE, **group)
+            else:
+                process = await asyncio.create_subprocess_exec(
+                    *shlex.split(command), stdout=stdout, stderr=asyncio.subprocess.PIPE, **group)
+        except OSError as e:
+            return {"returncode": -1, "stdout": "", "stderr": str(e),
+                    "success": False, "timed_out": False, "error": str(e)}
+        
+        # Output read so far survives a timeout
+        stderr_parts: List[str] = []
+        stdout_parts: List[bytes] = []
+        readers = asyncio.gather(
+            self._read_stderr(process.stderr, on_stderr_chunk, stderr_parts),
+            _drain(process.stdout, stdout_parts),
+        )
+        timed_out = False
+        try:
+            await asyncio.wait_for(readers, timeout)
+            return_code = await process.wait()
+        except asyncio.TimeoutError:
+            timed_out = True
+            await self._terminate(process)
+            return_code = process.returncode
+        except asyncio.CancelledError:
+            await asyncio.shield(self._terminate(process))
+            raise
+        except Exception:
+            # A failed reader must not leave the command running unattended
+            readers.cancel()
+            await asyncio.shield(self._terminate(process))
+            raise
+        
+        stderr_output = "".join(stderr_parts)
+        metrics.STDERR_BYTES.inc(len(stderr_output))
+        return {
+            "returncode": return_code,
+            "stdout": OutputNormalizer().normalize(b"".join(stdout_parts)),
+            "stderr": stderr_output,
+            "success": return_code == 0 and not timed_out,
+            "timed_out": timed_out
+        }
+    
+    async def run_many(
+        self,
+        commands: List[str],
+        concurrency: int = 64,
+        on_stderr_chunk: Optional[Callable[[int, str], Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Run many commands on one event loop, at most `concurrency` at a time
+        
+        Args:
+            commands: Commands to run
+            concurrency: Commands running at once
+            on_stderr_chunk: Callback receiving (command index, chunk)
+            
+        Returns:
+            Results in input order
+        """
+        slots = asyncio.Semaphore(concurrency)
+        
+        async def run(index: int, command: str) -> Dict[str, Any]:
+            callback = None
+            if on_stderr_chunk:
+                callback = lambda chunk: on_stderr_chunk(index, chunk)
+            async with slots:
+                return await self.run_with_capture(command, on_stderr_chunk=callback)
+        
+        return await asyncio.gather(*(run(i, c) for i, c in enumerate(commands)))
+    
+    async def _read_stderr(
+        self,
+        stream: asyncio.StreamReader,
+        on_chunk: Optional[Callable[[str], Any]],
+        parts: List[str]
+    ):
+        """Read stderr into parts, passing chunks of min_chunk_size to the callback"""
+        normalizer = OutputNormalizer()
+        pending = ""
+        while True:
+            # Fixed-size reads: readline() fails on long runs without a newline (\r redraws)
+            data = await stream.read(self.read_size)
+            text = normalizer.feed(data) if data else normalizer.finish()
+            parts.append(text)
+            pending += text
+            if not data:
+                break
+            if on_chunk and len(pending) >= self.min_chunk_size:
+                await _call(on_chunk, pending)
+                pending = ""
+        if on_chunk and pending.strip():
+            await _call(on_chunk, pending)
+    
+    async def _terminate(self, process: asyncio.subprocess.Process):
+        """Terminate the command's process group, killing it if it lingers"""
+        if process.returncode is not None:
+            return
+        _signal_group(process, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), self.kill_grace)
+        except asyncio.TimeoutError:
+            _signal_group(process, getattr(signal, "SIGKILL", signal.SIGTERM))
+            await process.wait()
+
+
+def _signal_group(process: asyncio.subprocess.Process, sig: int):
+    """Signal a process and everything it spawned"""
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, sig)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+async def _call(callback: Callable[[str], Any], chunk: str):
+    """Invoke a plain or coroutine callback"""
+    result = callback(chunk)
+    if inspect.isawaitable(result):
+        await result
+
+
+async def _drain(stream: Optional[asyncio.StreamReader], parts: List[bytes]):
+    """Read a stream to EOF into parts"""
+    while stream:
+        data = await stream.read(65536)
+        if not data:
+            return
+        parts.append(data)
 
 
 class RealTimeDisplay:
     """Displays real-time suggestions as they're generated"""
     
-    def __init__(self):
+    def __init__(self, stream: Optional[TextIO] = None):
+        self.stream = stream or sys.stdout
         self.buffer = ""
         self.is_printing = False
+        self.is_tty = bool(getattr(self.stream, "isatty", None) and self.stream.isatty())
+        self.timer = StageTimer()
     
-    def stream_display(self, text_generator):
-        """Stream text to display character by character"""
-        delay = STREAM_CONFIG.get("display_delay", 0.1)
+    def stream_display(self, text_generator: Iterable[str]) -> str:
+        """
+        Stream text to the display, coalescing writes into frames.
+        
+        On a terminal, pending text is flushed at most STREAM_CONFIG["display_fps"]
+        times per second so partial lines appear as they arrive. Otherwise only whole
+        lines are written and flushed once at the end. Output stops after
+        DISPLAY_CONFIG["max_output_lines"] lines, but the generator is still
+        consumed so the full text can be returned.
+        
+        Args:
+            text_generator: Iterable of text chunks
+            
+        Returns:
+            The complete streamed text
+        """
+        fps = STREAM_CONFIG.get("display_fps", 30)
+        frame_interval = 1.0 / fps if fps else 0.0
+        max_lines = DISPLAY_CONFIG.get("max_output_lines", 50)
+        
+        parts = []
+        pending = ""
+        lines_shown = 0
+        truncated = False
+        last_flush = time.monotonic()
+        self.is_printing = True
+        self.timer.reset()
+        start = time.perf_counter()
+        rendered = 0
         
         for chunk in text_generator:
-            for char in chunk:
-                print(char, end='', flush=True)
-                time.sleep(delay / 1000)  # Small delay for effect
+            parts.append(chunk)
+            if truncated:
+                continue
+            if not rendered:
+                self.timer.since("first_chunk", start)
+            
+            pending += chunk
+            if max_lines and lines_shown + pending.count("\n") > max_lines:
+                # Cut at the last permitted line and stop rendering
+                keep = max_lines - lines_shown
+                head = pending.split("\n", keep)[:keep]
+                self.stream.write("\n".join(head) + "\n... (output truncated)")
+                pending = ""
+                truncated = True
+                continue
+            
+            rendered += 1
+            with self.timer.stage("render"):
+                if self.is_tty:
+                    now = time.monotonic()
+                    if now - last_flush >= frame_interval:
+                        lines_shown += pending.count("\n")
+                        self.stream.write(pending)
+                        self.stream.flush()
+                        pending = ""
+                        last_flush = now
+                elif "\n" in pending:
+                    complete, pending = pending.rsplit("\n", 1)
+                    lines_shown += complete.count("\n") + 1
+                    self.stream.write(complete + "\n")
         
-        print()  # Newline at end
+        with self.timer.stage("render"):
+            self.stream.write(pending + "\n")
+            self.stream.flush()
+        self.timer.since("total", start)
+        self.timer.set("chunks", len(parts))
+        log_timings("display", self.timer.as_dict())
+        self.is_printing = False
+        self.buffer = "".join(parts)
+        return self.buffer
     
     def display_suggestion(self, suggestion: str):
         """Display a suggestion nicely"""
@@ -1,9 +1,73 @@
 #!/usr/bin/env python3
 """Unit tests for CommandPro"""
 
+import asyncio
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from analyzer import ErrorAnalyzer
-from knowledge_base import find_error_type, get_all_patterns
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from unittest import mock
+import config
+from analyzer import ErrorAnalyzer, match_parallel
+from knowledge_base import (
+    find_error_type, find_error_type_id, find_error_type_windowed, get_all_patterns,
+    get_error_type, iter_shards, load_pattern_pack
+)
+from batch import BatchRunner
+from benchmarks import compare
+from cli import main as cli_main
+import context
+from context import collect_context, command_binary, describe_exit_code
+import ml_cli
+from ml_cli import MLErrorProcessor
+from admission import AdmissionController
+import metrics
+from ml_config import (
+    ADMISSION_CONFIG, DEBUG, DISPLAY_CONFIG, HISTORY_CONFIG, OLLAMA_CONFIG, PROMPT_SETTINGS,
+    REGISTRY_CONFIG
+)
+from model_registry import ModelRegistry
+from ollama_client import (
+    FIX_SCHEMA, PROMPT_INSTRUCTIONS, FixListParser, OllamaClient, StructuredFixParser
+)
+from output import EventWriter
+from fake_ollama import FakeOllamaServer
+from follow import iter_findings
+from history import HistoryStore, fingerprint
+from learn import propose, write_pack
+from scanner import classify, iter_records, scan_paths
+from stream_processor import (
+    HAS_PTY, AsyncCommandWrapper, CommandWrapper, OutputNormalizer, RealTimeDisplay, strip_ansi
+)
+import knowledge_base
+
+
+_packs_dir = tempfile.TemporaryDirectory()
+_pack_patchers = [
+    mock.patch.object(config, "CUSTOM_PATTERNS_FILE", None),
+    mock.patch.object(config, "LEARNED_PATTERNS_FILE", os.path.join(_packs_dir.name, "learned.json")),
+]
+
+
+def setUpModule():
+    """Keep the developer's pattern packs out of the CLI entry points under test"""
+    for patcher in _pack_patchers:
+        patcher.start()
+
+
+def tearDownModule():
+    for patcher in _pack_patchers:
+        patcher.stop()
+    _packs_dir.cleanup()
 
 
 class TestErrorAnalyzer(unittest.TestCase):
@@ -99,6 +163,23 @@ class TestErrorAnalyzer(unittest.TestCase):
         result1 = ErrorAnalyzer.analyze("command not found")
         result2 = ErrorAnalyzer.analyze("COMMAND NOT FOUND")
         self.assertEqual(result1["error_type"], result2["error_type"])
+    
+    def test_classify_references_knowledge_base(self):
+        """Test that classify shares knowledge-base data instead of copying it"""
+        message = "ModuleNotFoundError: No module named 'x'"
+        result = ErrorAnalyzer.classify(message)
+        self.assertEqual(result.type_id, find_error_type_id(message))
+        self.assertIs(result.solutions, get_error_type(result.type_id).solutions)
+        self.assertFalse(hasattr(result, "__dict__"))
+        with self.assertRaises(AttributeError):
+            result.success = False
+    
+    def test_classify_to_dict_matches_analyze(self):
+        """Test that to_dict keeps the analyze() result shape"""
+        for message in ["disk full", "nothing recognizable here", ""]:
+            self.assertEqual(ErrorAnalyzer.classify(message).to_dict(),
+                             ErrorAnalyzer.analyze(message))
+        self.assertEqual(ErrorAnalyzer.analyze("")["solutions"], [])
 
 
 class TestKnowledgeBase(unittest.TestCase):
@@ -128,6 +209,1019 @@ class TestKnowledgeBase(unittest.TestCase):
         """Test finding unknown error type"""
         error_type = find_error_type("completely unknown error xyz 123")
         self.assertIsNone(error_type)
+    
+    def test_compiled_table(self):
+        """Test that the compiled table mirrors ERROR_PATTERNS with integer IDs"""
+        for type_id, entry in enumerate(get_all_patterns()):
+            error_type = get_error_type(type_id)
+            self.assertEqual(error_type.id, type_id)
+            self.assertEqual(error_type.name, entry["name"])
+            self.assertEqual(error_type.solutions, tuple(entry["solutions"]))
+        type_id = find_error_type_id("Permission denied")
+        self.assertEqual(get_error_type(type_id).name, "Permission Denied")
+    
+    def test_sharded_matching_keeps_first_match_order(self):
+        """Test that sharded and parallel matching agree with a whole-text search"""
+        noise = "INFO step ok\n" * 500
+        message = noise + "Permission denied\n" + noise + "command not found\n" + noise
+        whole = find_error_type_id(message)
+        self.assertEqual(whole, find_error_type_id("command not found"))
+        with mock.patch.object(config, "MATCH_SHARD_SIZE", 1000):
+            self.assertEqual(find_error_type_id(message), whole)
+        self.assertEqual(match_parallel(message, jobs=2, shard_size=1000), whole)
+        self.assertIsNone(match_parallel(noise * 4, jobs=2, shard_size=1000))
+    
+    def test_windowed_matching_reports_region(self):
+        """Test that the tail and anchor windows are searched before the full text"""
+        noise = "INFO step ok\n" * 2000
+        tail_hit = noise + "ERROR: disk full\n"
+        anchor_hit = noise + "Traceback:\nModuleNotFoundError: x\n" + noise
+        buried = "no space left on device\n" + noise + noise
+        self.assertEqual(find_error_type_windowed(tail_hit)[1].name, "tail")
+        type_id, region = find_error_type_windowed(anchor_hit)
+        self.assertEqual(get_error_type(type_id).name, "Module or Package Not Found")
+        self.assertEqual(region.name, "anchor")
+        self.assertIn("Traceback:", anchor_hit[region.start:region.end])
+        type_id, region = find_error_type_windowed(buried)
+        self.assertEqual((get_error_type(type_id).name, region.name), ("Disk Space Error", "full"))
+        result = ErrorAnalyzer.analyze(tail_hit)
+        self.assertEqual(result["match_region"]["name"], "tail")
+    
+    def test_shards_overlap_line_aligned(self):
+        """Test that shards cover the text and start at line boundaries"""
+        text = "".join(f"line {i}\n" for i in range(200))
+        shards = list(iter_shards(text, 100, 20))
+        self.assertGreater(len(shards), 1)
+        self.assertTrue(all(shard.endswith("\n") for shard in shards))
+        self.assertTrue(all(shard.startswith("line ") for shard in shards))
+        self.assertTrue(any("line 150\n" in shard for shard in shards))
+
+
+class TestMLConfidence(unittest.TestCase):
+    """Test cases for ML confidence estimation"""
+    
+    def test_logprobs_drive_confidence(self):
+        """Test that confident tokens score higher than uncertain ones"""
+        sure = MLErrorProcessor.estimate_confidence("Fix: retry", {"logprobs": [-0.05, -0.1]})
+        unsure = MLErrorProcessor.estimate_confidence("Fix: retry", {"logprobs": [-2.0, -3.0]})
+        self.assertGreater(sure, 0.85)
+        self.assertLess(unsure, 0.2)
+    
+    def test_agreement_with_rule_based(self):
+        """Test that agreeing with the rule-based type raises confidence"""
+        text = "ModuleNotFoundError: run pip install requests"
+        agree = MLErrorProcessor.estimate_confidence(text, {}, "Module or Package Not Found")
+        disagree = MLErrorProcessor.estimate_confidence(text, {}, "Disk Space Error")
+        neutral = MLErrorProcessor.estimate_confidence(text, {})
+        self.assertGreater(agree, neutral)
+        self.assertLess(disagree, neutral)
+    
+    def test_truncated_or_empty_answers(self):
+        """Test that truncated and empty generations are penalized"""
+        full = MLErrorProcessor.estimate_confidence("Fix: retry", {"done_reason": "stop"})
+        cut = MLErrorProcessor.estimate_confidence("Fix: retry", {"done_reason": "length"})
+        self.assertLess(cut, full)
+        self.assertEqual(MLErrorProcessor.estimate_confidence("", {}), 0.0)
+        self.assertEqual(MLErrorProcessor.estimate_confidence("x", {"eval_count": 0}), 0.0)
+
+
+class TestRealTimeDisplay(unittest.TestCase):
+    """Test cases for the buffered suggestion renderer"""
+    
+    def test_returns_full_text(self):
+        """Test that streamed chunks are written and returned intact"""
+        out = io.StringIO()
+        text = RealTimeDisplay(out).stream_display(["Fix: ", "pip install ", "requests\nDone"])
+        self.assertEqual(text, "Fix: pip install requests\nDone")
+        self.assertEqual(out.getvalue(), "Fix: pip install requests\nDone\n")
+    
+    def test_respects_max_output_lines(self):
+        """Test that rendering stops after max_output_lines"""
+        out = io.StringIO()
+        max_lines = DISPLAY_CONFIG["max_output_lines"]
+        chunks = [f"line {i}\n" for i in range(max_lines * 2)]
+        text = RealTimeDisplay(out).stream_display(chunks)
+        self.assertEqual(text, "".join(chunks))
+        self.assertIn("output truncated", out.getvalue())
+        self.assertNotIn(f"line {max_lines}\n", out.getvalue())
+        self.assertIn(f"line {max_lines - 1}\n", out.getvalue())
+
+
+class TestMachineReadableOutput(unittest.TestCase):
+    """Test cases for JSON and NDJSON output"""
+    
+    def test_cli_json(self):
+        """Test that --format json emits one parseable result"""
+        out = io.StringIO()
+        with redirect_stdout(out):
+            cli_main(["--format", "json", "Access", "is", "denied"])
+        result = json.loads(out.getvalue())
+        self.assertEqual(result["error_type"], "Permission Denied")
+        self.assertEqual(result["method"], "Rule-Based")
+        self.assertIn("analysis_ms", result["timings"])
+    
+    def test_cli_ndjson_events(self):
+        """Test that --format ndjson emits classification then final events"""
+        out = io.StringIO()
+        with redirect_stdout(out):
+            cli_main(["--format", "ndjson", "disk", "full"])
+        events = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([e["event"] for e in events], ["classification", "final"])
+        self.assertEqual(events[-1]["analysis"]["error_type"], "Disk Space Error")
+    
+    def test_ml_cli_final_event_matches_cli(self):
+        """Test that ml_cli.py's final event carries the result under analysis too"""
+        out = io.StringIO()
+        with mock.patch.object(ml_cli, "MLErrorProcessor") as processor, redirect_stdout(out):
+            processor.return_value.process_error.return_value = {"error_type": "Disk Space Error"}
+            command = f'"{sys.executable}" -c "import sys; sys.exit(\'disk full\')"'
+            ml_cli.EnhancedCLI(output_format="ndjson").run_command_with_analysis(command)
+        final = json.loads(out.getvalue().splitlines()[-1])
+        self.assertEqual(final["event"], "final")
+        self.assertEqual(final["analysis"]["error_type"], "Disk Space Error")
+    
+    def test_cli_strips_option_terminator(self):
+        """Test that a leading -- is not analyzed as part of the message"""
+        out = io.StringIO()
+        with redirect_stdout(out):
+            cli_main(["--format", "json", "--", "Access", "is", "denied"])
+        self.assertEqual(json.loads(out.getvalue())["original_message"], "Access is denied")
+    
+    def test_ml_cli_strips_option_terminator(self):
+        """Test that a leading -- is not run as part of the command"""
+        with mock.patch.object(ml_cli, "EnhancedCLI") as enhanced, \
+                mock.patch.object(ml_cli.OllamaManager, "is_running", return_value=True), \
+                mock.patch.object(ml_cli.metrics, "write_metrics"):
+            enhanced.return_value.run_command_with_analysis.return_value = 0
+            self.assertEqual(ml_cli.main(["--format", "json", "--", "ls", "-la"]), 0)
+        enhanced.return_value.run_command_with_analysis.assert_called_once_with("ls -la")
+    
+    def test_event_writer_one_line_per_event(self):
+        """Test that multi-line payloads stay on a single NDJSON line"""
+        out = io.StringIO()
+        EventWriter(out).emit("chunk", text="line 1\nline 2\n")
+        self.assertEqual(out.getvalue().count("\n"), 1)
+        self.assertEqual(json.loads(out.getvalue())["text"], "line 1\nline 2\n")
+
+
+class TestScanner(unittest.TestCase):
+    """Test cases for bulk log scanning"""
+    
+    LOG = (
+        "INFO starting build\n"
+        "ERROR: Connection refused\n"
+        "bash: foo: command not found\n"
+        "INFO retrying\n"
+        "ERROR: Connection refused\n"
+    )
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.plain = os.path.join(self.tmpdir.name, "build.log")
+        self.packed = os.path.join(self.tmpdir.name, "build.log.gz")
+        with open(self.plain, "w") as f:
+            f.write(self.LOG)
+        with gzip.open(self.packed, "wt") as f:
+            f.write(self.LOG)
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def test_classify_matches_find_error_type(self):
+        """Test that the scanner agrees with find_error_type"""
+        for message in ["ModuleNotFoundError: x", "Permission denied (publickey)",
+                        "'foo' is not recognized as an internal or external command",
+                        "nothing to see here"]:
+            self.assertEqual(classify(message.lower().encode()), find_error_type_id(message))
+    
+    def test_scan_plain_and_gzip(self):
+        """Test that plain and gzip files are scanned and aggregated"""
+        summary = scan_paths([self.tmpdir.name], jobs=1)
+        self.assertEqual(summary["files"], 2)
+        self.assertEqual(summary["records"], 10)
+        self.assertEqual(summary["error_types"]["Network Connection Error"]["count"], 4)
+        self.assertEqual(summary["error_types"]["Command Not Found"]["count"], 2)
+        self.assertEqual(summary["failed"], [])
+    
+    def test_record_boundaries(self):
+        """Test that continuation lines are grouped with their record"""
+        lines = [b"ERROR one\n", b"  detail\n", b"ERROR two\n", b"INFO ok\n"]
+        records = list(iter_records(lines, r"ERROR|INFO"))
+        self.assertEqual(records, [b"ERROR one\n  detail\n", b"ERROR two\n", b"INFO ok\n"])
+    
+    def test_ndjson_file_events_use_names(self):
+        """Test that per-file events are keyed by error-type name, not ID"""
+        out = io.StringIO()
+        with redirect_stdout(out):
+            cli_main(["scan", "--format", "ndjson", "--jobs", "1", self.plain])
+        events = [json.loads(line) for line in out.getvalue().splitlines()]
+        file_event = next(e for e in events if e["event"] == "file")
+        self.assertEqual(file_event["counts"], {"Network Connection Error": 2, "Command Not Found": 1})
+        self.assertEqual(set(file_event["samples"]), set(file_event["counts"]))
+
+
+class TestFollowMode(unittest.TestCase):
+    """Test cases for line-streaming classification"""
+    
+    def test_findings_with_context(self):
+        """Test that findings carry their line number and preceding lines"""
+        stream = io.BytesIO(b"compiling\nlinking\nld: disk full\ndone\n")
+        findings = list(iter_findings(stream, context_lines=1))
+        self.assertEqual(len(findings), 1)
+        self.assertEqual(findings[0]["line_number"], 3)
+        self.assertEqual(findings[0]["error_type"], "Disk Space Error")
+        self.assertEqual(findings[0]["context"], ["linking"])
+    
+    def test_repeats_suppressed_within_window(self):
+        """Test that a repeated error type is reported once per window"""
+        stream = io.BytesIO(b"Connection refused\n" * 10)
+        self.assertEqual(len(list(iter_findings(stream, repeat_window=5))), 2)
+    
+    def test_long_lines_are_split(self):
+        """Test that memory per line is bounded"""
+        stream = io.BytesIO(b"x" * 100 + b" command not found\n")
+        findings = list(iter_findings(stream, max_line_bytes=64))
+        self.assertEqual(findings[0]["line_number"], 2)
+
+
+class TestBenchmarkCompare(unittest.TestCase):
+    """Test cases for benchmark regression detection"""
+    
+    def test_detects_regressions_by_direction(self):
+        """Test that throughput drops and latency rises are both flagged"""
+        old = {"results": {"matcher": {"messages_per_s": 1000, "small_p50_us": 10, "messages": 5}}}
+        new = {"results": {"matcher": {"messages_per_s": 800, "small_p50_us": 15, "messages": 1}}}
+        regressions = compare(old, new, threshold=0.1)
+        self.assertEqual(len(regressions), 2)
+        self.assertEqual(compare(old, old, threshold=0.1), [])
+
+
+class TestInstrumentation(unittest.TestCase):
+    """Test cases for DEBUG["benchmark"] stage timings"""
+    
+    def setUp(self):
+        self.saved = dict(DEBUG)
+    
+    def tearDown(self):
+        DEBUG.clear()
+        DEBUG.update(self.saved)
+    
+    def test_disabled_by_default(self):
+        """Test that results carry no stage timings unless enabled"""
+        DEBUG["benchmark"] = False
+        self.assertNotIn("timings", ErrorAnalyzer.analyze("disk full"))
+    
+    def test_timings_attached_and_logged(self):
+        """Test that enabled timings reach the result and the NDJSON log"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            DEBUG["benchmark"] = True
+            DEBUG["log_file"] = os.path.join(tmpdir, "timings.ndjson")
+            result = ErrorAnalyzer.analyze("disk full")
+            self.assertIn("match_ms", result["timings"])
+            with open(DEBUG["log_file"]) as f:
+                record = json.loads(f.readline())
+            self.assertEqual(record["component"], "analyzer")
+            self.assertEqual(record["timings"]["input_bytes"], len("disk full"))
+    
+    def test_display_render_timings(self):
+        """Test that the renderer records its own stages"""
+        DEBUG["benchmark"] = True
+        display = RealTimeDisplay(io.StringIO())
+        display.stream_display(["a\n", "b\n"])
+        self.assertIn("render_ms", display.timer.timings)
+        self.assertEqual(display.timer.timings["chunks"], 2)
+
+
+class TestFakeOllamaServer(unittest.TestCase):
+    """Test cases for the ML path against the fake Ollama server"""
+    
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        for patcher in (
+            mock.patch.dict(REGISTRY_CONFIG, path=os.path.join(tmp.name, "models.json")),
+            mock.patch.dict(ADMISSION_CONFIG, lock_dir=os.path.join(tmp.name, "admission")),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    def client(self, server, **overrides):
+        """Build a client pointed at the fake server, sending one request per analysis"""
+        config = dict(OLLAMA_CONFIG, base_url=server.base_url, reuse_prefix=False)
+        config.update(overrides)
+        return OllamaClient(config)
+    
+    def test_stream_and_non_stream_generation(self):
+        """Test that both generate modes return the full response and stats"""
+        with FakeOllamaServer(response="Fix: pip install requests") as server:
+            client = self.client(server)
+            streamed = "".join(client.analyze_error_stream("No module named requests"))
+            self.assertEqual(streamed, "Fix: pip install requests")
+            self.assertEqual(client.last_stats["done_reason"], "stop")
+            self.assertEqual(client.analyze_error("No module named requests"), streamed)
+    
+    def test_first_token_delay_and_token_rate(self):
+        """Test that configured latency is observable by the client"""
+        with FakeOllamaServer(response="a b c d", tokens_per_s=40,
+                              first_token_delay=0.1) as server:
+            stream = self.client(server).analyze_error_stream("boom")
+            start = time.perf_counter()
+            next(stream)
+            first = time.perf_counter() - start
+            list(stream)
+            total = time.perf_counter() - start
+            self.assertGreaterEqual(first, 0.1)
+            self.assertGreaterEqual(total, 0.1 + 3 / 40)
+    
+    def test_injected_failures(self):
+        """Test error, dropped and hung generations"""
+        with FakeOllamaServer(failures=["error", "drop", "hang"], hang_seconds=1) as server:
+            client = self.client(server, timeout=0.3)
+            self.assertIsNone(client.analyze_error("boom"))
+            self.assertEqual("".join(client.analyze_error_stream("boom")), "Fix:")
+            self.assertIsNone(client.analyze_error("boom"))
+            self.assertEqual(len(server.requests_to("/api/generate")), 3)
+    
+    def test_default_replies_take_the_ml_path(self):
+        """Test that the default fake reply matches the requested format and is used"""
+        with FakeOllamaServer() as server, mock.patch.dict(HISTORY_CONFIG, enabled=False):
+            for output_format in ("schema", "json", "text"):
+                processor = MLErrorProcessor()
+                processor.ollama_client = self.client(server, output_format=output_format)
+                result = processor.process_error("ModuleNotFoundError: No module named 'requests'")
+                self.assertEqual(result["method"], "ML", output_format)
+                self.assertIn("pip install requests", "\n".join(result["suggestions"]))
+    
+    def test_prefix_context_reuse(self):
+        """Test that the system prompt is prefilled once and later sent as context"""
+        with FakeOllamaServer(response="Fix: pip install requests") as server:
+            full = self.client(server)
+            full.analyze_error("No module named requests")
+            for _ in range(2):
+                reused = self.client(server, reuse_prefix=True)
+                self.assertEqual(reused.analyze_error("No module named requests"),
+                                 "Fix: pip install requests")
+            bodies = [r["body"] for r in server.requests_to("/api/generate")]
+        
+        self.assertEqual(len(bodies), 4)
+        self.assertEqual(bodies[1]["options"], {"num_predict": 1, "num_ctx": OLLAMA_CONFIG["num_ctx"]})
+        for body in bodies[2:]:
+            self.assertNotIn("system", body)
+            self.assertEqual(body["context"], bodies[2]["context"])
+            self.assertNotIn(PROMPT_INSTRUCTIONS, body["prompt"])
+        self.assertLess(reused.last_stats["prompt_eval_count"], full.last_stats["prompt_eval_count"])
+    
+    def test_failed_prefill_backs_off(self):
+        """Test that a failed prefill is not repeated before every request"""
+        with FakeOllamaServer(response="Fix: pip install requests", failures=["error"]) as server, \
+                mock.patch.dict(OllamaClient._prefix_failures, clear=True):
+            for _ in range(3):
+                client = self.client(server, reuse_prefix=True, model="backoff-model")
+                self.assertEqual(client.analyze_error("No module named requests"),
+                                 "Fix: pip install requests")
+            bodies = [r["body"] for r in server.requests_to("/api/generate")]
+        self.assertEqual(len(bodies), 4)
+        self.assertEqual(bodies[0]["options"], {"num_predict": 1, "num_ctx": OLLAMA_CONFIG["num_ctx"]})
+        self.assertTrue(all("system" in body for body in bodies[1:]))
+    
+    def test_structured_reply_stops_early(self):
+        """Test that streaming stops once every required field has arrived"""
+        reply = ('{"error_type": "missing module", "fix_commands": ["pip install requests"], '
+                 '"explanation": "requests is not installed", "confidence": 0.8, '
+                 '"notes": "' + "more " * 40 + '"}')
+        with FakeOllamaServer(response=reply, tokens_per_s=100) as server:
+            client = self.client(server, output_format="schema")
+            start = time.perf_counter()
+            text = "".join(client.analyze_error_stream("No module named requests"))
+            elapsed = time.perf_counter() - start
+            body = server.requests_to("/api/generate")[0]["body"]
+        
+        self.assertEqual(body["format"], FIX_SCHEMA)
+        self.assertIn('"fix_commands"', body["prompt"])
+        self.assertTrue(client.last_stats["early_stop"])
+        self.assertLess(elapsed, 0.35)
+        self.assertNotIn("more", text)
+        self.assertEqual(client.last_structured["fix_commands"], ["pip install requests"])
+        self.assertEqual(client.last_structured["confidence"], 0.8)
+    
+    def test_generation_budget_and_stop_sequences(self):
+        """Test that num_predict and stop sequences follow max_suggestions"""
+        with FakeOllamaServer() as server, \
+                mock.patch.dict(PROMPT_SETTINGS, max_suggestions=2):
+            self.client(server, output_format="text", tokens_per_suggestion=40).analyze_error("x")
+            self.client(server, output_format="schema", num_predict=100).analyze_error("x")
+            text, schema = [r["body"] for r in server.requests_to("/api/generate")]
+        self.assertEqual(text["options"]["num_predict"], 64 + 2 * 40)
+        self.assertEqual(text["options"]["stop"], ["\n3.", "\n3)"])
+        self.assertIn("at most 2 fixes", text["prompt"])
+        self.assertEqual(schema["options"]["num_predict"], 100)
+        self.assertNotIn("stop", schema["options"])
+    
+    def test_model_parameters_sent_as_options(self):
+        """Test that temperature and num_ctx go in options, where Ollama reads them"""
+        with FakeOllamaServer() as server:
+            self.client(server, temperature=0.2, num_ctx=4096).analyze_error("x")
+            body = server.requests_to("/api/generate")[0]["body"]
+        self.assertEqual(body["options"]["temperature"], 0.2)
+        self.assertEqual(body["options"]["num_ctx"], 4096)
+        self.assertNotIn("temperature", body)
+        self.assertNotIn("num_ctx", body)
+    
+    def test_prose_reply_stops_after_enough_fixes(self):
+        """Test that the stream is closed once an item beyond max_suggestions starts"""
+        reply = "Try these:\n1. pip install requests\n2. pip show requests\n3. Also" + " more" * 40
+        # Without stop sequences, as with a server that ignores them
+        with FakeOllamaServer(response=reply, tokens_per_s=100) as server, \
+                mock.patch.dict(PROMPT_SETTINGS, max_suggestions=2), \
+                mock.patch.object(OllamaClient, "generation_options", return_value={}):
+            client = self.client(server, output_format="text")
+            start = time.perf_counter()
+            text = "".join(client.analyze_error_stream("No module named requests"))
+            elapsed = time.perf_counter() - start
+        self.assertTrue(client.last_stats["early_stop"])
+        self.assertLess(elapsed, 0.35)
+        self.assertEqual(text.strip(), "Try these:\n1. pip install requests\n2. pip show requests")
+    
+    def test_concurrency_limit(self):
+        """Test that max_concurrency queues extra generations"""
+        with FakeOllamaServer(response="a b", tokens_per_s=20, max_concurrency=1) as server:
+            threads = [threading.Thread(target=self.client(server).analyze_error, args=("x",))
+                       for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(server.peak_concurrency, 1)
+    
+    def test_pull_adds_model(self):
+        """Test that pulling a model makes it listed"""
+        with FakeOllamaServer() as server:
+            client = self.client(server)
+            self.assertNotIn("llama3", client.list_models())
+            self.assertTrue(client.pull_model("llama3"))
+            self.assertIn("llama3", client.list_models())
+    
+    def test_registry_answers_from_cache(self):
+        """Test that model checks and context lengths are fetched once per TTL"""
+        with FakeOllamaServer(models=["mistral"], context_length=8192) as server:
+            self.assertTrue(ModelRegistry(server.base_url).has_model("mistral"))
+            registry = ModelRegistry(server.base_url)
+            self.assertTrue(registry.has_model("mistral:latest"))
+            self.assertFalse(registry.has_model("llama3"))
+            self.assertEqual(registry.context_length("mistral"), 8192)
+            self.assertEqual(ModelRegistry(server.base_url).context_length("mistral"), 8192)
+            self.assertEqual(len(server.requests_to("/api/tags")), 1)
+            self.assertEqual(len(server.requests_to("/api/show")), 1)
+            
+            expired = ModelRegistry(server.base_url, ttl=0)
+            self.assertTrue(expired.has_model("mistral"))
+            self.assertEqual(len(server.requests_to("/api/tags")), 2)
+        # Offline, the stale list is still used
+        self.assertTrue(expired.has_model("mistral"))
+    
+    def test_background_pull_reports_progress(self):
+        """Test streaming pull progress and the registry update after it"""
+        progress = []
+        with FakeOllamaServer(pull_seconds=0.2, pull_steps=4, pull_size=400) as server:
+            registry = ModelRegistry(server.base_url)
+            self.assertFalse(registry.has_model("llama3"))
+            future = registry.pull_in_background(
+                "llama3", lambda status, done, total: progress.append(done)
+            )
+            self.assertTrue(future.result(timeout=5))
+            self.assertTrue(ModelRegistry(server.base_url).has_model("llama3"))
+        self.assertEqual(progress, [0, 100, 200, 300, 400, 0])
+
+
+class TestMetrics(unittest.TestCase):
+    """Test cases for Prometheus-style metrics"""
+    
+    def setUp(self):
+        for metric in metrics.REGISTRY:
+            metric.reset()
+    
+    def test_counters_merge_across_threads(self):
+        """Test that per-thread shards add up"""
+        def work():
+            for _ in range(1000):
+                metrics.ANALYSES.inc(method="ML")
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(metrics.ANALYSES.values()[("ML",)], 4000)
+    
+    def test_histogram_rendering(self):
+        """Test cumulative buckets, sum and count in the text format"""
+        metrics.OLLAMA_LATENCY.observe(0.3, mode="stream")
+        metrics.OLLAMA_LATENCY.observe(7.0, mode="stream")
+        text = metrics.render()
+        self.assertIn('cmdpro_ollama_request_seconds_bucket{mode="stream",le="0.5"} 1', text)
+        self.assertIn('cmdpro_ollama_request_seconds_bucket{mode="stream",le="+Inf"} 2', text)
+        self.assertIn('cmdpro_ollama_request_seconds_count{mode="stream"} 2', text)
+    
+    def test_ml_path_records_metrics(self):
+        """Test that the ML path counts requests, methods and error types"""
+        with FakeOllamaServer(response="Run: pip install requests") as server, \
+                mock.patch.dict(HISTORY_CONFIG, enabled=False):
+            processor = MLErrorProcessor()
+            processor.ollama_client = OllamaClient(
+                dict(OLLAMA_CONFIG, base_url=server.base_url, output_format="text")
+            )
+            processor.process_error("ModuleNotFoundError: No module named 'requests'")
+        self.assertEqual(metrics.ANALYSES.values()[("ML",)], 1)
+        self.assertEqual(metrics.ERROR_TYPES.values()[("Module or Package Not Found",)], 1)
+        self.assertEqual(metrics.OLLAMA_REQUESTS.values()[("stream", "ok")], 1)
+
+
+
+class TestStructuredOutput(unittest.TestCase):
+    """Test cases for structured ML replies"""
+    
+    def test_parser_validates_members_incrementally(self):
+        """Test split chunks, escaped quotes and fields of the wrong type"""
+        reply = ('Here: {"error_type": "a \\"quoted\\" name", "fix_commands": ["ls", 3], '
+                 '"explanation": "comma, and brace }", "confidence": 7, "extra": 1')
+        parser = StructuredFixParser()
+        done_at = next(i for i in range(0, len(reply), 5) if parser.feed(reply[i:i + 5]))
+        self.assertLess(done_at, len(reply) - 5)
+        self.assertEqual(parser.result(), {
+            "error_type": 'a "quoted" name',
+            "fix_commands": ["ls"],
+            "explanation": "comma, and brace }",
+            "confidence": 1.0,
+        })
+        self.assertIsNone(StructuredFixParser.parse('{"error_type": "x", "confidence": "high"}'))
+    
+    def test_fix_list_counts_numbered_items_only(self):
+        """Test that prose bullets are ignored and items keep their command lines"""
+        reply = ("- the module is missing\n1. Install it with pip:\n   pip install requests\n"
+                 "2. Or use your distro package:\n   sudo apt install python3-requests\n")
+        parser = FixListParser(3)
+        self.assertFalse(any(parser.feed(reply[i:i + 4]) for i in range(0, len(reply), 4)))
+        
+        parser = FixListParser(2)
+        chunks = [reply[i:i + 4] for i in range(0, len(reply), 4)] + ["3. Or", " vendor it"]
+        kept = ""
+        for chunk in chunks:
+            done = parser.feed(chunk)
+            kept += chunk[:len(chunk) - parser.excess] if done else chunk
+            if done:
+                break
+        self.assertEqual(kept, reply)
+        self.assertEqual(parser.suggestions, [
+            "1. Install it with pip:\npip install requests",
+            "2. Or use your distro package:\nsudo apt install python3-requests",
+        ])
+    
+    def test_processor_uses_structured_fields(self):
+        """Test that fix commands become the suggestions and unparseable replies fall back"""
+        reply = ('{"error_type": "missing module", "fix_commands": ["pip install requests", '
+                 '"pip show requests"], "explanation": "Not installed.", "confidence": 0.9}')
+        results = []
+        for response in (reply, "Run: pip install requests", reply[:60]):
+            with FakeOllamaServer(response=response) as server, \
+                    mock.patch.dict(HISTORY_CONFIG, enabled=False), \
+                    mock.patch.dict(DISPLAY_CONFIG, verbose=True), \
+                    redirect_stdout(io.StringIO()) as out:
+                processor = MLErrorProcessor()
+                processor.ollama_client = OllamaClient(dict(
+                    OLLAMA_CONFIG, base_url=server.base_url, output_format="schema", reuse_prefix=False
+                ))
+                results.append(processor.process_error("ModuleNotFoundError: No module named 'requests'"))
+            self.assertNotIn('"fix_commands"', out.getvalue())
+        
+        structured, prose, truncated = results
+        self.assertEqual(structured["method"], "ML")
+        self.assertEqual(structured["suggestions"], ["pip install requests", "pip show requests"])
+        for result in (prose, truncated):
+            self.assertEqual(result["method"], "Rule-Based")
+            self.assertEqual(result["error_type"], "Module or Package Not Found")
+            self.assertNotIn("explanation", result)
+
+
+class TestHistory(unittest.TestCase):
+    """Test cases for the analysis history store"""
+    
+    def setUp(self):
+        self.store = HistoryStore(":memory:")
+    
+    def test_fingerprint_ignores_volatile_details(self):
+        """Test that paths, line numbers and ports do not change the fingerprint"""
+        a = 'File "/tmp/a1/app.py", line 12\nConnectionRefusedError: port 8080'
+        b = 'File "/home/u/src/app.py", line 97\nConnectionRefusedError: port 5432'
+        self.assertEqual(fingerprint(a), fingerprint(b))
+        self.assertNotEqual(fingerprint(a), fingerprint("PermissionError: denied"))
+    
+    def test_lookup_prefers_resolved_fix(self):
+        """Test that the suggestion followed by a success wins"""
+        error = "ModuleNotFoundError: No module named 'requests'"
+        fp = fingerprint(error)
+        self.store.record(error, {"method": "ML", "ml_confidence": 0.9,
+                                  "suggestions": ["pip install requests"]}, command="python app.py")
+        self.store.mark_resolved("python app.py")
+        self.store.record(error, {"method": "ML", "ml_confidence": 0.9,
+                                  "suggestions": ["reinstall python"]}, command="python b.py")
+        self.assertEqual(self.store.lookup(fp)["suggestions"], ["pip install requests"])
+        self.assertIsNone(self.store.lookup(fp, min_confidence=0.95))
+        self.assertIsNone(self.store.lookup("unknown"))
+    
+    def test_processor_answers_from_history(self):
+        """Test that a recurring error skips the model"""
+        error = "ModuleNotFoundError: No module named 'requests'"
+        with FakeOllamaServer(response="Run: pip install requests") as server, \
+                mock.patch.dict(HISTORY_CONFIG, db_path=":memory:"):
+            processor = MLErrorProcessor()
+            processor.ollama_client = OllamaClient(
+                dict(OLLAMA_CONFIG, base_url=server.base_url, reuse_prefix=False, output_format="text")
+            )
+            first = processor.process_error(error, "python app.py", returncode=1)
+            second = processor.process_error(error, "python app.py", returncode=1)
+            generations = len(server.requests_to("/api/generate"))
+            returncodes = [record["returncode"] for record in processor.history.recent(10)]
+        self.assertEqual(returncodes, [1])
+        self.assertFalse(first["cache_hit"])
+        self.assertTrue(second["cache_hit"])
+        self.assertEqual(second["suggestions"], first["suggestions"])
+        self.assertEqual(generations, 1)
+    
+    def test_pruning_keeps_newest(self):
+        """Test that old records are dropped beyond max_records"""
+        with mock.patch.dict(HISTORY_CONFIG, max_records=3):
+            for i in range(5):
+                self.store.record(f"error {i}", {"method": "Rule-Based"}, command=f"cmd{i}")
+        commands = [r["command"] for r in self.store.recent(10)]
+        self.assertEqual(commands, ["cmd4", "cmd3", "cmd2"])
+
+
+
+class TestPatternLearning(unittest.TestCase):
+    """Test cases for promoting ML answers into rules"""
+    
+    def setUp(self):
+        self.store = HistoryStore(":memory:")
+        answer = {"method": "ML", "ml_confidence": 0.8,
+                  "suggestions": ["1. Renew the token: gh auth login\n2. Retry the push"]}
+        for path, code in [("/home/a/repo", 401), ("/srv/ci/build", 403), ("/tmp/x/y", 401)]:
+            self.store.record(f"cd {path}\nremote: fatal: token expired (http {code})", answer)
+        self.store.record("some one-off failure", answer)
+    
+    def test_propose_generalizes_cluster(self):
+        """Test that a frequent cluster yields a pattern matching its variants"""
+        proposals = propose(self.store, min_count=3)
+        self.assertEqual(len(proposals), 1)
+        proposal = proposals[0]
+        self.assertEqual(proposal["count"], 3)
+        self.assertEqual(proposal["solutions"], ["Renew the token: gh auth login", "Retry the push"])
+        self.assertRegex("remote: fatal: token expired (http 500)", proposal["patterns"][0])
+    
+    def test_approved_pack_is_loadable(self):
+        """Test that an applied proposal loads back as a knowledge-base entry"""
+        proposals = propose(self.store, min_count=3)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "learned.json")
+            self.assertEqual(write_pack(proposals, path), 1)
+            self.assertEqual(write_pack(proposals, path), 0)
+            entries = load_pattern_pack(path)
+        self.assertEqual([e["name"] for e in entries], [proposals[0]["name"]])
+        self.assertEqual(entries[0]["solutions"], proposals[0]["solutions"])
+    
+    def test_packs_load_on_request_only(self):
+        """Test that the learned pack joins the rules only when explicitly loaded"""
+        proposals = propose(self.store, min_count=3)
+        write_pack(proposals, config.LEARNED_PATTERNS_FILE)
+        self.addCleanup(os.remove, config.LEARNED_PATTERNS_FILE)
+        message = "remote: fatal: token expired (http 500)"
+        self.assertIsNone(find_error_type_id(message))
+        
+        saved = list(knowledge_base.ERROR_PATTERNS)
+        self.addCleanup(knowledge_base.compile_knowledge_base)
+        self.addCleanup(knowledge_base.ERROR_PATTERNS.__setitem__, slice(None), saved)
+        with mock.patch.object(knowledge_base, "_packs_loaded", False):
+            self.assertTrue(knowledge_base.load_configured_packs())
+            self.assertFalse(knowledge_base.load_configured_packs())
+        self.assertEqual(get_error_type(find_error_type_id(message)).name, proposals[0]["name"])
+    
+    def test_spawned_workers_get_loaded_packs(self):
+        """Test that worker processes started with spawn match the parent's pack entries"""
+        proposals = propose(self.store, min_count=3)
+        write_pack(proposals, config.LEARNED_PATTERNS_FILE)
+        self.addCleanup(os.remove, config.LEARNED_PATTERNS_FILE)
+        message = "remote: fatal: token expired (http 500)"
+        
+        saved = list(knowledge_base.ERROR_PATTERNS)
+        self.addCleanup(knowledge_base.compile_knowledge_base)
+        self.addCleanup(knowledge_base.ERROR_PATTERNS.__setitem__, slice(None), saved)
+        with mock.patch.object(knowledge_base, "_packs_loaded", False), \
+                mock.patch.object(knowledge_base, "_pack_entries", []):
+            knowledge_base.load_configured_packs()
+            expected = find_error_type_id(message)
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context,
+                                     **knowledge_base.worker_options()) as executor:
+                self.assertEqual(executor.submit(find_error_type_id, message).result(), expected)
+        self.assertIsNotNone(expected)
+
+
+
+class TestBatchMode(unittest.TestCase):
+    """Test cases for concurrent batch runs"""
+    
+    def test_failures_are_deduplicated(self):
+        """Test that identical failures share one analysis"""
+        calls = []
+        
+        class Processor:
+            def process_error(self, stderr, command_context="", returncode=None):
+                calls.append(command_context)
+                return {"success": True, "method": "Rule-Based", "error_type": "X",
+                        "suggestions": ["fix it"]}
+        
+        fail = f'"{sys.executable}" -c "import sys; sys.exit(\'boom at line {{}}\')"'
+        commands = [fail.format(1), f'"{sys.executable}" -c "pass"', fail.format(2), fail.format(3)]
+        report = BatchRunner(Processor, jobs=4, analysis_workers=2).run(commands)
+        
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(report["summary"]["failed"], 3)
+        self.assertEqual(report["summary"]["unique_errors"], 1)
+        self.assertEqual([entry["index"] for entry in report["results"]], [0, 1, 2, 3])
+        failed = [entry for entry in report["results"] if entry["returncode"]]
+        self.assertTrue(all(entry["analysis"]["suggestions"] == ["fix it"] for entry in failed))
+        self.assertEqual(sum("duplicate_of" in entry for entry in failed), 2)
+    
+    def test_failing_processor_does_not_stall_runners(self):
+        """Test that analysis errors are recorded while the bounded queue keeps draining"""
+        class Processor:
+            def process_error(self, stderr, command_context="", returncode=None):
+                raise RuntimeError("model crashed")
+        
+        def broken_factory():
+            raise RuntimeError("no processor")
+        
+        fail = f'"{sys.executable}" -c "import sys; sys.exit(\'{{}} failed\')"'
+        commands = [fail.format(word) for word in ("alpha", "beta", "gamma", "delta", "epsilon")]
+        for factory, message in ((Processor, "model crashed"), (broken_factory, "no processor")):
+            reports = []
+            runner = BatchRunner(factory, jobs=5, analysis_workers=1, queue_size=1)
+            thread = threading.Thread(target=lambda: reports.append(runner.run(commands)), daemon=True)
+            thread.start()
+            thread.join(30)
+            self.assertFalse(thread.is_alive())
+            self.assertEqual(reports[0]["summary"]["unique_errors"], 5)
+            self.assertTrue(all(entry["analysis"]["error"] == message
+                                for entry in reports[0]["results"]))
+
+
+
+class TestAsyncCommandWrapper(unittest.TestCase):
+    """Test cases for the asyncio command wrapper"""
+    
+    def script(self, code):
+        return f'"{sys.executable}" -c "{code}"'
+    
+    def test_capture_with_async_callback(self):
+        """Test that both streams are captured and chunks reach a coroutine callback"""
+        chunks = []
+        
+        async def on_chunk(chunk):
+            chunks.append(chunk)
+        
+        command = self.script("import sys; print('out'); sys.stderr.write('x' * 60 + '\\n'); sys.exit(3)")
+        result = asyncio.run(AsyncCommandWrapper().run_with_capture(command, on_stderr_chunk=on_chunk))
+        self.assertEqual(result["returncode"], 3)
+        self.assertEqual(result["stdout"].strip(), "out")
+        self.assertEqual("".join(chunks), result["stderr"])
+        self.assertFalse(result["timed_out"])
+    
+    def test_timeout_kills_and_keeps_partial_output(self):
+        """Test that a hung command is killed and its earlier stderr kept"""
+        command = self.script("import sys, time; sys.stderr.write('started\\n'); "
+                              "sys.stderr.flush(); time.sleep(30)")
+        start = time.monotonic()
+        result = asyncio.run(AsyncCommandWrapper(timeout=1.0).run_with_capture(command))
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertTrue(result["timed_out"])
+        self.assertFalse(result["success"])
+        self.assertEqual(result["stderr"], "started\n")
+    
+    def test_run_many_preserves_order(self):
+        """Test that many commands run on one loop and results keep input order"""
+        commands = [self.script(f"import sys; sys.exit({i})") for i in range(6)]
+        results = asyncio.run(AsyncCommandWrapper().run_many(commands, concurrency=3))
+        self.assertEqual([r["returncode"] for r in results], list(range(6)))
+    
+    def test_long_carriage_return_output(self):
+        """Test that stderr without newlines beyond the stream limit is read and collapsed"""
+        command = self.script("import sys; sys.stderr.write('50%\\r' * 30000 + 'done\\n')")
+        result = asyncio.run(AsyncCommandWrapper(timeout=30).run_with_capture(command))
+        self.assertEqual(result["returncode"], 0)
+        self.assertEqual(result["stderr"], "done\n")
+
+
+
+class TestPtyCapture(unittest.TestCase):
+    """Test cases for pseudo-terminal capture"""
+    
+    def test_strip_ansi(self):
+        """Test that color, cursor and title sequences are removed"""
+        text = "\x1b[1;31mError\x1b[0m: \x1b]0;title\x07bad\x1b[2K input"
+        self.assertEqual(strip_ansi(text), "Error: bad input")
+    
+    @unittest.skipUnless(HAS_PTY, "pseudo-terminals need POSIX")
+    def test_command_sees_a_terminal(self):
+        """Test that colored stderr is streamed raw and returned plain"""
+        chunks = []
+        code = ("import sys; print('out', sys.stdout.isatty()); "
+                "sys.stderr.write('\\x1b[31mModuleNotFoundError\\x1b[0m: ' + str(sys.stderr.isatty()) + '\\n'); "
+                "sys.exit(1)")
+        result = CommandWrapper.run_with_capture(
+            f'"{sys.executable}" -c "{code}"', on_stderr_chunk=chunks.append, use_pty=True
+        )
+        self.assertTrue(result["pty"])
+        self.assertEqual(result["returncode"], 1)
+        self.assertEqual(result["stdout"], "out True\n")
+        self.assertEqual(result["stderr"], "ModuleNotFoundError: True\n")
+        self.assertIn("\x1b[31m", "".join(chunks))
+        self.assertEqual(ErrorAnalyzer.analyze(result["stderr"])["error_type"], "Module or Package Not Found")
+
+
+class TestOutputNormalizer(unittest.TestCase):
+    """Test cases for incremental output normalization"""
+    
+    def test_escapes_and_progress_bars_across_chunks(self):
+        """Test that split escapes are stripped and only a bar's final state is kept"""
+        normalizer = OutputNormalizer()
+        out = normalizer.feed(b"\x1b[3")
+        out += normalizer.feed(b"1merror\x1b[0m: failed\r\n 10%\r 55%")
+        self.assertEqual(out, "error: failed\n")
+        out += normalizer.feed(b"\r100%\r\ndone\x07")
+        out += normalizer.finish()
+        self.assertEqual(out, "error: failed\n100%\ndone")
+    
+    def test_sync_capture_of_long_progress_bar(self):
+        """Test that the pipe reader copes with redraws that never end a line"""
+        normalizer = OutputNormalizer()
+        for _ in range(1000):
+            normalizer.feed(b" 50%\r" * 100)
+        self.assertLess(len(normalizer._pending), 100)
+        command = f'"{sys.executable}" -c "import sys; sys.stderr.write(\'50%\\r\' * 30000 + \'done\\n\')"'
+        result = CommandWrapper.run_with_capture(command, use_pty=False)
+        self.assertEqual(result["stderr"], "done\n")
+    
+    def test_encoding_detection(self):
+        """Test BOM, UTF-16 and non-UTF-8 fallback decoding"""
+        self.assertEqual(OutputNormalizer().normalize("Fehler\n".encode("utf-16")), "Fehler\n")
+        self.assertEqual(OutputNormalizer().normalize("Fehler\n".encode("utf-16-le")), "Fehler\n")
+        normalizer = OutputNormalizer(fallback_encoding="cp1252")
+        self.assertEqual(normalizer.normalize(b"ok\nno such file: caf\xe9\n"), "ok\nno such file: caf\u00e9\n")
+        self.assertEqual(normalizer.encoding, "cp1252")
+    
+    def test_capture_pipeline_is_normalized(self):
+        """Test that wrapped commands return and stream plain text"""
+        chunks = []
+        code = "import sys; sys.stderr.write('\\x1b[31mError\\x1b[0m: ' + 'x' * 60 + '\\n'); sys.exit(1)"
+        result = CommandWrapper.run_with_capture(
+            f'"{sys.executable}" -c "{code}"', on_stderr_chunk=chunks.append, use_pty=False
+        )
+        self.assertEqual(result["stderr"], "Error: " + "x" * 60 + "\n")
+        self.assertEqual("".join(chunks), result["stderr"])
+
+
+
+class TestEnvironmentContext(unittest.TestCase):
+    """Test cases for the prompt context collector"""
+    
+    def test_command_binary(self):
+        """Test that assignments and wrappers are skipped"""
+        self.assertEqual(command_binary("sudo FOO=1 npm install x"), "npm")
+        self.assertEqual(command_binary("env -i ./run.sh"), "./run.sh")
+        self.assertIsNone(command_binary("FOO=1"))
+    
+    def test_exit_code_descriptions(self):
+        """Test that shell and signal exit codes are explained"""
+        self.assertEqual(describe_exit_code(127), "127 (command not found)")
+        self.assertEqual(describe_exit_code(137), "137 (killed by SIGKILL)")
+        self.assertEqual(describe_exit_code(1), "1")
+    
+    def test_slow_collectors_are_dropped(self):
+        """Test that collection never waits past its budget"""
+        with tempfile.TemporaryDirectory() as cwd, \
+                mock.patch.object(context, "_listing", side_effect=lambda _: time.sleep(2)):
+            start = time.monotonic()
+            facts = collect_context("nosuchprogram-xyz --flag", 127, cwd=cwd, budget=0.5)
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertNotIn("cwd", facts)
+        self.assertEqual(facts["exit_code"], "127 (command not found)")
+        self.assertEqual(facts["path"], "nosuchprogram-xyz -> not found")
+    
+    def test_hung_collector_does_not_block_exit(self):
+        """Test that the interpreter exits while a collector is still stuck"""
+        script = ("import time, context; context._listing = lambda cwd: time.sleep(60); "
+                  "print(sorted(context.collect_context('ls', budget=0.2)))")
+        start = time.monotonic()
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                                timeout=30, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertNotIn("'cwd'", result.stdout)
+        self.assertIn("'os'", result.stdout)
+    
+    def test_prompt_includes_environment(self):
+        """Test that the ML path sends the collected facts to the model"""
+        with FakeOllamaServer(response="Run: pip install requests") as server, \
+                mock.patch.dict(HISTORY_CONFIG, enabled=False):
+            processor = MLErrorProcessor()
+            processor.ollama_client = OllamaClient(dict(OLLAMA_CONFIG, base_url=server.base_url))
+            processor.process_error("No module named 'requests'", "python app.py", returncode=1)
+            prompt = server.requests_to("/api/generate")[-1]["body"]["prompt"]
+        self.assertIn("Environment:\nexit_code: 1\n", prompt)
+        self.assertIn("path: python -> ", prompt)
+
+
+class TestAdmissionControl(unittest.TestCase):
+    """Test cases for the machine-wide generation queue"""
+    
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.lock_dir = tmp.name
+        patcher = mock.patch.dict(ADMISSION_CONFIG, max_wait={"interactive": 0.3, "batch": 5.0})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def controller(self, **overrides):
+        """Each controller opens its own lock files, like a separate process"""
+        return AdmissionController(lock_dir=self.lock_dir, **overrides)
+    
+    def test_slot_limit_times_out(self):
+        """Test that a request waits for a held slot and is shed after its limit"""
+        with self.controller().admit() as first:
+            self.assertTrue(first.admitted)
+            with self.controller().admit() as second:
+                self.assertFalse(second.admitted)
+                self.assertEqual(second.reason, "timeout")
+                self.assertGreaterEqual(second.wait_s, 0.3)
+        with self.controller().admit() as third:
+            self.assertTrue(third.admitted)
+            self.assertEqual(self.controller().queue_depth(), 0)
+    
+    def test_deep_queue_sheds_immediately(self):
+        """Test that requests are shed without waiting when the queue is full"""
+        controller = self.controller(max_queue=1)
+        controller._enqueue((0, time.time_ns()))
+        start = time.monotonic()
+        with controller.admit("batch") as admission:
+            self.assertFalse(admission.admitted)
+            self.assertEqual(admission.reason, "queue_full")
+            self.assertEqual(admission.queue_depth, 1)
+        self.assertLess(time.monotonic() - start, 0.1)
+    
+    def test_interactive_served_before_batch(self):
+        """Test that an interactive request overtakes an earlier batch one"""
+        order = []
+        
+        def request(priority):
+            with self.controller().admit(priority) as admission:
+                if admission.admitted:
+                    order.append(priority)
+        
+        holder = self.controller().admit()
+        holder.__enter__()
+        batch = threading.Thread(target=request, args=("batch",))
+        batch.start()
+        while self.controller().queue_depth() < 1:
+            time.sleep(0.01)
+        interactive = threading.Thread(target=request, args=("interactive",))
+        interactive.start()
+        while self.controller().queue_depth() < 2:
+            time.sleep(0.01)
+        holder.__exit__(None, None, None)
+        batch.join()
+        interactive.join()
+        self.assertEqual(order, ["interactive", "batch"])
+    
+    def test_unusable_lock_directory_admits(self):
+        """Test that lock-file errors let the request through instead of raising"""
+        with mock.patch.object(AdmissionController, "_try_slots",
+                               side_effect=PermissionError("read-only")):
+            with self.controller().admit() as admission:
+                self.assertTrue(admission.admitted)
+                self.assertEqual(admission.reason, "lock_error")
+        self.assertEqual(self.controller().queue_depth(), 0)
+    
+    def test_busy_model_falls_back_to_rules(self):
+        """Test that a shed request is answered by the rule-based analyzer"""
+        with FakeOllamaServer(response="Run: pip install requests") as server, \
+                mock.patch.dict(HISTORY_CONFIG, enabled=False), \
+                mock.patch.dict(ADMISSION_CONFIG, lock_dir=self.lock_dir):
+            processor = MLErrorProcessor()
+            processor.ollama_client = OllamaClient(dict(OLLAMA_CONFIG, base_url=server.base_url))
+            with self.controller().admit():
+                result = processor.process_error("ModuleNotFoundError: No module named 'requests'")
+            self.assertEqual(server.requests_to("/api/generate"), [])
+        self.assertEqual(result["method"], "Rule-Based")
+        self.assertEqual(result["shed"], "timeout")
+        self.assertGreaterEqual(result["timings"]["queue_wait_ms"], 300)
 
 
 if __name__ == "__main__":